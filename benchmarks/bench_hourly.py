@@ -0,0 +1,113 @@
+"""
+Compares the single-pass `parse_hourly` with the former post-processing of
+the hourly data, which used `flip_list_of_dicts`, `convert_to_int`, `rename`,
+`save_del` and `time_to_datetime`.
+
+Usage::
+
+    $ python -m benchmarks.bench_hourly
+"""
+
+import argparse
+import re
+import sys
+import timeit
+import tracemalloc
+
+from weatheregg.weatheregg import (
+    convert_to_int,
+    flip_list_of_dicts,
+    parse_hourly,
+    parse_location_info,
+    rename,
+    save_del,
+    time_to_datetime
+)
+from weatheregg.tests.server import list_pages, read_page
+
+PATTERN = re.compile(r"var locationInfo = (?P<weather>.*);")
+
+
+def former_parse_hourly(hourly_data: list, tz=None) -> dict:
+    """
+    The post-processing of `parse_response` and `get_weather_for_location`
+    before `parse_hourly` was introduced.
+
+    :param hourly_data:
+    :param tz:
+    :return:
+    """
+    hourly_data = flip_list_of_dicts(hourly_data)
+    hourly_data['temp'] = convert_to_int(hourly_data['temp'])
+    rename(hourly_data, 'temp', 'temperature')
+    hourly_data['wind'] = convert_to_int(hourly_data['wind'])
+    rename(hourly_data, 'wind', 'wind_velocity')
+    hourly_data['cloud'] = convert_to_int(hourly_data['cloud'])
+    rename(hourly_data, 'cloud', 'cloudiness')
+    hourly_data['rain'] = convert_to_int(hourly_data['rain'])
+
+    rename(hourly_data, 'periodText', 'timestamp')
+
+    save_del(hourly_data, 'info')
+    save_del(hourly_data, 'icon')
+
+    hourly_data['timestamp'] = time_to_datetime(hourly_data['timestamp'], tz)
+    return hourly_data
+
+
+def allocations(func, *args) -> tuple:
+    """
+    Returns the peak memory and the memory retained by the result in bytes
+    and the number of memory blocks of the result.
+
+    :param func:
+    :param args:
+    :return:
+    """
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        retained, peak = tracemalloc.get_traced_memory()
+        blocks = sum(stat.count for stat in
+                     tracemalloc.take_snapshot().statistics('filename'))
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak, retained, blocks
+
+
+def main(args=None) -> None:
+    if args is None:
+        args = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(prog='bench_hourly')
+    parser.add_argument('-n', '--number', type=int, default=2000,
+                        help='Number of runs per page.')
+    args = parser.parse_args(args)
+
+    line = '{:<12} {:<8} {:>10} {:>10} {:>14} {:>8}'
+    print(line.format('page', 'parser', 'time [µs]', 'peak [kB]',
+                      'retained [kB]', 'blocks'))
+
+    for name in list_pages():
+        content = read_page(name).decode('utf-8')
+        hourly = parse_location_info(
+            PATTERN.search(content).group('weather'))['hourly']
+
+        for label, func in [('former', former_parse_hourly),
+                            ('single', parse_hourly)]:
+            t = min(timeit.repeat(lambda: func(hourly),
+                                  number=args.number, repeat=3))
+            peak, retained, blocks = allocations(func, hourly)
+            print(line.format(
+                name,
+                label,
+                '{:.1f}'.format(t / args.number * 1e6),
+                '{:.1f}'.format(peak / 1024),
+                '{:.1f}'.format(retained / 1024),
+                blocks
+            ))
+
+
+if __name__ == '__main__':
+    main()
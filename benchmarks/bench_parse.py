@@ -0,0 +1,71 @@
+"""
+Compares `parse_location_info` with the former `literal_eval` parsing of the
+`locationInfo` object on the recorded pages.
+
+Usage::
+
+    $ python -m benchmarks.bench_parse
+"""
+
+import argparse
+import re
+import sys
+import timeit
+import tracemalloc
+from ast import literal_eval
+
+from weatheregg.weatheregg import parse_location_info
+from weatheregg.tests.server import list_pages, read_page
+
+PATTERN = re.compile(r"var locationInfo = (?P<weather>.*);")
+
+
+def peak_memory(func, *args) -> int:
+    """
+    Returns the peak memory in bytes which is allocated by the function.
+
+    :param func:
+    :param args:
+    :return:
+    """
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main(args=None) -> None:
+    if args is None:
+        args = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(prog='bench_parse')
+    parser.add_argument('-n', '--number', type=int, default=200,
+                        help='Number of runs per page.')
+    args = parser.parse_args(args)
+
+    line = '{:<12} {:>14} {:>14} {:>8} {:>12} {:>12}'
+    print(line.format('page', 'literal [µs]', 'json [µs]', 'speedup',
+                      'literal [kB]', 'json [kB]'))
+
+    for name in list_pages():
+        text = PATTERN.search(read_page(name).decode('utf-8')).group('weather')
+
+        t_literal = min(timeit.repeat(lambda: literal_eval(text),
+                                      number=args.number, repeat=3))
+        t_json = min(timeit.repeat(lambda: parse_location_info(text),
+                                   number=args.number, repeat=3))
+
+        print(line.format(
+            name,
+            '{:.1f}'.format(t_literal / args.number * 1e6),
+            '{:.1f}'.format(t_json / args.number * 1e6),
+            '{:.1f}x'.format(t_literal / t_json),
+            '{:.1f}'.format(peak_memory(literal_eval, text) / 1024),
+            '{:.1f}'.format(peak_memory(parse_location_info, text) / 1024),
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,426 @@
+"""
+Measures the fetch → parse → save pipeline for 1, 100 and 10,000
+locations. The recorded pages are served by the stand-in server of the
+tests, so the results depend neither on wetter.at nor on the network.
+
+For every number of locations the latency percentiles and the throughput
+per core of every stage and the peak memory of a run are reported. The
+throughput per core is the number of locations per second of CPU time of
+the benchmark thread, so the stand-in server is not counted.
+The results are stored as json file per commit and two result files can be
+compared to find regressions.
+
+Usage::
+
+    $ python -m benchmarks.bench_pipeline run -l 1 100 10000
+    $ python -m benchmarks.bench_pipeline compare \\
+        benchmarks/results/1a2b3c4d5e6f.json \\
+        benchmarks/results/6f5e4d3c2b1a.json
+"""
+
+import argparse
+import collections
+import contextlib
+import datetime
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import typing as T
+from os import path
+
+import pytz
+
+from weatheregg.weatheregg import (
+    BACKLOG_FORMATS,
+    TimeContext,
+    get_response_for_location,
+    parse_response,
+    save,
+    save_data_to_csv,
+    time_to_datetime
+)
+from weatheregg.tests.server import list_pages, read_page, stand_in_server
+
+BENCHMARK_DIR = path.abspath(path.dirname(__file__))
+ROOT_DIR = path.dirname(BENCHMARK_DIR)
+RESULT_DIR = path.join(BENCHMARK_DIR, 'results')
+
+STAGES = ('fetch', 'parse', 'time', 'csv', 'save')
+LOCATIONS = (1, 100, 10000)
+PERCENTILES = (50, 90, 99)
+# small runs are repeated until every stage has this many samples
+MIN_SAMPLES = 100
+# relative change which is reported as regression
+THRESHOLD = 0.1
+
+COUNTRY = 'oesterreich'
+STATE = 'niederoesterreich'
+TIMEZONE = 'Europe/Vienna'
+
+
+class StageTimer:
+    """
+    Collects the latencies and the CPU time of the stages.
+    """
+
+    def __init__(self):
+        self.latencies = {stage: [] for stage in STAGES}
+        self.cpu = dict.fromkeys(STAGES, 0.)
+
+    @contextlib.contextmanager
+    def measure(self, stage: str):
+        cpu = time.thread_time()
+        start = time.perf_counter()
+        yield
+        self.latencies[stage].append(time.perf_counter() - start)
+        self.cpu[stage] += time.thread_time() - cpu
+
+
+def location_names(n: int) -> T.List[str]:
+    return ['ort-{}'.format(i) for i in range(n)]
+
+
+def run_pipeline(names: T.Sequence[str],
+                 directory: str,
+                 backlog: str = 'csv',
+                 tz: T.Union[datetime.tzinfo, None] = None,
+                 timer: T.Union[StageTimer, None] = None) -> None:
+    """
+    Fetches, parses and saves the forecasts of the locations one after
+    another, like a refresh of many locations.
+
+    :param names: locations which are served by the stand-in server
+    :param directory: the forecasts are saved to a directory per location
+    :param backlog: csv, segments or delta
+    :param tz:
+    :param timer: measures the stages, if given
+    :return:
+    """
+    if timer is not None:
+        measure = timer.measure
+    else:
+        def measure(stage):
+            return contextlib.nullcontext()
+
+    os.makedirs(directory, exist_ok=True)
+    context = TimeContext()
+    period_texts = None
+    for name in names:
+        with measure('fetch'):
+            response = get_response_for_location(COUNTRY, STATE, name)
+
+        with measure('parse'):
+            forecast = parse_response(response, tz=tz,
+                                      time_context=context)
+
+        if period_texts is None:
+            period_texts = [t.strftime('%H:%M')
+                            for t in forecast['timestamp']]
+        with measure('time'):
+            time_to_datetime(period_texts, tz=tz)
+
+        with measure('csv'):
+            save_data_to_csv(forecast, path.join(directory, name + '.csv'))
+
+        with measure('save'):
+            save(forecast, path.join(directory, name), tz=tz,
+                 backlog=backlog)
+
+
+def percentile(values: T.Sequence[float], q: float) -> float:
+    """
+    Returns the nearest-rank percentile of the sorted values.
+
+    :param values:
+    :param q: between 0 and 100
+    :return:
+    """
+    index = max(0, math.ceil(q / 100. * len(values)) - 1)
+    return values[index]
+
+
+def summarize(latencies: T.List[float], cpu: float) -> dict:
+    """
+    Returns the percentiles in ms and the throughput per core.
+
+    :param latencies: seconds
+    :param cpu: seconds of CPU time
+    :return:
+    """
+    values = sorted(latencies)
+    summary = {'p{}'.format(q): percentile(values, q) * 1e3
+               for q in PERCENTILES}
+    summary['max'] = values[-1] * 1e3
+    summary['per_core'] = len(values) / cpu if cpu > 0 else None
+    return summary
+
+
+def peak_memory(func, *args) -> int:
+    """
+    Returns the peak memory in bytes which is allocated by the function.
+
+    :param func:
+    :param args:
+    :return:
+    """
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark(n: int,
+              backlog: str = 'csv',
+              tz: T.Union[datetime.tzinfo, None] = None,
+              memory: bool = True) -> dict:
+    """
+    Runs the pipeline for n locations and returns the summary of every
+    stage, of the whole pipeline and the peak memory of a run.
+
+    :param n: number of locations
+    :param backlog:
+    :param tz:
+    :param memory: measure the peak memory in an additional run
+    :return:
+    """
+    names = location_names(n)
+    repeat = max(1, math.ceil(MIN_SAMPLES / n))
+    timer = StageTimer()
+
+    directory = tempfile.mkdtemp(prefix='weatheregg-bench-')
+    try:
+        # the first request opens the connection.
+        run_pipeline(names[:1], path.join(directory, 'warm-up'), backlog, tz)
+
+        start = time.perf_counter()
+        for i in range(repeat):
+            run_pipeline(names, path.join(directory, str(i)), backlog, tz,
+                         timer)
+        seconds = time.perf_counter() - start
+
+        totals = [sum(stage) for stage in zip(*(timer.latencies[stage]
+                                               for stage in STAGES))]
+        result = {
+            'locations': n,
+            'repeat': repeat,
+            'seconds': seconds,
+            'stages': {stage: summarize(timer.latencies[stage],
+                                        timer.cpu[stage])
+                       for stage in STAGES},
+            'total': summarize(totals, sum(timer.cpu.values())),
+            'peak_memory': None
+        }
+
+        if memory:
+            result['peak_memory'] = peak_memory(
+                run_pipeline, names, path.join(directory, 'memory'),
+                backlog, tz
+            )
+    finally:
+        shutil.rmtree(directory)
+    return result
+
+
+def git_commit() -> T.Tuple[str, bool]:
+    """
+    Returns the commit of the working tree and whether it has changes.
+
+    :return:
+    """
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR, check=True,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        ).stdout.decode('ascii').strip()
+        dirty = subprocess.run(
+            ['git', 'diff', '--quiet', 'HEAD'], cwd=ROOT_DIR,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        ).returncode != 0
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', True
+    return commit, dirty
+
+
+def result_path(directory: str, commit: str, dirty: bool) -> str:
+    name = commit[:12] + ('-dirty' if dirty else '')
+    return path.join(directory, name + '.json')
+
+
+def print_run(run: dict) -> None:
+    line = '{:<8} {:>9} {:>9} {:>9} {:>9} {:>14}'
+    print('{} locations, {} runs, {:.1f} s, peak memory {}'.format(
+        run['locations'], run['repeat'], run['seconds'],
+        '-' if run['peak_memory'] is None
+        else '{:.1f} kB'.format(run['peak_memory'] / 1024)
+    ))
+    print(line.format('stage', 'p50 [ms]', 'p90 [ms]', 'p99 [ms]',
+                      'max [ms]', 'per core [1/s]'))
+
+    rows = list(run['stages'].items()) + [('total', run['total'])]
+    for stage, summary in rows:
+        print(line.format(
+            stage,
+            *('{:.3f}'.format(summary[key])
+              for key in ('p50', 'p90', 'p99', 'max')),
+            '-' if summary['per_core'] is None
+            else '{:.0f}'.format(summary['per_core'])
+        ))
+    print()
+
+
+def compare(old: dict, new: dict, threshold: float = THRESHOLD) -> int:
+    """
+    Prints the change of the median latency, the throughput per core and
+    the peak memory between two results and returns the number of
+    regressions beyond the threshold.
+
+    :param old:
+    :param new:
+    :param threshold: relative change
+    :return:
+    """
+    line = '{:<10} {:<12} {:>11} {:>11} {:>8}  {}'
+    print(line.format('locations', 'stage', 'old', 'new', 'change', ''))
+
+    regressions = 0
+
+    def report(locations, stage, old_value, new_value, higher_is_better):
+        nonlocal regressions
+        if not old_value or new_value is None:
+            return
+        change = new_value / old_value - 1.
+        worse = -change if higher_is_better else change
+        flag = ''
+        if worse > threshold:
+            flag = 'REGRESSION'
+            regressions += 1
+        elif worse < -threshold:
+            flag = 'improvement'
+        print(line.format(locations, stage, '{:.3f}'.format(old_value),
+                          '{:.3f}'.format(new_value),
+                          '{:+.1%}'.format(change), flag))
+
+    for locations, new_run in new['runs'].items():
+        old_run = old['runs'].get(locations)
+        if old_run is None:
+            continue
+
+        old_summaries = dict(old_run['stages'], total=old_run['total'])
+        for stage, new_summary in new_run['stages'].items():
+            old_summary = old_summaries.get(stage)
+            if old_summary is None:
+                continue
+            report(locations, stage + ' p50', old_summary['p50'],
+                   new_summary['p50'], False)
+            report(locations, stage + ' /core', old_summary['per_core'],
+                   new_summary['per_core'], True)
+        report(locations, 'total p50', old_run['total']['p50'],
+               new_run['total']['p50'], False)
+        report(locations, 'total /core', old_run['total']['per_core'],
+               new_run['total']['per_core'], True)
+        report(locations, 'memory', old_run['peak_memory'],
+               new_run['peak_memory'], False)
+
+    return regressions
+
+
+def read_result(file_path: str) -> dict:
+    with open(file_path) as f:
+        return json.load(f)
+
+
+def main(args=None) -> None:
+    if args is None:
+        args = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(prog='bench_pipeline')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    run_parser = commands.add_parser('run', help='Runs the benchmark.')
+    run_parser.add_argument('-l', '--locations', type=int, nargs='+',
+                            default=LOCATIONS,
+                            help='Numbers of locations.')
+    run_parser.add_argument('-b', '--backlog', choices=BACKLOG_FORMATS,
+                            default='csv')
+    run_parser.add_argument('--no-memory', action='store_true',
+                            help='Skip the run which measures the peak '
+                                 'memory.')
+    run_parser.add_argument('-o', '--output', default=RESULT_DIR,
+                            help='Directory of the result files.')
+    run_parser.add_argument('-c', '--compare',
+                            help='Compare the results with this result '
+                                 'file.')
+
+    compare_parser = commands.add_parser(
+        'compare', help='Compares two result files.'
+    )
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+
+    for sub_parser in (run_parser, compare_parser):
+        sub_parser.add_argument('-t', '--threshold', type=float,
+                                default=THRESHOLD,
+                                help='Relative change which is reported '
+                                     'as regression.')
+
+    args = parser.parse_args(args)
+
+    if args.command == 'compare':
+        regressions = compare(read_result(args.old), read_result(args.new),
+                              args.threshold)
+        sys.exit(1 if regressions else 0)
+
+    tz = pytz.timezone(TIMEZONE)
+    names = list_pages()
+    commit, dirty = git_commit()
+    result = {
+        'commit': commit,
+        'dirty': dirty,
+        'date': datetime.datetime.now(tz=pytz.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'backlog': args.backlog,
+        'runs': {}
+    }
+
+    # the locations get the recorded pages in turn.
+    pages = {name: read_page(names[i % len(names)])
+             for i, name in enumerate(location_names(max(args.locations)))}
+    with stand_in_server(pages=pages) as server:
+        # the server runs in this process, so its request log would be
+        # counted as peak memory.
+        server.requests = collections.deque(maxlen=1)
+        server.headers = collections.deque(maxlen=1)
+
+        for n in args.locations:
+            run = benchmark(n, backlog=args.backlog, tz=tz,
+                            memory=not args.no_memory)
+            result['runs'][str(n)] = run
+            print_run(run)
+
+    os.makedirs(args.output, exist_ok=True)
+    file_path = result_path(args.output, commit, dirty)
+    with open(file_path, 'w') as f:
+        json.dump(result, f, indent=2)
+    print('Stored the results in {}'.format(file_path))
+
+    if args.compare:
+        print()
+        regressions = compare(read_result(args.compare), result,
+                              args.threshold)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -39,9 +39,16 @@ setup(
                       'pytest==3.6.3',
                       'lxml==4.2.3',
                       'pytz==2018.5'],
+    extras_require={'zstd': ['zstandard'], 'numpy': ['numpy']},
     entry_points={
               'console_scripts': [
                   'weatheregg-recorder = weatheregg.__main__:run_weatheregg',
+                  'weatheregg-multi-recorder = '
+                  'weatheregg.__main__:run_multi_recorder',
+                  'weatheregg-convert-backlog = '
+                  'weatheregg.__main__:run_convert_backlog',
+                  'weatheregg-compact = weatheregg.__main__:run_compact',
+                  'weatheregg-ingest = weatheregg.__main__:run_ingest',
                   'weatheregg-forecast = weatheregg.__main__:forecast',
                   'weatheregg = weatheregg.__main__:current_weather'
               ]
@@ -7,6 +7,8 @@ Furthermore it can record the data for later analysis.
 
 
 from weatheregg.weatheregg import WeatherEgg
+from weatheregg.forecast import Forecast
+from weatheregg.reader import BacklogReader
 
 from weatheregg.version import __version__
 
@@ -15,5 +17,5 @@ __author__ = "Sebastian Schaffer"
 __license__ = "MIT"
 __status__ = "Production"
 
-__all__ = ('WeatherEgg', )
+__all__ = ('WeatherEgg', 'Forecast', 'BacklogReader')
 
@@ -1,10 +1,13 @@
 import argparse
+import os
 import sys
 
 import pytz
 
 from weatheregg import WeatherEgg
+from weatheregg.cache import DiskCache
 from weatheregg.version import __version__ as version
+from weatheregg.weatheregg import BACKLOG_FORMATS, DATA_DIR_NAME
 
 
 HELP_MSG = "Country, state and location correspond to the information in " \
@@ -12,6 +15,147 @@ HELP_MSG = "Country, state and location correspond to the information in " \
            "http://www.wetter.at/wetter/oesterreich/" \
            "niederoesterreich/zwettl/prognose/48-stunden."
 
+CACHE_DIR_HELP = 'Directory where downloaded pages are cached for an ' \
+                 'hour, so repeated calls do not request wetter.at ' \
+                 'again. Defaults to the WEATHEREGG_CACHE_DIR environment ' \
+                 'variable. Without a directory nothing is cached.'
+
+BACKLOG_HELP = 'How the backlog is stored. csv writes one csv file per ' \
+               'update, segments appends the updates to one file per day ' \
+               'and delta only appends the changes since the last update.'
+
+FSYNC_HELP = 'Flush every saved file to the disk, so it survives a power ' \
+             'failure. This makes saving slower.'
+
+OFFSET_HELP = 'Minutes after the full interval at which the data is ' \
+              'updated, e. g. 5 updates at 5 minutes past every hour.'
+
+JITTER_HELP = 'Delay every update randomly by up to this many minutes.'
+
+COMPRESSION_HELP = 'Compress the csv files of the backlog. zstd requires ' \
+                   'the zstandard package.'
+
+
+def get_compression(compression):
+    """
+    Returns None for the compression 'none'.
+    """
+    return None if compression == 'none' else compression
+
+
+def get_backlog_dir(directory):
+    """
+    Returns the backlog directory of a data directory or the directory
+    itself.
+    """
+    back_log_dir = os.path.join(directory, DATA_DIR_NAME)
+    if os.path.isdir(back_log_dir):
+        return back_log_dir
+    return directory
+
+
+def add_retry_arguments(parser):
+    """
+    Adds the options of the retry policy to the parser.
+    """
+    from weatheregg.retry import BUDGET_RATIO, FAILURE_THRESHOLD, \
+        MAX_RETRY_INTERVAL, RETRY_INTERVAL
+
+    parser.add_argument('--retry-interval',
+                        type=float,
+                        default=RETRY_INTERVAL,
+                        help='Seconds until a failed request is retried. '
+                             'The interval doubles with every failure.')
+
+    parser.add_argument('--max-retry-interval',
+                        type=float,
+                        default=MAX_RETRY_INTERVAL,
+                        help='The maximum seconds until a failed request '
+                             'is retried.')
+
+    parser.add_argument('--failure-threshold',
+                        type=int,
+                        default=FAILURE_THRESHOLD,
+                        help='Pause all requests to wetter.at for a while '
+                             'after this many failures in a row.')
+
+    parser.add_argument('--retry-budget',
+                        type=float,
+                        default=BUDGET_RATIO,
+                        help='The maximum retries per update, e. g. 0.2 '
+                             'allows one retry for every 5 updates.')
+
+
+def get_retry_policy(args):
+    """
+    Returns the retry policy of the parsed arguments.
+    """
+    from weatheregg.retry import Backoff, RetryBudget, RetryPolicy
+
+    return RetryPolicy(
+        backoff=Backoff(base=args.retry_interval,
+                        max_delay=args.max_retry_interval),
+        budget=RetryBudget(ratio=args.retry_budget),
+        failure_threshold=args.failure_threshold
+    )
+
+
+def add_metrics_arguments(parser):
+    """
+    Adds the options of the metrics export to the parser.
+    """
+    parser.add_argument('--metrics-file',
+                        help='Write the metrics in the Prometheus text '
+                             'format to this file after every update, e. g. '
+                             'for the textfile collector of the node '
+                             'exporter.')
+
+    parser.add_argument('--metrics-port',
+                        type=int,
+                        help='Serve the metrics in the Prometheus text '
+                             'format at http://localhost:PORT/metrics.')
+
+    parser.add_argument('--metrics-address',
+                        default='127.0.0.1',
+                        help='The address of the metrics endpoint. Use '
+                             '0.0.0.0 to serve all interfaces.')
+
+
+def add_log_arguments(parser):
+    """
+    Adds the options of the logging to the parser.
+    """
+    parser.add_argument('--log-format',
+                        choices=('text', 'json'),
+                        default='text',
+                        help='json writes every log message as one json '
+                             'object per line, e. g. for a log collector.')
+
+
+def start_metrics_server(args):
+    """
+    Starts the metrics endpoint of the parsed arguments, if a port is given.
+    """
+    if args.metrics_port is None:
+        return None
+
+    from weatheregg.metrics import start_http_server
+    return start_http_server(args.metrics_port, args.metrics_address)
+
+
+def get_disk_cache(cache_dir=None):
+    """
+    Returns the disk cache for the directory or the WEATHEREGG_CACHE_DIR
+    environment variable. Returns None if neither is set.
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get('WEATHEREGG_CACHE_DIR')
+
+    if not cache_dir:
+        return None
+
+    return DiskCache(cache_dir)
+
 
 def forecast(args=None) -> None:
     """
@@ -45,6 +189,8 @@ def forecast(args=None) -> None:
                              'instead of plain csv.'
                         )
 
+    parser.add_argument('-c', '--cache-dir', help=CACHE_DIR_HELP)
+
     args = parser.parse_args(args)
 
     if args.timezone is not None:
@@ -56,7 +202,8 @@ def forecast(args=None) -> None:
         country=args.country,
         state=args.state,
         location=args.location,
-        tz=tz
+        tz=tz,
+        disk_cache=get_disk_cache(args.cache_dir)
     )
 
     weatheregg.print_weather(pretty_print=args.pretty_format)
@@ -81,12 +228,15 @@ def current_weather(args=None) -> None:
     parser.add_argument('state')
     parser.add_argument('location', help=HELP_MSG)
 
+    parser.add_argument('-c', '--cache-dir', help=CACHE_DIR_HELP)
+
     args = parser.parse_args(args)
 
     weatheregg = WeatherEgg(
         country=args.country,
         state=args.state,
         location=args.location,
+        disk_cache=get_disk_cache(args.cache_dir)
     )
 
     weather = weatheregg.current_weather()
@@ -103,6 +253,8 @@ def run_weatheregg(args=None):
     """
     This function start the weather record for the specified location.
     """
+    from weatheregg.compression import COMPRESSIONS
+    from weatheregg.log import configure_logging
 
     if args is None:
         args = sys.argv[1:]
@@ -136,14 +288,325 @@ def run_weatheregg(args=None):
                              'timezone if the location does not have your '
                              'local timezone')
 
+    parser.add_argument('-b', '--backlog',
+                        choices=BACKLOG_FORMATS,
+                        default='csv',
+                        help=BACKLOG_HELP)
+
+    parser.add_argument('--fsync',
+                        action='store_true',
+                        help=FSYNC_HELP)
+
+    parser.add_argument('-z', '--compression',
+                        choices=('none', ) + COMPRESSIONS,
+                        default='none',
+                        help=COMPRESSION_HELP)
+
+    parser.add_argument('--offset',
+                        type=float,
+                        default=0.,
+                        help=OFFSET_HELP)
+
+    parser.add_argument('--jitter',
+                        type=float,
+                        default=0.,
+                        help=JITTER_HELP)
+
+    add_retry_arguments(parser)
+    add_metrics_arguments(parser)
+    add_log_arguments(parser)
+
     args = parser.parse_args(args)
 
+    configure_logging(json_format=args.log_format == 'json')
+
     weatheregg = WeatherEgg(
         country=args.country,
         state=args.state,
         location=args.location,
         tz=args.timezone,
-        data_dir=args.directory
+        data_dir=args.directory,
+        interval=args.interval,
+        backlog=args.backlog,
+        fsync=args.fsync,
+        compression=get_compression(args.compression)
+    )
+
+    start_metrics_server(args)
+    weatheregg.run_forever(offset=args.offset, jitter=args.jitter,
+                           retry_policy=get_retry_policy(args),
+                           metrics_file=args.metrics_file)
+
+
+def run_multi_recorder(args=None):
+    """
+    This function starts the weather record for all locations in the
+    locations file from a single process.
+    """
+    from weatheregg.aio import CONCURRENCY
+    from weatheregg.compression import COMPRESSIONS
+    from weatheregg.log import configure_logging
+    from weatheregg.recorder import MultiRecorder, read_locations
+
+    if args is None:
+        args = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(
+        description='WeatherEgg-{}'.format(version),
+        prog='weatheregg-multi-recorder'
+    )
+
+    parser.add_argument(
+        'locations',
+        help='A csv file where every line contains country, state, '
+             'location and data directory. ' + HELP_MSG
     )
 
-    weatheregg.run_forever()
+    parser.add_argument(
+        '-i', '--interval',
+        type=int,
+        default=60,
+        help='In which intervals do you want to update the data?'
+             ' It must be bigger than 60 minutes.'
+    )
+
+    parser.add_argument('-t', '--timezone',
+                        help='E. g. Europe/Vienna. You need to specify the '
+                             'timezone if the locations do not have your '
+                             'local timezone')
+
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=CONCURRENCY,
+        help='How many locations are checked at the same time on start.'
+    )
+
+    parser.add_argument('-b', '--backlog',
+                        choices=BACKLOG_FORMATS,
+                        default='csv',
+                        help=BACKLOG_HELP)
+
+    parser.add_argument('--fsync',
+                        action='store_true',
+                        help=FSYNC_HELP)
+
+    parser.add_argument('-z', '--compression',
+                        choices=('none', ) + COMPRESSIONS,
+                        default='none',
+                        help=COMPRESSION_HELP)
+
+    parser.add_argument('--offset',
+                        type=float,
+                        default=0.,
+                        help=OFFSET_HELP)
+
+    parser.add_argument('--jitter',
+                        type=float,
+                        default=0.,
+                        help=JITTER_HELP)
+
+    add_retry_arguments(parser)
+    add_metrics_arguments(parser)
+    add_log_arguments(parser)
+
+    args = parser.parse_args(args)
+
+    configure_logging(json_format=args.log_format == 'json')
+
+    start_metrics_server(args)
+    recorder = MultiRecorder.from_locations(
+        read_locations(args.locations),
+        tz=args.timezone,
+        interval=args.interval,
+        concurrency=args.concurrency,
+        backlog=args.backlog,
+        fsync=args.fsync,
+        compression=get_compression(args.compression),
+        offset=args.offset,
+        jitter=args.jitter,
+        retry_policy=get_retry_policy(args),
+        metrics_file=args.metrics_file
+    )
+
+    recorder.run_forever()
+
+
+def run_convert_backlog(args=None):
+    """
+    This function converts the csv files of a backlog directory to another
+    compression.
+    """
+    from weatheregg.compression import COMPRESSIONS
+    from weatheregg.reader import convert_backlog
+
+    if args is None:
+        args = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(
+        description='WeatherEgg-{}'.format(version),
+        prog='weatheregg-convert-backlog'
+    )
+
+    parser.add_argument(
+        'directory',
+        help='The backlog directory or the data directory of a recorder.'
+    )
+
+    parser.add_argument('-z', '--compression',
+                        choices=('none', ) + COMPRESSIONS,
+                        default='gzip',
+                        help='The new compression of the csv files. '
+                             'none decompresses them.')
+
+    parser.add_argument('--fsync',
+                        action='store_true',
+                        help=FSYNC_HELP)
+
+    args = parser.parse_args(args)
+
+    directory = get_backlog_dir(args.directory)
+    count = convert_backlog(directory,
+                            get_compression(args.compression),
+                            fsync=args.fsync)
+    print('Converted {} files in {}.'.format(count, directory))
+
+
+def run_compact(args=None):
+    """
+    This function merges the snapshots of past days of a backlog directory
+    into one segment per day or month. It can run while a recorder writes
+    to the directory.
+    """
+    from weatheregg.backlog import KEYFRAME_INTERVAL
+    from weatheregg.compact import PERIODS, RetentionPolicy, compact_backlog
+
+    if args is None:
+        args = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(
+        description='WeatherEgg-{}'.format(version),
+        prog='weatheregg-compact'
+    )
+
+    parser.add_argument(
+        'directory',
+        help='The backlog directory or the data directory of a recorder.'
+    )
+
+    parser.add_argument('-p', '--period',
+                        choices=PERIODS,
+                        default='day',
+                        help='Merge the snapshots into one file per day or '
+                             'per month.')
+
+    parser.add_argument('-r', '--retention',
+                        type=RetentionPolicy.parse,
+                        help='Thin out old snapshots. E. g. 0d=1h,30d=6h '
+                             'keeps one snapshot per hour and one per 6 '
+                             'hours after 30 days. A spacing of drop '
+                             'removes the snapshots, e. g. 365d=drop. '
+                             'Without a policy every snapshot is kept.')
+
+    parser.add_argument('--delta',
+                        action='store_true',
+                        help='Only store the changes between the snapshots.')
+
+    args = parser.parse_args(args)
+
+    directory = get_backlog_dir(args.directory)
+    result = compact_backlog(
+        directory,
+        period=args.period,
+        retention=args.retention,
+        keyframe_interval=KEYFRAME_INTERVAL if args.delta else None
+    )
+    print('Compacted {} snapshots into {} in {} and removed {} files.'.format(
+        result.read, result.written, directory, result.removed
+    ))
+
+
+def run_ingest(args=None):
+    """
+    This function parses saved wetter.at pages in parallel and adds their
+    forecasts to the backlog of a data directory.
+    """
+    from weatheregg.compression import COMPRESSIONS
+    from weatheregg.ingest import CHUNK_SIZE, ingest, read_pages
+
+    if args is None:
+        args = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(
+        description='WeatherEgg-{}'.format(version),
+        prog='weatheregg-ingest'
+    )
+
+    parser.add_argument(
+        'pages',
+        nargs='+',
+        help='Page files or directories, e. g. the cache directory. The '
+             'modification time of a file is the time of its request.'
+    )
+
+    parser.add_argument('-d', '--directory',
+                        required=True,
+                        help='The data directory. The forecasts are added '
+                             'to its backlog.')
+
+    parser.add_argument('-t', '--timezone',
+                        help='E. g. Europe/Vienna. You need to specify the '
+                             'timezone if the locations do not have your '
+                             'local timezone')
+
+    parser.add_argument('-b', '--backlog',
+                        choices=BACKLOG_FORMATS,
+                        default='csv',
+                        help=BACKLOG_HELP)
+
+    parser.add_argument('--fsync',
+                        action='store_true',
+                        help=FSYNC_HELP)
+
+    parser.add_argument('-z', '--compression',
+                        choices=('none', ) + COMPRESSIONS,
+                        default='none',
+                        help=COMPRESSION_HELP)
+
+    parser.add_argument('-w', '--workers',
+                        type=int,
+                        help='Number of parsing processes. Defaults to the '
+                             'number of cores.')
+
+    parser.add_argument('--chunk-size',
+                        type=int,
+                        default=CHUNK_SIZE,
+                        help='Pages which are sent to a process at once.')
+
+    parser.add_argument('--unordered',
+                        action='store_true',
+                        help='Write the forecasts as soon as they are '
+                             'parsed. Only use it with the csv backlog.')
+
+    args = parser.parse_args(args)
+
+    tz = pytz.timezone(args.timezone) if args.timezone else None
+    back_log_dir = os.path.join(args.directory, DATA_DIR_NAME)
+
+    def on_error(result):
+        print('Could not parse {}: {}'.format(result.key, result.error),
+              file=sys.stderr)
+
+    result = ingest(read_pages(args.pages, tz=tz),
+                    back_log_dir,
+                    backlog=args.backlog,
+                    fsync=args.fsync,
+                    compression=get_compression(args.compression),
+                    workers=args.workers,
+                    chunk_size=args.chunk_size,
+                    ordered=not args.unordered,
+                    tz=tz,
+                    on_error=on_error)
+    print('Ingested {} pages into {}. {} pages failed.'.format(
+        result.parsed, back_log_dir, result.failed
+    ))
@@ -0,0 +1,225 @@
+"""
+This file contains the asynchronous fetch engine.
+It requests the 48 hours forecast for many locations concurrently and
+returns the forecasts in the order in which they are completed.
+"""
+
+import asyncio
+import datetime
+import time
+import typing as T
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import urlsplit
+
+import requests
+
+from weatheregg.forecast import Forecast
+from weatheregg.weatheregg import TimeContext, WeatherEgg, \
+    get_url_for_location, get_weather_for_location
+
+Location = T.Tuple[str, str, str]
+Job = T.Tuple[T.Hashable, T.Union[str, None], T.Callable[[], T.Any]]
+
+CONCURRENCY = 10
+
+
+class RateLimiter:
+    """
+    Limits the number of requests per second for every host.
+    """
+
+    def __init__(self, rate: float):
+        if rate <= 0:
+            msg = 'The rate limit must be bigger than 0. Got {}.'
+            raise ValueError(msg.format(rate))
+
+        self._interval = 1. / rate
+        # host -> monotonic time of the next free slot
+        self._next_slot = {}  # type: T.Dict[str, float]
+
+    async def wait(self, host: str) -> None:
+        """
+        Waits until the next request to the host is allowed.
+
+        :param host:
+        :return:
+        """
+        now = time.monotonic()
+        slot = max(now, self._next_slot.get(host, now))
+        self._next_slot[host] = slot + self._interval
+        await asyncio.sleep(slot - now)
+
+
+async def iter_completed(
+        jobs: T.Iterable[Job],
+        concurrency: int = CONCURRENCY,
+        rate_limit: T.Union[float, None] = None
+) -> T.AsyncIterator[T.Tuple[T.Hashable, T.Any]]:
+    """
+    Runs blocking requests in a thread pool. Every job is a tuple of a key,
+    the requested url and a function without arguments which does the
+    request. Yields a tuple of the key and the result of the function as
+    soon as it is completed. If the function raises, the exception is
+    yielded instead of the result.
+
+    :param jobs: tuples of key, url and function
+    :param concurrency: maximum number of requests at the same time
+    :param rate_limit: maximum number of requests per second and host
+    :return:
+    """
+    if concurrency < 1:
+        msg = 'Concurrency must be at least 1. Got {}.'
+        raise ValueError(msg.format(concurrency))
+
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(rate_limit) if rate_limit is not None else None
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def run(key: T.Hashable,
+                  url: T.Union[str, None],
+                  function: T.Callable[[], T.Any]):
+        async with semaphore:
+            try:
+                if limiter is not None and url is not None:
+                    await limiter.wait(urlsplit(url).netloc)
+
+                result = await loop.run_in_executor(executor, function)
+            except Exception as error:
+                result = error
+
+        return key, result
+
+    tasks = [asyncio.ensure_future(run(*job)) for job in jobs]
+    try:
+        for future in asyncio.as_completed(tasks):
+            yield await future
+    finally:
+        # cancelling the tasks cancels the requests which have not started.
+        # Waiting for the running requests would block the event loop, if
+        # the consumer stops early, so the threads finish them on their own.
+        for task in tasks:
+            task.cancel()
+        executor.shutdown(wait=False)
+
+
+async def iter_weather_for_locations(
+        locations: T.Iterable[Location],
+        tz: T.Union[datetime.tzinfo, None] = None,
+        concurrency: int = CONCURRENCY,
+        rate_limit: T.Union[float, None] = None,
+        session: T.Union[requests.Session, None] = None,
+        time_context: T.Union[TimeContext, None] = None
+) -> T.AsyncIterator[T.Tuple[Location, T.Union[Forecast, Exception]]]:
+    """
+    Asynchronous counterpart of `get_weather_for_location` for many
+    locations. Yields a tuple of the location and its forecast as soon as
+    the forecast is completed. If the request or parsing fails, the
+    exception is yielded instead of the forecast.
+    The requests share the connection pool of the session, so its pool
+    size should not be smaller than the concurrency.
+
+    Usage::
+        >>> async for location, weather in iter_weather_for_locations(
+        ...         [('oesterreich', 'wien', 'wien')],
+        ...         concurrency=4,
+        ...         rate_limit=2.
+        ... ):  # doctest: +SKIP
+        ...     print(location, weather['temperature'])
+
+    :param locations: tuples of country, state and location
+    :param tz:
+    :param concurrency: maximum number of requests at the same time
+    :param rate_limit: maximum number of requests per second and host
+    :param session: defaults to the shared session
+    :param time_context: the time of the batch, defaults to now
+    :return:
+    """
+    if time_context is None:
+        time_context = TimeContext()
+
+    jobs = []
+    for location in locations:
+        country, state, name = location
+        try:
+            url = get_url_for_location(country, state, name)
+        except TypeError:
+            # the request fails with the same error.
+            url = None
+        jobs.append((tuple(location), url,
+                     partial(get_weather_for_location, country, state, name,
+                             tz=tz, session=session,
+                             time_context=time_context)))
+
+    results = iter_completed(jobs, concurrency, rate_limit)
+    try:
+        async for result in results:
+            yield result
+    finally:
+        # cancels the pending requests right away, if the consumer stops.
+        await results.aclose()
+
+
+def get_weather_for_locations(
+        locations: T.Iterable[Location],
+        tz: T.Union[datetime.tzinfo, None] = None,
+        concurrency: int = CONCURRENCY,
+        rate_limit: T.Union[float, None] = None,
+        session: T.Union[requests.Session, None] = None,
+        time_context: T.Union[TimeContext, None] = None
+) -> T.List[T.Tuple[Location, T.Union[Forecast, Exception]]]:
+    """
+    Fetches the forecasts for all locations concurrently and returns them
+    in completion order. See `iter_weather_for_locations`.
+
+    :param locations: tuples of country, state and location
+    :param tz:
+    :param concurrency: maximum number of requests at the same time
+    :param rate_limit: maximum number of requests per second and host
+    :param session: defaults to the shared session
+    :param time_context: the time of the batch, defaults to now
+    :return:
+    """
+    async def collect():
+        return [result async for result in iter_weather_for_locations(
+            locations, tz=tz, concurrency=concurrency,
+            rate_limit=rate_limit, session=session,
+            time_context=time_context
+        )]
+
+    return asyncio.run(collect())
+
+
+def validate_weathereggs(
+        weathereggs: T.Iterable[WeatherEgg],
+        concurrency: int = CONCURRENCY,
+        rate_limit: T.Union[float, None] = None
+) -> T.List[T.Tuple[WeatherEgg, Exception]]:
+    """
+    Checks the locations of many WeatherEggs concurrently, see
+    `WeatherEgg.validate`. The WeatherEggs should be created with
+    `validate='lazy'`. Their first update returns the forecast of the check
+    without requesting the page again.
+    Returns the WeatherEggs whose check failed together with the error in
+    completion order.
+
+    :param weathereggs:
+    :param concurrency: maximum number of requests at the same time
+    :param rate_limit: maximum number of requests per second and host
+    :return:
+    """
+    weathereggs = list(weathereggs)
+    time_context = TimeContext()
+    jobs = [(i, weatheregg.url,
+             partial(weatheregg.validate, time_context=time_context))
+            for i, weatheregg in enumerate(weathereggs)]
+
+    async def collect():
+        return [(weathereggs[i], result)
+                async for i, result in iter_completed(jobs, concurrency,
+                                                      rate_limit)
+                if isinstance(result, Exception)]
+
+    return asyncio.run(collect())
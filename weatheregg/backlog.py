@@ -0,0 +1,795 @@
+"""
+This file contains the SegmentStore.
+The SegmentStore keeps the backlog of a location in one binary segment file
+per day instead of one csv file per update. The snapshots of the current
+day are appended to a write-ahead file. Older days are compacted into a
+sealed segment with an index, so they are read without scanning.
+
+Every snapshot is stored as a header followed by its body::
+
+    magic | fetched | start | step | hours | flags | size | body
+
+`fetched` and `start` are the wall clock times in seconds since 1970-01-01,
+`step` is the number of seconds between two forecast hours and `size` is
+the length of the body in bytes.
+The body of a keyframe contains the four columns as little-endian 32 bit
+integers. The body of a delta contains a bit mask of the changed hours for
+every column followed by the changed values. The hours are compared with
+the same hours of the previous snapshot in the file, so a delta only
+stores the values which changed since the last update. Every file starts
+with a keyframe.
+
+A sealed segment ends with the index entries of its snapshots and a
+footer::
+
+    snapshots | index entries | index offset | count | magic
+
+"""
+
+import array
+import bisect
+import contextlib
+import datetime
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+import typing as T
+from pathlib import PurePath
+
+from weatheregg.forecast import COLUMNS, TYPECODE, Forecast, Timestamps
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # e. g. on Windows the compactions are not locked.
+    fcntl = None
+
+MAGIC = b'WEGG'
+
+# magic, fetched, start, step, hours, flags, size of the body
+RECORD = struct.Struct('<4sqqIHHI')
+# fetched, start, step, hours, offset, size of the body, keyframe offset
+INDEX_ENTRY = struct.Struct('<qqIHQIQ')
+# index offset, count, magic
+FOOTER = struct.Struct('<QI4s')
+
+EPOCH = datetime.datetime(1970, 1, 1)
+SECOND = datetime.timedelta(seconds=1)
+
+# the body of the record contains the changes against the previous one.
+FLAG_DELTA = 1
+
+# a keyframe every 24 snapshots, i. e. every day with hourly updates.
+KEYFRAME_INTERVAL = 24
+
+DAY_PATTERN = '{0:%Y_%m_%d}'
+MONTH_PATTERN = '{0:%Y_%m}'
+# matches days and months, see weatheregg.compact
+DAY_REGEX = re.compile(r'^(\d{4})_(\d{2})(?:_(\d{2}))?$')
+
+LOCK_FILE_NAME = '.lock'
+
+
+class SegmentError(Exception):
+    pass
+
+
+class Snapshot(T.NamedTuple):
+    fetched: datetime.datetime
+    forecast: Forecast
+
+
+class IndexEntry(T.NamedTuple):
+    fetched: int
+    start: int
+    hours: int
+    step: int
+    path: str
+    offset: int
+    size: int
+    keyframe: int  # offset of the keyframe the record depends on
+
+    @property
+    def end(self) -> int:
+        return self.offset + RECORD.size + self.size
+
+    def covers(self, hour: int) -> bool:
+        """
+        Returns if the forecast contains the hour.
+
+        :param hour: wall clock time in seconds
+        :return:
+        """
+        end = self.start + self.hours * self.step
+        return self.start <= hour < end and \
+            (hour - self.start) % self.step == 0
+
+
+def to_seconds(t: datetime.datetime) -> int:
+    """
+    Returns the wall clock time in seconds since 1970-01-01. The timezone
+    is ignored, like in the csv files.
+
+    :param t:
+    :return:
+    """
+    return (t.replace(tzinfo=None) - EPOCH) // SECOND
+
+
+def from_seconds(seconds: int) -> datetime.datetime:
+    return EPOCH + seconds * SECOND
+
+
+def _column_bytes(values: T.Sequence[int]) -> bytes:
+    if isinstance(values, memoryview) and values.format == TYPECODE and \
+            sys.byteorder == 'little':
+        # the columns of a Forecast
+        return values.tobytes()
+
+    column = values if isinstance(values, array.array) and \
+        values.typecode == TYPECODE else array.array(TYPECODE, values)
+    if sys.byteorder == 'big':
+        column = array.array(TYPECODE, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def _column_from_bytes(data: bytes) -> array.array:
+    column = array.array(TYPECODE)
+    column.frombytes(data)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+
+def _timestamps(data: T.Mapping) -> Timestamps:
+    timestamps = data['timestamp']
+    if isinstance(timestamps, Timestamps):
+        return timestamps
+
+    hours = len(timestamps)
+    if hours == 0:
+        return Timestamps(None, 0)
+    step = timestamps[1] - timestamps[0] if hours > 1 else \
+        datetime.timedelta(hours=1)
+    return Timestamps(timestamps[0], hours, step)
+
+
+def encode_snapshot(data: T.Mapping,
+                    fetched: datetime.datetime,
+                    previous: T.Union[Forecast, None] = None) -> bytes:
+    """
+    Returns the record of the snapshot. If the previous forecast is given
+    and a delta against it is smaller than the complete snapshot, the
+    record is a delta. Otherwise it is a keyframe.
+
+    :param data: the forecast
+    :param fetched: time of the update
+    :param previous: the forecast of the previous record
+    :return:
+    """
+    timestamps = _timestamps(data)
+    hours = len(timestamps)
+    if hours == 0:
+        msg = 'Can not store an empty forecast.'
+        raise ValueError(msg)
+
+    flags = 0
+    body = b''.join(_column_bytes(data[name]) for name in COLUMNS)
+    if previous is not None:
+        # after a long gap every value is new and the masks make the delta
+        # larger than the keyframe.
+        delta = _encode_delta(data, timestamps, previous)
+        if delta is not None and len(delta) < len(body):
+            body = delta
+            flags = FLAG_DELTA
+
+    header = RECORD.pack(MAGIC, to_seconds(fetched),
+                         to_seconds(timestamps.start),
+                         timestamps.step // SECOND, hours, flags, len(body))
+    return header + body
+
+
+def _shift(timestamps: Timestamps,
+           previous: Forecast) -> T.Union[int, None]:
+    """
+    Returns the index of the first hour of the timestamps in the previous
+    forecast or None if the forecasts can not be compared.
+
+    :param timestamps:
+    :param previous:
+    :return:
+    """
+    previous_timestamps = previous.timestamps
+    if previous_timestamps.step != timestamps.step:
+        return None
+
+    shift, rest = divmod(timestamps.start - previous_timestamps.start,
+                         timestamps.step)
+    if rest or shift < 0:
+        return None
+    return shift
+
+
+def _encode_delta(data: T.Mapping,
+                  timestamps: Timestamps,
+                  previous: Forecast) -> T.Union[bytes, None]:
+    shift = _shift(timestamps, previous)
+    if shift is None:
+        return None
+
+    hours = len(timestamps)
+    masks = []
+    values = array.array(TYPECODE)
+    for name in COLUMNS:
+        column = data[name]
+        reference = previous[name][shift:shift + hours]
+        mask = 0
+        for i, value in enumerate(column):
+            # the hours after the end of the previous forecast are new.
+            if i >= len(reference) or value != reference[i]:
+                mask |= 1 << i
+                values.append(value)
+        masks.append(mask.to_bytes(_mask_size(hours), 'little'))
+
+    return b''.join(masks) + _column_bytes(values)
+
+
+def _mask_size(hours: int) -> int:
+    return (hours + 7) // 8
+
+
+class SegmentStore:
+    """
+    Stores the snapshots of one location in a directory.
+
+    Usage::
+        >>> store = SegmentStore('/home/user/data/weather_back_log')
+        >>> store.append(forecast, datetime.datetime.now())  # doctest: +SKIP
+        >>> for fetched, forecast in store.snapshots():  # doctest: +SKIP
+        ...     print(fetched, forecast['temperature'][0])
+
+    The snapshots of a day are compacted when the first snapshot of a later
+    day is appended. Only the write-ahead file of the latest day is written
+    to, so the sealed segments can be read by other processes at any time.
+
+    With a keyframe_interval, the snapshots are stored as deltas against
+    the previous snapshot and every keyframe_interval-th snapshot is stored
+    completely. Without it, every snapshot is stored completely. Both kinds
+    of files can be read by every SegmentStore.
+    """
+
+    WAL_SUFFIX = '.wal'
+    SEGMENT_SUFFIX = '.seg'
+
+    def __init__(self,
+                 directory: T.Union[str, PurePath],
+                 keyframe_interval: T.Union[int, None] = None):
+        if keyframe_interval is not None and keyframe_interval < 1:
+            msg = 'keyframe_interval must be at least 1. Got {}.'
+            raise ValueError(msg.format(keyframe_interval))
+
+        self._directory = os.path.abspath(str(directory))
+        self._keyframe_interval = keyframe_interval
+        # path -> ((mtime, size), index entries)
+        self._indexes = {}  # type: T.Dict[str, tuple]
+        # the last read record: (path, end offset, forecast)
+        self._last_read = None  # type: T.Union[tuple, None]
+        # the write-ahead file of the last append:
+        # (path, (inode, mtime, size), index entries, end offset)
+        self._wal = None  # type: T.Union[tuple, None]
+        self._lock = threading.Lock()
+        self._directory_lock = threading.RLock()
+        self._lock_file = None  # type: T.Union[T.IO, None]
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    @property
+    def keyframe_interval(self) -> T.Union[int, None]:
+        return self._keyframe_interval
+
+    def _path(self, day: datetime.date, suffix: str) -> str:
+        return os.path.join(self._directory, DAY_PATTERN.format(day) + suffix)
+
+    @contextlib.contextmanager
+    def locked(self) -> T.Iterator[None]:
+        """
+        Holds the lock of the directory, so only one process compacts it at
+        a time. The lock can be acquired again by the same store.
+
+        :return:
+        """
+        with self._directory_lock:
+            if self._lock_file is not None:
+                yield
+                return
+
+            os.makedirs(self._directory, exist_ok=True)
+            lock_path = os.path.join(self._directory, LOCK_FILE_NAME)
+            with open(lock_path, 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                self._lock_file = lock_file
+                try:
+                    yield
+                finally:
+                    self._lock_file = None
+
+    def days(self) -> T.List[T.Tuple[datetime.date, str]]:
+        """
+        Returns the days and the paths of all segments and write-ahead
+        files, sorted by day. A monthly segment has the first day of its
+        month.
+
+        :return:
+        """
+        try:
+            names = os.listdir(self._directory)
+        except FileNotFoundError:
+            return []
+
+        days = []
+        for name in names:
+            stem, suffix = os.path.splitext(name)
+            match = DAY_REGEX.match(stem)
+            if match is None or \
+                    suffix not in (self.WAL_SUFFIX, self.SEGMENT_SUFFIX):
+                continue
+            year, month, day = match.groups()
+            day = datetime.date(int(year), int(month), int(day or 1))
+            days.append((day, os.path.join(self._directory, name)))
+
+        days.sort()
+        return days
+
+    def _previous(self, entries: T.List[IndexEntry]
+                  ) -> T.Union[Forecast, None]:
+        """
+        Returns the forecast a new record is encoded against or None if
+        the new record must be a keyframe.
+
+        :param entries: the index of the file
+        :return:
+        """
+        if self._keyframe_interval is None or not entries:
+            return None
+
+        keyframe = entries[-1].keyframe
+        chain = sum(1 for entry in entries if entry.keyframe == keyframe)
+        if chain >= self._keyframe_interval:
+            return None
+
+        # the forecast of the last append is kept, so the chain of the
+        # keyframe is not decoded again.
+        with self._lock:
+            last_read = self._last_read
+        if last_read is not None and \
+                last_read[:2] == (entries[-1].path, entries[-1].end):
+            return last_read[2]
+
+        return self.read(entries[-1]).forecast
+
+    def _wal_index(self, wal_path: str, f: T.BinaryIO
+                   ) -> T.Tuple[T.List[IndexEntry], int]:
+        """
+        Returns the index and the end of the last complete record of the
+        open write-ahead file. The file is only scanned if it changed since
+        the last append of this store.
+
+        :param wal_path:
+        :param f:
+        :return:
+        """
+        stat = os.fstat(f.fileno())
+        version = stat.st_ino, stat.st_mtime_ns, stat.st_size
+        with self._lock:
+            cached = self._wal
+        if cached is not None and cached[:2] == (wal_path, version):
+            return cached[2], cached[3]
+        return self._scan(wal_path)
+
+    def append(self,
+               data: T.Mapping,
+               fetched: datetime.datetime,
+               fsync: bool = False) -> None:
+        """
+        Appends the snapshot to the write-ahead file of its day. If it is
+        the first snapshot of the day, the former days are compacted.
+
+        :param data: the forecast
+        :param fetched: time of the update
+        :param fsync: flush the write-ahead file to the disk
+        :return:
+        """
+        os.makedirs(self._directory, exist_ok=True)
+        day = fetched.date()
+        wal_path = self._path(day, self.WAL_SUFFIX)
+
+        if not os.path.exists(wal_path):
+            self.compact(before=day)
+
+        with open(wal_path, 'ab') as f:
+            # a torn record of a crashed write would hide every later one.
+            entries, end = self._wal_index(wal_path, f)
+            if f.tell() != end:
+                f.truncate(end)
+                f.seek(end)
+            previous = self._previous(entries)
+            record = encode_snapshot(data, fetched, previous)
+            f.write(record)
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+
+            _, seconds, start, step, hours, flags, size = \
+                RECORD.unpack_from(record)
+            keyframe = entries[-1].keyframe if flags & FLAG_DELTA else end
+            entries = entries + [IndexEntry(seconds, start, hours, step,
+                                            wal_path, end, size, keyframe)]
+            stat = os.fstat(f.fileno())
+            version = stat.st_ino, stat.st_mtime_ns, stat.st_size
+            forecast = decode_snapshot(record, previous).forecast
+
+        with self._lock:
+            self._wal = wal_path, version, entries, end + len(record)
+            self._last_read = wal_path, end + len(record), forecast
+
+    def compact(self,
+                before: T.Union[datetime.date, None] = None) -> T.List[str]:
+        """
+        Seals the write-ahead files of all days before the given day, which
+        defaults to today. Returns the paths of the sealed segments.
+
+        :param before:
+        :return:
+        """
+        if before is None:
+            before = datetime.date.today()
+
+        def unsealed():
+            return [day for day, file_path in self.days()
+                    if day < before and file_path.endswith(self.WAL_SUFFIX)]
+
+        if not unsealed():
+            return []
+
+        with self.locked():
+            # another process may have sealed them in the meantime.
+            return [self._seal(day) for day in unsealed()]
+
+    def _seal(self, day: datetime.date) -> str:
+        wal_path = self._path(day, self.WAL_SUFFIX)
+        segment_path = self._path(day, self.SEGMENT_SUFFIX)
+
+        snapshots = {}
+        for file_path in (segment_path, wal_path):
+            if not os.path.exists(file_path):
+                continue
+            for snapshot in self.read_file(file_path):
+                # the latest snapshot of an update wins.
+                key = snapshot.fetched, snapshot.forecast.timestamps.start
+                snapshots[key] = snapshot
+
+        self.write_segment(segment_path, [snapshots[key]
+                                          for key in sorted(snapshots)])
+        try:
+            os.remove(wal_path)
+        except FileNotFoundError:
+            # sealed by another process at the same time
+            pass
+        return segment_path
+
+    def write_segment(self,
+                      file_path: str,
+                      snapshots: T.Iterable[Snapshot]) -> None:
+        """
+        Writes the snapshots and their index to a sealed segment. The file
+        is replaced atomically.
+
+        :param file_path:
+        :param snapshots:
+        :return:
+        """
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(file_path),
+                                         suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                index = []
+                previous = None
+                keyframe = 0
+                chain = 0
+                for fetched, forecast in snapshots:
+                    if self._keyframe_interval is None or \
+                            chain >= self._keyframe_interval:
+                        previous = None
+
+                    record = encode_snapshot(forecast, fetched, previous)
+                    _, fetched, start, step, hours, flags, size = \
+                        RECORD.unpack_from(record)
+                    if not flags & FLAG_DELTA:
+                        keyframe = f.tell()
+                        chain = 0
+                    index.append(INDEX_ENTRY.pack(fetched, start, step,
+                                                  hours, f.tell(), size,
+                                                  keyframe))
+                    f.write(record)
+                    previous = forecast
+                    chain += 1
+
+                index_offset = f.tell()
+                f.write(b''.join(index))
+                f.write(FOOTER.pack(index_offset, len(index), MAGIC))
+            os.replace(temp_path, file_path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def _scan(self, file_path: str) -> T.Tuple[T.List[IndexEntry], int]:
+        """
+        Reads the headers of a write-ahead file. Returns the index and the
+        end of the last complete record.
+
+        :param file_path:
+        :return:
+        """
+        entries = []
+        with open(file_path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            offset = 0
+            keyframe = 0
+            while offset + RECORD.size <= file_size:
+                f.seek(offset)
+                magic, fetched, start, step, hours, flags, size = \
+                    RECORD.unpack(f.read(RECORD.size))
+                end = offset + RECORD.size + size
+                if magic != MAGIC or end > file_size:
+                    break
+                if not flags & FLAG_DELTA:
+                    keyframe = offset
+                entries.append(IndexEntry(fetched, start, hours, step,
+                                          file_path, offset, size, keyframe))
+                offset = end
+        return entries, offset
+
+    def _read_index(self, file_path: str) -> T.List[IndexEntry]:
+        if file_path.endswith(self.WAL_SUFFIX):
+            return self._scan(file_path)[0]
+
+        with open(file_path, 'rb') as f:
+            f.seek(-FOOTER.size, os.SEEK_END)
+            index_offset, count, magic = FOOTER.unpack(f.read(FOOTER.size))
+            if magic != MAGIC:
+                msg = '{} is not a sealed segment.'
+                raise SegmentError(msg.format(file_path))
+
+            f.seek(index_offset)
+            data = f.read(count * INDEX_ENTRY.size)
+        return [IndexEntry(fetched, start, hours, step, file_path, offset,
+                           size, keyframe)
+                for fetched, start, step, hours, offset, size, keyframe in
+                INDEX_ENTRY.iter_unpack(data)]
+
+    def read_file(self, file_path: str) -> T.Iterator[Snapshot]:
+        """
+        Yields all snapshots of a file in the order of the file.
+
+        :param file_path:
+        :return:
+        """
+        entries = sorted(self._read_index(file_path),
+                         key=lambda entry: entry.offset)
+        if not entries:
+            return
+
+        with open(file_path, 'rb') as f:
+            data = f.read(entries[-1].end)
+
+        previous = None
+        for entry in entries:
+            snapshot = decode_snapshot(data[entry.offset:entry.end], previous)
+            previous = snapshot.forecast
+            yield snapshot
+
+    def index(self) -> T.List[IndexEntry]:
+        """
+        Returns the index entries of all snapshots sorted by the time of
+        the update. The index of every file is cached until the file
+        changes.
+
+        :return:
+        """
+        entries = []
+        seen = set()
+        for _, file_path in self.days():
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                # compacted in the meantime
+                continue
+            version = stat.st_mtime_ns, stat.st_size
+            seen.add(file_path)
+
+            with self._lock:
+                cached = self._indexes.get(file_path)
+            if cached is None or cached[0] != version:
+                try:
+                    cached = version, self._read_index(file_path)
+                except FileNotFoundError:
+                    continue
+                with self._lock:
+                    self._indexes[file_path] = cached
+            entries.extend(cached[1])
+
+        with self._lock:
+            for file_path in set(self._indexes) - seen:
+                del self._indexes[file_path]
+
+        entries.sort(key=lambda entry: (entry.fetched, entry.start))
+        return entries
+
+    def find(self,
+             fetched_from: T.Union[datetime.datetime, None] = None,
+             fetched_to: T.Union[datetime.datetime, None] = None,
+             hour: T.Union[datetime.datetime, None] = None
+             ) -> T.List[IndexEntry]:
+        """
+        Returns the index entries of the snapshots which were fetched
+        between fetched_from (inclusive) and fetched_to (exclusive) and
+        contain the forecast for the hour.
+
+        :param fetched_from:
+        :param fetched_to:
+        :param hour:
+        :return:
+        """
+        entries = self.index()
+        keys = [entry.fetched for entry in entries]
+
+        lo = 0 if fetched_from is None else \
+            bisect.bisect_left(keys, to_seconds(fetched_from))
+        hi = len(entries) if fetched_to is None else \
+            bisect.bisect_left(keys, to_seconds(fetched_to))
+        entries = entries[lo:hi]
+
+        if hour is not None:
+            hour = to_seconds(hour)
+            entries = [entry for entry in entries if entry.covers(hour)]
+        return entries
+
+    def read(self, entry: IndexEntry) -> Snapshot:
+        """
+        Reads the snapshot of the index entry. A delta is applied to the
+        snapshots since its keyframe. If the previous record was read last,
+        only the delta is read.
+
+        :param entry:
+        :return:
+        """
+        with self._lock:
+            last_read = self._last_read
+
+        with open(entry.path, 'rb') as f:
+            if entry.keyframe == entry.offset:
+                f.seek(entry.offset)
+                snapshot = decode_snapshot(f.read(entry.end - entry.offset))
+            elif last_read is not None and \
+                    last_read[:2] == (entry.path, entry.offset):
+                f.seek(entry.offset)
+                snapshot = decode_snapshot(f.read(entry.end - entry.offset),
+                                           last_read[2])
+            else:
+                f.seek(entry.keyframe)
+                data = f.read(entry.end - entry.keyframe)
+                snapshot = None
+                for record in _iter_records(data):
+                    snapshot = decode_snapshot(
+                        record, snapshot.forecast if snapshot else None
+                    )
+
+        with self._lock:
+            self._last_read = entry.path, entry.end, snapshot.forecast
+        return snapshot
+
+    def snapshots(self,
+                  fetched_from: T.Union[datetime.datetime, None] = None,
+                  fetched_to: T.Union[datetime.datetime, None] = None
+                  ) -> T.Iterator[Snapshot]:
+        """
+        Yields the snapshots which were fetched between fetched_from
+        (inclusive) and fetched_to (exclusive).
+
+        :param fetched_from:
+        :param fetched_to:
+        :return:
+        """
+        for entry in self.find(fetched_from, fetched_to):
+            yield self.read(entry)
+
+
+def _iter_records(data: bytes) -> T.Iterator[bytes]:
+    offset = 0
+    while offset < len(data):
+        size = RECORD.unpack_from(data, offset)[-1]
+        end = offset + RECORD.size + size
+        yield data[offset:end]
+        offset = end
+
+
+def decode_snapshot(record: bytes,
+                    previous: T.Union[Forecast, None] = None) -> Snapshot:
+    """
+    Returns the snapshot of the record. A delta requires the forecast of
+    the previous record.
+
+    :param record:
+    :param previous:
+    :return:
+    """
+    magic, fetched, start, step, hours, flags, size = \
+        RECORD.unpack_from(record)
+    if magic != MAGIC:
+        msg = 'Invalid snapshot record.'
+        raise SegmentError(msg)
+
+    body = record[RECORD.size:RECORD.size + size]
+    if len(body) != size:
+        msg = 'Snapshot record is truncated.'
+        raise SegmentError(msg)
+
+    timestamps = Timestamps(from_seconds(start), hours,
+                            datetime.timedelta(seconds=step))
+
+    if flags & FLAG_DELTA:
+        if previous is None:
+            msg = 'The delta record requires the previous snapshot.'
+            raise SegmentError(msg)
+        columns = _decode_delta(body, timestamps, previous)
+    else:
+        column_size = 4 * hours
+        columns = [
+            _column_from_bytes(body[i * column_size:(i + 1) * column_size])
+            for i in range(len(COLUMNS))
+        ]
+
+    if any(len(column) != hours for column in columns):
+        msg = 'Snapshot record is invalid.'
+        raise SegmentError(msg)
+
+    return Snapshot(from_seconds(fetched), Forecast(timestamps, *columns))
+
+
+def _decode_delta(body: bytes,
+                  timestamps: Timestamps,
+                  previous: Forecast) -> T.List[array.array]:
+    shift = _shift(timestamps, previous)
+    if shift is None:
+        msg = 'The delta record does not match the previous snapshot.'
+        raise SegmentError(msg)
+
+    hours = len(timestamps)
+    mask_size = _mask_size(hours)
+    values = _column_from_bytes(body[len(COLUMNS) * mask_size:])
+
+    columns = []
+    position = 0
+    for i, name in enumerate(COLUMNS):
+        mask = int.from_bytes(body[i * mask_size:(i + 1) * mask_size],
+                              'little')
+        # the unchanged hours are copied from the previous forecast.
+        column = array.array(TYPECODE, previous[name][shift:shift + hours])
+        column.extend([0] * (hours - len(column)))
+        while mask:
+            hour = (mask & -mask).bit_length() - 1
+            column[hour] = values[position]
+            position += 1
+            mask &= mask - 1
+        columns.append(column)
+    return columns
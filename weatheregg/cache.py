@@ -0,0 +1,309 @@
+"""
+This file contains the caches of the Weatheregg.
+The ForecastCache keeps the latest forecasts in memory, so reading several
+values of the same forecast does not request wetter.at again.
+The DiskCache keeps the downloaded pages on disk, so they are shared between
+several runs of the command line tools.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import typing as T
+from collections import OrderedDict
+from pathlib import PurePath
+
+from weatheregg.forecast import Forecast
+from weatheregg.scheduler import Clock
+
+CACHE_TTL = 300  # seconds
+CACHE_SIZE = 1024  # forecasts
+
+DISK_CACHE_TTL = 3600  # seconds
+DISK_CACHE_SIZE = 64 * 1024 * 1024  # bytes
+
+
+class ForecastCache:
+    """
+    Keeps the forecasts of up to `maxsize` locations for `ttl` seconds.
+    If the cache is full, the least recently used forecast is evicted.
+    A ttl of 0 disables the cache.
+
+    The cache is thread-safe and can be shared between WeatherEggs.
+    """
+
+    def __init__(self,
+                 ttl: float = CACHE_TTL,
+                 maxsize: int = CACHE_SIZE,
+                 clock: T.Union[Clock, None] = None):
+        if ttl < 0:
+            msg = 'ttl must not be negative. Got {}.'
+            raise ValueError(msg.format(ttl))
+
+        if maxsize < 1:
+            msg = 'maxsize must be at least 1. Got {}.'
+            raise ValueError(msg.format(maxsize))
+
+        self._ttl = ttl
+        self._maxsize = maxsize
+        self._clock = clock if clock is not None else Clock()
+        # key -> (expiry time, forecast), least recently used first
+        self._entries = OrderedDict()  # type: OrderedDict
+        self._lock = threading.Lock()
+
+    @property
+    def ttl(self) -> float:
+        return self._ttl
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key: T.Hashable) -> T.Union[Forecast, None]:
+        """
+        Returns the cached forecast or None if there is no valid one.
+
+        :param key:
+        :return:
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires, forecast = entry
+            if self._clock.time() >= expires:
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return forecast
+
+    def put(self, key: T.Hashable, forecast: Forecast) -> None:
+        """
+        Stores the forecast for `ttl` seconds.
+
+        :param key:
+        :param forecast:
+        :return:
+        """
+        if self._ttl == 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (self._clock.time() + self._ttl, forecast)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: T.Hashable = None) -> None:
+        """
+        Removes the forecast for the key or all forecasts if no key is
+        given.
+
+        :param key:
+        :return:
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+class DiskCache:
+    """
+    Keeps downloaded pages in a directory. Every page is stored gzip
+    compressed in a file named by the hash of its url. The pages expire
+    after `ttl` seconds. If the directory grows bigger than `max_size`
+    bytes, the least recently used pages are removed.
+
+    Several processes can use the same directory at the same time. The size
+    of the directory is counted once and then kept up to date by every
+    put, so the directory is only scanned again if it grows too big. Pages
+    of other processes are counted by that scan.
+    """
+
+    SUFFIX = '.gz'
+
+    def __init__(self,
+                 directory: T.Union[str, PurePath],
+                 ttl: float = DISK_CACHE_TTL,
+                 max_size: int = DISK_CACHE_SIZE,
+                 clock: T.Union[Clock, None] = None):
+        if ttl < 0:
+            msg = 'ttl must not be negative. Got {}.'
+            raise ValueError(msg.format(ttl))
+
+        if max_size < 1:
+            msg = 'max_size must be at least 1. Got {}.'
+            raise ValueError(msg.format(max_size))
+
+        self._directory = os.path.abspath(str(directory))
+        self._ttl = ttl
+        self._max_size = max_size
+        self._clock = clock if clock is not None else Clock()
+        self._lock = threading.Lock()
+
+        os.makedirs(self._directory, exist_ok=True)
+        # the bytes and the number of the pages in the directory
+        self._size = 0
+        self._count = 0
+        self._scan()
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            return self._size
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._count
+
+    def _path(self, url: str) -> str:
+        name = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self._directory, name + self.SUFFIX)
+
+    def get(self, url: str) -> T.Union[bytes, None]:
+        """
+        Returns the cached page or None if there is no valid one.
+
+        :param url:
+        :return:
+        """
+        file_path = self._path(url)
+        try:
+            with gzip.open(file_path, 'rb') as f:
+                header = json.loads(f.readline())
+                body = f.read()
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError):
+            # broken entries are treated like missing ones.
+            self._remove(file_path)
+            return None
+
+        if header.get('url') != url:
+            return None
+
+        if self._clock.time() >= header.get('stored', 0) + self._ttl:
+            self._remove(file_path)
+            return None
+
+        # the modification time marks the last use.
+        try:
+            os.utime(file_path)
+        except OSError:
+            pass
+
+        return body
+
+    def put(self, url: str, body: bytes) -> None:
+        """
+        Stores the page and removes the least recently used pages if the
+        cache is too big.
+
+        :param url:
+        :param body:
+        :return:
+        """
+        if self._ttl == 0:
+            return
+
+        header = json.dumps({'url': url, 'stored': self._clock.time()})
+
+        file_path = self._path(url)
+        fd, temp_path = tempfile.mkstemp(dir=self._directory,
+                                         suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+                    gz.write(header.encode('utf-8') + b'\n')
+                    gz.write(body)
+                new_size = f.tell()
+            old_size = self._file_size(file_path)
+            os.replace(temp_path, file_path)
+        except BaseException:
+            self._remove(temp_path)
+            raise
+
+        with self._lock:
+            self._size += new_size - (old_size or 0)
+            self._count += old_size is None
+            too_big = self._size > self._max_size
+
+        if too_big:
+            self._evict()
+
+    def _entries(self) -> T.List[os.DirEntry]:
+        with os.scandir(self._directory) as entries:
+            return [entry for entry in entries
+                    if entry.name.endswith(self.SUFFIX)]
+
+    def _stats(self) -> T.List[T.Tuple[float, int, str]]:
+        """
+        Returns the time of the last use, the size and the path of every
+        page.
+
+        :return:
+        """
+        stats = []
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            stats.append((stat.st_mtime, stat.st_size, entry.path))
+        return stats
+
+    def _scan(self) -> T.List[T.Tuple[float, int, str]]:
+        stats = self._stats()
+        with self._lock:
+            self._size = sum(entry[1] for entry in stats)
+            self._count = len(stats)
+        return stats
+
+    def _evict(self) -> None:
+        for _, _, file_path in sorted(self._scan()):
+            if self.size <= self._max_size:
+                break
+            self._remove(file_path)
+
+    def clear(self) -> None:
+        """
+        Removes all pages.
+
+        :return:
+        """
+        for entry in self._entries():
+            self._remove(entry.path)
+
+    @staticmethod
+    def _file_size(file_path: str) -> T.Union[int, None]:
+        try:
+            return os.stat(file_path).st_size
+        except FileNotFoundError:
+            return None
+
+    def _remove(self, file_path: str) -> None:
+        size = self._file_size(file_path)
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            return
+
+        if size is not None and file_path.endswith(self.SUFFIX):
+            with self._lock:
+                self._size -= size
+                self._count -= 1
+
+
+# can be passed to WeatherEggs which should share their forecasts.
+SHARED_CACHE = ForecastCache()
@@ -0,0 +1,269 @@
+"""
+This file contains the compaction of the backlog.
+The compaction merges the csv files and segments of past days into one
+sealed segment per day or month and thins out old snapshots according to a
+retention policy.
+
+It can run while a recorder writes to the same directory: only days before
+today are touched, the merged segments are replaced atomically and the
+merged files are removed afterwards. Two compactions of the same directory
+wait for each other.
+"""
+
+import datetime
+import os
+import re
+import typing as T
+from pathlib import PurePath
+
+from weatheregg.backlog import DAY_PATTERN, MONTH_PATTERN, SegmentError, \
+    SegmentStore, Snapshot, from_seconds, to_seconds
+from weatheregg.reader import list_csv_files, read_csv
+
+PERIODS = ('day', 'month')
+
+UNITS = {
+    'm': datetime.timedelta(minutes=1),
+    'h': datetime.timedelta(hours=1),
+    'd': datetime.timedelta(days=1),
+    'w': datetime.timedelta(weeks=1),
+}
+DURATION_REGEX = re.compile(r'^(\d+)([mhdw])$')
+
+# keep every snapshot
+KEEP = datetime.timedelta(0)
+# drop every snapshot
+DROP = None
+
+
+class CompactionResult(T.NamedTuple):
+    read: int  # snapshots
+    written: int  # snapshots
+    removed: int  # files
+
+
+def parse_duration(text: str) -> datetime.timedelta:
+    """
+    Parses a duration like 30d, 6h, 2w or 15m.
+
+    :param text:
+    :return:
+    """
+    match = DURATION_REGEX.match(text.strip())
+    if match is None:
+        msg = 'Invalid duration {!r}. Use e. g. 30d, 6h, 2w or 15m.'
+        raise ValueError(msg.format(text))
+    return int(match.group(1)) * UNITS[match.group(2)]
+
+
+class RetentionPolicy:
+    """
+    Decides which snapshots are kept. Every rule maps an age to the spacing
+    of the kept snapshots from that age on::
+
+        >>> policy = RetentionPolicy.parse('0d=1h,30d=6h,365d=drop')
+        >>> policy.spacing(datetime.timedelta(days=40))
+        datetime.timedelta(seconds=21600)
+        >>> policy.spacing(datetime.timedelta(days=400)) is None
+        True
+
+    keeps one snapshot per hour, one per 6 hours after 30 days and drops
+    the snapshots after 365 days. `all` keeps every snapshot. Snapshots
+    younger than the first rule are kept.
+    The first snapshot of every interval is kept. The intervals are aligned
+    to midnight, so compacting again does not remove more snapshots.
+    """
+
+    def __init__(self,
+                 rules: T.Iterable[T.Tuple[datetime.timedelta,
+                                           T.Union[datetime.timedelta,
+                                                   None]]]):
+        self._rules = sorted(rules, key=lambda rule: rule[0])
+
+    @classmethod
+    def parse(cls, text: str) -> 'RetentionPolicy':
+        """
+        Parses a policy like '0d=1h,30d=6h,365d=drop'.
+
+        :param text:
+        :return:
+        """
+        rules = []
+        for rule in text.split(','):
+            age, _, spacing = rule.partition('=')
+            spacing = spacing.strip()
+            if spacing == 'drop':
+                spacing = DROP
+            elif spacing == 'all':
+                spacing = KEEP
+            else:
+                spacing = parse_duration(spacing)
+            rules.append((parse_duration(age), spacing))
+        return cls(rules)
+
+    def spacing(self, age: datetime.timedelta
+                ) -> T.Union[datetime.timedelta, None]:
+        """
+        Returns the spacing of the kept snapshots of the age or None if
+        they are dropped.
+
+        :param age:
+        :return:
+        """
+        spacing = KEEP
+        for rule_age, rule_spacing in self._rules:
+            if age < rule_age:
+                break
+            spacing = rule_spacing
+        return spacing
+
+    def keep(self,
+             fetched: T.Iterable[datetime.datetime],
+             now: datetime.datetime) -> T.Set[datetime.datetime]:
+        """
+        Returns the times of the snapshots which are kept.
+
+        :param fetched: the times of the snapshots
+        :param now:
+        :return:
+        """
+        kept = set()
+        intervals = set()
+        for t in sorted(fetched):
+            spacing = self.spacing(now - t)
+            if spacing is DROP:
+                continue
+            if spacing == KEEP:
+                kept.add(t)
+                continue
+
+            interval = spacing, to_seconds(t) // int(spacing.total_seconds())
+            if interval not in intervals:
+                intervals.add(interval)
+                kept.add(t)
+        return kept
+
+
+def compact_backlog(directory: T.Union[str, PurePath],
+                    period: str = 'day',
+                    retention: T.Union[RetentionPolicy, None] = None,
+                    keyframe_interval: T.Union[int, None] = None,
+                    now: T.Union[datetime.datetime, None] = None
+                    ) -> CompactionResult:
+    """
+    Merges the csv files and segments of every past day or month of the
+    backlog directory into one sealed segment and drops the snapshots
+    which are not kept by the retention policy.
+
+    :param directory: the backlog directory
+    :param period: day or month
+    :param retention: defaults to keeping every snapshot
+    :param keyframe_interval: delta encodes the merged segments
+    :param now: defaults to the current time
+    :return:
+    """
+    if period not in PERIODS:
+        msg = 'period must be one of {}. Got {!r}.'
+        raise ValueError(msg.format(', '.join(PERIODS), period))
+
+    if now is None:
+        now = datetime.datetime.now()
+    today = now.date()
+    pattern = DAY_PATTERN if period == 'day' else MONTH_PATTERN
+
+    store = SegmentStore(directory, keyframe_interval)
+    read = written = removed = 0
+
+    with store.locked():
+        # the write-ahead file of today is still written by the recorder.
+        store.compact(before=today)
+
+        # file -> times of its snapshots
+        fetched = {}  # type: T.Dict[str, T.List[datetime.datetime]]
+        for t, file_path in list_csv_files(directory):
+            if t.date() < today:
+                fetched[file_path] = [t]
+        segments = {file_path for day, file_path in store.days()
+                    if day < today and
+                    file_path.endswith(SegmentStore.SEGMENT_SUFFIX)}
+        for file_path in segments:
+            fetched[file_path] = []
+        for entry in store.index():
+            if entry.path in segments:
+                fetched[entry.path].append(from_seconds(entry.fetched))
+
+        kept = None
+        if retention is not None:
+            kept = retention.keep(
+                (t for times in fetched.values() for t in times), now
+            )
+
+        def target_of(name: str) -> str:
+            return os.path.join(store.directory,
+                                name + SegmentStore.SEGMENT_SUFFIX)
+
+        # target name -> files which are merged into it
+        groups = {}  # type: T.Dict[str, T.List[str]]
+        # files which are read for more than one target or overwritten
+        shared = set()
+        for file_path, times in sorted(fetched.items()):
+            names = {pattern.format(t) for t in times}
+            for name in names:
+                groups.setdefault(name, []).append(file_path)
+            if [target_of(name) for name in names] != [file_path]:
+                shared.add(file_path)
+
+        loaded = {}  # type: T.Dict[str, T.List[Snapshot]]
+        merged = set()
+        targets = set()
+        for name, file_paths in sorted(groups.items()):
+            target = target_of(name)
+            if file_paths == [target] and target not in shared and \
+                    (kept is None or all(t in kept for t in fetched[target])):
+                continue
+
+            snapshots = {}
+            for file_path in file_paths:
+                try:
+                    if file_path not in loaded:
+                        loaded[file_path] = list(_read_snapshots(
+                            store, file_path, fetched[file_path]
+                        ))
+                except FileNotFoundError:
+                    continue
+                except (SegmentError, ValueError):
+                    # broken files are left alone.
+                    continue
+                merged.add(file_path)
+
+                for snapshot in loaded[file_path]:
+                    if pattern.format(snapshot.fetched) == name:
+                        key = (snapshot.fetched,
+                               snapshot.forecast.timestamps.start)
+                        snapshots[key] = snapshot
+                if file_path not in shared:
+                    del loaded[file_path]
+
+            read += len(snapshots)
+            snapshots = [snapshots[key] for key in sorted(snapshots)
+                         if kept is None or key[0] in kept]
+            if snapshots:
+                store.write_segment(target, snapshots)
+                written += len(snapshots)
+                targets.add(target)
+
+        for file_path in sorted(merged - targets):
+            os.remove(file_path)
+            removed += 1
+
+    return CompactionResult(read, written, removed)
+
+
+def _read_snapshots(store: SegmentStore,
+                    file_path: str,
+                    fetched: T.List[datetime.datetime]
+                    ) -> T.Iterator[Snapshot]:
+    if file_path.endswith(SegmentStore.SEGMENT_SUFFIX):
+        return store.read_file(file_path)
+    # a csv file contains one snapshot.
+    return iter([Snapshot(fetched[0], read_csv(file_path))])
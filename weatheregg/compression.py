@@ -0,0 +1,133 @@
+"""
+This file contains the compression of the backlog files.
+The csv files of the backlog can be compressed with gzip or, if the
+zstandard package is installed, with zstd. The compression is recognized by
+the suffix of the file name, so compressed and uncompressed files can be
+mixed in one directory.
+"""
+
+import gzip
+import io
+import typing as T
+from pathlib import PurePath
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+# compression -> suffix
+SUFFIXES = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+COMPRESSIONS = tuple(SUFFIXES)
+
+GZIP_LEVEL = 9
+ZSTD_LEVEL = 3  # the default of zstandard
+
+
+def check_compression(compression: T.Union[str, None]) -> None:
+    """
+    Raises a ValueError if the compression is unknown and an ImportError
+    if it is not available.
+
+    :param compression: gzip, zstd or None
+    :return:
+    """
+    if compression is not None and compression not in SUFFIXES:
+        msg = 'compression must be one of {} or None. Got {!r}.'
+        raise ValueError(msg.format(', '.join(COMPRESSIONS), compression))
+
+    if compression == 'zstd' and zstandard is None:
+        msg = 'The zstandard package is required for zstd compression.'
+        raise ImportError(msg)
+
+
+def suffix(compression: T.Union[str, None]) -> str:
+    """
+    Returns the suffix which is appended to the file name.
+
+    :param compression:
+    :return:
+    """
+    check_compression(compression)
+    return SUFFIXES.get(compression, '')
+
+
+def compression_of(file_path: T.Union[str, PurePath]
+                   ) -> T.Union[str, None]:
+    """
+    Returns the compression of the file by its suffix.
+
+    :param file_path:
+    :return:
+    """
+    file_path = str(file_path)
+    for compression, file_suffix in SUFFIXES.items():
+        if file_path.endswith(file_suffix):
+            return compression
+    return None
+
+
+def strip_suffix(file_name: str) -> str:
+    """
+    Returns the file name without the compression suffix.
+
+    :param file_name:
+    :return:
+    """
+    compression = compression_of(file_name)
+    if compression is None:
+        return file_name
+    return file_name[:-len(SUFFIXES[compression])]
+
+
+def compress(data: bytes, compression: T.Union[str, None]) -> bytes:
+    """
+    Compresses the data. None returns the data unchanged.
+
+    :param data:
+    :param compression: gzip, zstd or None
+    :return:
+    """
+    check_compression(compression)
+    if compression == 'gzip':
+        # without a timestamp, equal data results in equal files.
+        # gzip.compress only accepts the mtime since Python 3.8.
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode='wb',
+                           compresslevel=GZIP_LEVEL, mtime=0) as f:
+            f.write(data)
+        return buffer.getvalue()
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return data
+
+
+def decompress(data: bytes, compression: T.Union[str, None]) -> bytes:
+    """
+    Decompresses the data. None returns the data unchanged.
+
+    :param data:
+    :param compression: gzip, zstd or None
+    :return:
+    """
+    check_compression(compression)
+    if compression == 'gzip':
+        return gzip.decompress(data)
+    if compression == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def read_file(file_path: T.Union[str, PurePath]) -> bytes:
+    """
+    Reads the file and decompresses it according to its suffix.
+
+    :param file_path:
+    :return:
+    """
+    with open(str(file_path), 'rb') as f:
+        data = f.read()
+    return decompress(data, compression_of(file_path))
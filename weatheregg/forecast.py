@@ -0,0 +1,395 @@
+"""
+This file contains the Forecast.
+The Forecast stores the hourly weather data in compact typed arrays and the
+timestamps as start time plus a fixed step. It can be used like the dict
+which was returned by former versions.
+The timestamps are formatted in bulk: the date part of the format is only
+formatted once per day and the times are filled in by arithmetic, so no
+datetime is created per hour.
+"""
+
+import array
+import datetime
+import functools
+import typing as T
+from collections.abc import Mapping, Sequence
+
+# all columns are stored as C ints.
+TYPECODE = 'i'
+
+COLUMNS = ('temperature', 'cloudiness', 'rain', 'wind_velocity')
+KEYS = ('timestamp', ) + COLUMNS
+
+HOUR = datetime.timedelta(hours=1)
+DAY = datetime.timedelta(days=1)
+SECOND = datetime.timedelta(seconds=1)
+DAY_SECONDS = 86400
+# shorter steps are not cached per day
+MIN_DAY_STEP = 60
+
+# strftime directives, which only depend on the date or the timezone
+DATE_DIRECTIVES = frozenset('aAbBCdgGjmuUVwWyYzZ%')
+# strftime directives of the time of the day and their str.format fields
+TIME_DIRECTIVES = {'H': '{0:02d}', 'M': '{1:02d}', 'S': '{2:02d}'}
+
+
+class Timestamps(Sequence):
+    """
+    A sequence of `length` datetimes starting at `start` with a fixed step.
+    The datetimes are only created on access.
+    """
+
+    __slots__ = ('_start', '_step', '_length')
+
+    def __init__(self,
+                 start: datetime.datetime,
+                 length: int,
+                 step: datetime.timedelta = HOUR):
+        if length < 0:
+            msg = 'length must not be negative. Got {}.'
+            raise ValueError(msg.format(length))
+
+        self._start = start
+        self._step = step
+        self._length = length
+
+    @property
+    def start(self) -> datetime.datetime:
+        return self._start
+
+    @property
+    def step(self) -> datetime.timedelta:
+        return self._step
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            if step < 0:
+                return [self[i] for i in range(start, stop, step)]
+            return Timestamps(self._start + start * self._step,
+                              len(range(start, stop, step)),
+                              self._step * step)
+
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('Timestamps index out of range')
+
+        return self._start + index * self._step
+
+    def __iter__(self) -> T.Iterator[datetime.datetime]:
+        t = self._start
+        for _ in range(self._length):
+            yield t
+            t += self._step
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Timestamps):
+            if self._length != other._length:
+                return False
+            if self._length == 0:
+                return True
+            return self._start == other._start and \
+                (self._length == 1 or self._step == other._step)
+        if isinstance(other, Sequence):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((self._length, self._start if self._length else None))
+
+    def __reduce__(self):
+        return Timestamps, (self._start, self._length, self._step)
+
+    def __repr__(self) -> str:
+        return 'Timestamps(start={!r}, length={}, step={!r})'.format(
+            self._start, self._length, self._step
+        )
+
+    def strftime(self, fmt: str) -> T.List[str]:
+        """
+        Formats all timestamps like `datetime.strftime`. Formats which only
+        use date directives and %H, %M and %S are formatted once per day
+        and the formatted days are cached. Other formats fall back to
+        formatting every datetime.
+
+            >>> Timestamps(datetime.datetime(2019, 6, 1, 23), 2).strftime(
+            ...     '%Y-%m-%d %H:%M')
+            ['2019-06-01 23:00', '2019-06-02 00:00']
+
+        :param fmt:
+        :return:
+        """
+        template = _compile(fmt)
+        if template is None or not self._is_whole_seconds():
+            return [t.strftime(fmt) for t in self]
+
+        start = self._start
+        first = start.hour * 3600 + start.minute * 60 + start.second
+        # aware datetimes of different zones compare equal, so the days
+        # are cached by their wall time and zone.
+        midnight = start.replace(tzinfo=None) - \
+            datetime.timedelta(seconds=first)
+        step = self._step // SECOND
+        tz = start.tzinfo
+
+        if step < MIN_DAY_STEP or DAY_SECONDS % step:
+            formatted = []
+            day = None
+            for seconds in range(first, first + self._length * step, step):
+                days, seconds = divmod(seconds, DAY_SECONDS)
+                if days != day:
+                    day = days
+                    day_template = _day_template(template,
+                                                 midnight + days * DAY, tz)
+                hour, seconds = divmod(seconds, 3600)
+                formatted.append(day_template.format(hour,
+                                                     *divmod(seconds, 60)))
+            return formatted
+
+        # the step divides a day, so every day has the same times, which
+        # are formatted once per day and sliced.
+        phase = first % step
+        index = first // step
+        formatted = []
+        days = 0
+        while len(formatted) < self._length:
+            times = _format_day(template, midnight + days * DAY, tz, phase,
+                                step)
+            formatted.extend(times[index:index + self._length -
+                                   len(formatted)])
+            index = 0
+            days += 1
+        return formatted
+
+    def _is_whole_seconds(self) -> bool:
+        return self._length > 0 and self._step > datetime.timedelta(0) and \
+            not self._step % SECOND and not self._start.microsecond
+
+
+@functools.lru_cache(maxsize=64)
+def _compile(fmt: str) -> T.Union[str, None]:
+    """
+    Converts a strftime format to a template, whose date directives are
+    formatted by strftime and whose time directives are str.format fields.
+    Returns None if the format has other directives.
+
+    :param fmt:
+    :return:
+    """
+    parts = []
+    chars = iter(fmt)
+    for char in chars:
+        if char != '%':
+            parts.append(char.replace('{', '{{').replace('}', '}}'))
+            continue
+
+        directive = next(chars, '')
+        if directive in TIME_DIRECTIVES:
+            parts.append(TIME_DIRECTIVES[directive])
+        elif directive in DATE_DIRECTIVES:
+            parts.append('%' + directive)
+        else:
+            return None
+    return ''.join(parts)
+
+
+@functools.lru_cache(maxsize=1024)
+def _day_template(template: str,
+                  midnight: datetime.datetime,
+                  tz: T.Union[datetime.tzinfo, None]) -> str:
+    # shared by all series which cover the same days.
+    return midnight.replace(tzinfo=tz).strftime(template)
+
+
+@functools.lru_cache(maxsize=128)
+def _format_day(template: str,
+                midnight: datetime.datetime,
+                tz: T.Union[datetime.tzinfo, None],
+                phase: int,
+                step: int) -> T.Tuple[str, ...]:
+    """
+    Returns the formatted times of a day, which start `phase` seconds after
+    midnight and are `step` seconds apart.
+
+    :param template:
+    :param midnight:
+    :param tz:
+    :param phase:
+    :param step:
+    :return:
+    """
+    day_template = _day_template(template, midnight, tz)
+    formatted = []
+    for seconds in range(phase, DAY_SECONDS, step):
+        hour, seconds = divmod(seconds, 3600)
+        formatted.append(day_template.format(hour, *divmod(seconds, 60)))
+    return tuple(formatted)
+
+
+def format_timestamps(timestamps: T.Sequence[datetime.datetime],
+                      fmt: str) -> T.List[str]:
+    """
+    Formats the timestamps of a forecast, which are either Timestamps or
+    a list of datetimes.
+
+    :param timestamps:
+    :param fmt:
+    :return:
+    """
+    if isinstance(timestamps, Timestamps):
+        return timestamps.strftime(fmt)
+    return [t.strftime(fmt) for t in timestamps]
+
+
+class Forecast(Mapping):
+    """
+    The hourly weather forecast. The columns are stored as read-only views
+    of C ints and can be accessed like the items of a dict::
+
+        >>> forecast = Forecast(
+        ...     Timestamps(datetime.datetime(2019, 6, 1, 14), 2),
+        ...     temperature=[21, 20],
+        ...     cloudiness=[40, 60],
+        ...     rain=[0, 1],
+        ...     wind_velocity=[10, 12]
+        ... )
+        >>> forecast['temperature'][0]
+        21
+        >>> forecast['timestamp'][1]
+        datetime.datetime(2019, 6, 1, 15, 0)
+        >>> sorted(forecast.keys())
+        ['cloudiness', 'rain', 'temperature', 'timestamp', 'wind_velocity']
+
+    A forecast can not be changed, so it can be shared, e. g. by the
+    ForecastCache.
+    """
+
+    def __init__(self,
+                 timestamps: Timestamps,
+                 temperature: T.Iterable[int],
+                 cloudiness: T.Iterable[int],
+                 rain: T.Iterable[int],
+                 wind_velocity: T.Iterable[int]):
+        self._timestamps = timestamps
+        self._columns = {
+            'temperature': _to_column(temperature),
+            'cloudiness': _to_column(cloudiness),
+            'rain': _to_column(rain),
+            'wind_velocity': _to_column(wind_velocity),
+        }
+
+        for name, column in self._columns.items():
+            if len(column) != len(timestamps):
+                msg = '{} has {} values, but there are {} timestamps.'
+                raise ValueError(msg.format(name, len(column),
+                                            len(timestamps)))
+
+    @classmethod
+    def from_dict(cls, data: T.Mapping[str, T.Sequence]) -> 'Forecast':
+        """
+        Creates a Forecast from a dict of lists. The timestamps must be
+        datetimes in hourly steps.
+
+        :param data:
+        :return:
+        """
+        timestamps = data['timestamp']
+        if not isinstance(timestamps, Timestamps):
+            start = timestamps[0] if len(timestamps) else None
+            timestamps = Timestamps(start, len(timestamps))
+
+        return cls(timestamps, **{name: data[name] for name in COLUMNS})
+
+    @property
+    def timestamps(self) -> Timestamps:
+        return self._timestamps
+
+    def __getitem__(self, key: str):
+        if key == 'timestamp':
+            return self._timestamps
+        return self._columns[key]
+
+    def __iter__(self) -> T.Iterator[str]:
+        return iter(KEYS)
+
+    def __len__(self) -> int:
+        return len(KEYS)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Forecast):
+            return self._timestamps == other._timestamps and \
+                self._columns == other._columns
+        return super().__eq__(other)
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return Forecast, (self._timestamps, ) + tuple(
+            array.array(TYPECODE, self._columns[name]) for name in COLUMNS
+        )
+
+    def __repr__(self) -> str:
+        return 'Forecast(start={!r}, hours={})'.format(
+            self._timestamps.start, len(self._timestamps)
+        )
+
+    def column(self, name: str) -> memoryview:
+        """
+        Returns a read-only view of the column without copying the data.
+        It is the same as `forecast[name]`.
+
+        :param name:
+        :return:
+        """
+        return self._columns[name]
+
+    def to_numpy(self, name: str):
+        """
+        Returns the column as NumPy array without copying the data.
+        The array is read-only.
+
+        :param name:
+        :return:
+        """
+        # NumPy is only imported when it is needed, since the import is
+        # slow and would delay the start of the command line tools.
+        try:
+            import numpy as np
+        except ImportError:
+            msg = 'NumPy is required for Forecast.to_numpy.'
+            raise ImportError(msg)
+
+        column = np.frombuffer(self._columns[name], dtype=TYPECODE)
+        column.flags.writeable = False
+        return column
+
+    def to_dict(self) -> T.Dict[str, list]:
+        """
+        Returns the forecast as dict of lists.
+
+        :return:
+        """
+        data = {'timestamp': list(self._timestamps)}
+        for name, column in self._columns.items():
+            data[name] = column.tolist()
+        return data
+
+
+def _to_column(values: T.Iterable[int]) -> memoryview:
+    """
+    Returns the values as read-only view of C ints. The views of bytes are
+    read-only in every Python version.
+
+    :param values:
+    :return:
+    """
+    if isinstance(values, memoryview) and values.readonly and \
+            values.format == TYPECODE and values.ndim == 1:
+        return values
+    if not isinstance(values, array.array) or values.typecode != TYPECODE:
+        values = array.array(TYPECODE, values)
+    return memoryview(values.tobytes()).cast(TYPECODE)
@@ -0,0 +1,278 @@
+"""
+This file contains the bulk ingestion of saved pages.
+Saved wetter.at pages, e. g. the pages of a DiskCache, are parsed in a pool
+of processes, so re-parsing thousands of pages after a parser change uses
+every core. The pages are sent to the processes in chunks and the forecasts
+are returned in the order of the pages or as soon as they are parsed. The
+forecasts can be added to a backlog directory.
+"""
+
+import collections
+import datetime
+import json
+import os
+import typing as T
+from concurrent.futures import FIRST_COMPLETED, Executor, \
+    ProcessPoolExecutor, wait
+from pathlib import PurePath
+
+from weatheregg.compression import SUFFIXES, read_file
+from weatheregg.forecast import Forecast
+from weatheregg.weatheregg import check_backlog, create_store, parse_page, \
+    save_to_backlog
+
+CHUNK_SIZE = 32  # pages per task
+# the first line of a DiskCache file
+DISK_CACHE_HEADER = b'{"url": '
+PAGE_SUFFIXES = ('.html', '.htm') + tuple(SUFFIXES.values())
+
+
+class Page(T.NamedTuple):
+    key: T.Hashable  # e. g. the path of the file
+    content: bytes
+    fetched: T.Union[datetime.datetime, None]  # None is now
+
+
+class Parsed(T.NamedTuple):
+    key: T.Hashable
+    fetched: T.Union[datetime.datetime, None]
+    forecast: T.Union[Forecast, None]
+    error: T.Union[Exception, None]
+
+
+class IngestResult(T.NamedTuple):
+    parsed: int
+    failed: int
+
+
+def _parse_chunk(chunk: T.List[T.Tuple[bytes, T.Union[datetime.datetime,
+                                                      None]]],
+                 tz: T.Union[datetime.tzinfo, None]
+                 ) -> T.List[T.Tuple[T.Union[Forecast, None],
+                                     T.Union[Exception, None]]]:
+    """
+    Parses the pages of a chunk in a worker process. The errors are
+    returned instead of raised, so one broken page does not fail the chunk.
+
+    :param chunk: tuples of the page and the time of its request
+    :param tz:
+    :return:
+    """
+    results = []
+    for content, fetched in chunk:
+        try:
+            results.append((parse_page(content, tz=tz, now=fetched), None))
+        except Exception as error:
+            results.append((None, error))
+    return results
+
+
+def _chunks(pages: T.Iterable[Page],
+            chunk_size: int) -> T.Iterator[T.List[Page]]:
+    chunk = []
+    for page in pages:
+        chunk.append(page)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_parse(pages: T.Iterable[Page],
+               workers: T.Union[int, None] = None,
+               chunk_size: int = CHUNK_SIZE,
+               ordered: bool = True,
+               tz: T.Union[datetime.tzinfo, None] = None,
+               executor: T.Union[Executor, None] = None
+               ) -> T.Iterator[Parsed]:
+    """
+    Parses the pages in a pool of processes. Only a few chunks per process
+    are parsed ahead, so the pages are read lazily.
+
+    Usage::
+        >>> for key, fetched, forecast, error in iter_parse(
+        ...         read_pages(['/home/user/pages'])
+        ... ):  # doctest: +SKIP
+        ...     print(key, error or forecast['temperature'][0])
+
+    :param pages:
+    :param workers: number of processes, defaults to the number of cores.
+        0 parses in this process.
+    :param chunk_size: pages per task
+    :param ordered: yield the results in the order of the pages instead
+        of as soon as they are parsed
+    :param tz:
+    :param executor: an existing pool, e. g. a ThreadPoolExecutor
+    :return:
+    """
+    if chunk_size < 1:
+        msg = 'The chunk size must be at least 1. Got {}.'
+        raise ValueError(msg.format(chunk_size))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 0:
+        msg = 'The number of workers must not be negative. Got {}.'
+        raise ValueError(msg.format(workers))
+
+    chunks = _chunks(pages, chunk_size)
+
+    if executor is None and workers == 0:
+        for chunk in chunks:
+            yield from _results(chunk, _parse_chunk(_payload(chunk), tz))
+        return
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+
+    try:
+        yield from _iter_pool(executor, chunks, max(workers, 1) * 2,
+                              ordered, tz)
+    finally:
+        if own_executor:
+            executor.shutdown(wait=True)
+
+
+def _payload(chunk: T.List[Page]
+             ) -> T.List[T.Tuple[bytes, T.Union[datetime.datetime, None]]]:
+    # the keys stay in this process.
+    return [(page.content, page.fetched) for page in chunk]
+
+
+def _results(chunk: T.List[Page], results) -> T.Iterator[Parsed]:
+    for page, (forecast, error) in zip(chunk, results):
+        yield Parsed(page.key, page.fetched, forecast, error)
+
+
+def _iter_pool(executor: Executor,
+               chunks: T.Iterator[T.List[Page]],
+               max_pending: int,
+               ordered: bool,
+               tz: T.Union[datetime.tzinfo, None]) -> T.Iterator[Parsed]:
+    pending = collections.OrderedDict()  # future -> chunk
+
+    def submit() -> None:
+        while len(pending) < max_pending:
+            chunk = next(chunks, None)
+            if chunk is None:
+                return
+            future = executor.submit(_parse_chunk, _payload(chunk), tz)
+            pending[future] = chunk
+
+    try:
+        submit()
+        while pending:
+            if ordered:
+                done = [next(iter(pending))]
+            else:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                chunk = pending.pop(future)
+                yield from _results(chunk, future.result())
+            submit()
+    finally:
+        # the caller stopped early.
+        for future in pending:
+            future.cancel()
+
+
+def list_page_files(paths: T.Iterable[T.Union[str, PurePath]]
+                    ) -> T.List[str]:
+    """
+    Returns the page files of the paths. Directories are searched
+    recursively for html files and compressed files, like the files of a
+    DiskCache.
+
+    :param paths: files and directories
+    :return:
+    """
+    files = []
+    for file_path in paths:
+        file_path = str(file_path)
+        if not os.path.isdir(file_path):
+            files.append(file_path)
+            continue
+
+        for root, _, names in os.walk(file_path):
+            files.extend(os.path.join(root, name) for name in names
+                         if name.endswith(PAGE_SUFFIXES))
+    return files
+
+
+def read_pages(paths: T.Iterable[T.Union[str, PurePath]],
+               tz: T.Union[datetime.tzinfo, None] = None
+               ) -> T.Iterator[Page]:
+    """
+    Reads the page files of the paths, oldest first. The modification time
+    of a file is the time of the request, except for the pages of a
+    DiskCache, which store the time of the request. Compressed pages are
+    decompressed.
+
+    :param paths: files and directories
+    :param tz:
+    :return:
+    """
+    files = sorted((os.stat(file_path).st_mtime, file_path)
+                   for file_path in list_page_files(paths))
+    for mtime, file_path in files:
+        content = read_file(file_path)
+
+        if content.startswith(DISK_CACHE_HEADER):
+            header, _, content = content.partition(b'\n')
+            mtime = json.loads(header).get('stored', mtime)
+
+        fetched = datetime.datetime.fromtimestamp(mtime, tz)
+        yield Page(file_path, content, fetched)
+
+
+def ingest(pages: T.Iterable[Page],
+           back_log_dir: T.Union[str, PurePath],
+           backlog: str = 'csv',
+           fsync: bool = False,
+           compression: T.Union[str, None] = None,
+           workers: T.Union[int, None] = None,
+           chunk_size: int = CHUNK_SIZE,
+           ordered: bool = True,
+           tz: T.Union[datetime.tzinfo, None] = None,
+           on_error: T.Union[T.Callable[[Parsed], None], None] = None
+           ) -> IngestResult:
+    """
+    Parses the pages and adds their forecasts to the backlog directory.
+    The segment backlogs should be written in order.
+
+    :param pages:
+    :param back_log_dir:
+    :param backlog: csv, segments or delta
+    :param fsync: flush the files to the disk
+    :param compression: gzip or zstd compresses the csv backlog files
+    :param workers: number of processes, defaults to the number of cores
+    :param chunk_size: pages per task
+    :param ordered: write the forecasts in the order of the pages
+    :param tz:
+    :param on_error: called with every page which could not be parsed
+    :return:
+    """
+    check_backlog(backlog, compression)
+    os.makedirs(str(back_log_dir), exist_ok=True)
+
+    store = create_store(back_log_dir, backlog)
+    parsed = failed = 0
+    for result in iter_parse(pages, workers=workers, chunk_size=chunk_size,
+                             ordered=ordered, tz=tz):
+        if result.error is not None:
+            failed += 1
+            if on_error is not None:
+                on_error(result)
+            continue
+
+        fetched = result.fetched
+        if fetched is None:
+            fetched = datetime.datetime.now(tz=tz)
+        save_to_backlog(result.forecast, back_log_dir, fetched,
+                        backlog=backlog, fsync=fsync,
+                        compression=compression, store=store)
+        parsed += 1
+    return IngestResult(parsed, failed)
@@ -0,0 +1,175 @@
+"""
+This file contains the logging of the recorders.
+The weatheregg logger is configured once per process. Its records are put
+into a queue and a background thread formats them and writes them to stderr
+and the log files, so neither the formatting nor the disk I/O of the logs
+blocks the updates. The records can be written as one json object per line,
+e. g. for a log collector.
+
+Usage::
+    >>> logger = configure_logging('/home/user/weather/weatheregg.log',
+    ...                            json_format=True)  # doctest: +SKIP
+    >>> logger.info('Load data from %s.', url,
+    ...             extra={'location': url})  # doctest: +SKIP
+
+"""
+
+import atexit
+import datetime
+import json
+import logging
+import os
+import queue
+import threading
+import typing as T
+from logging.handlers import QueueHandler, QueueListener
+from pathlib import PurePath
+
+LOGGER_NAME = 'weatheregg_logger'
+TEXT_FORMAT = '[%(levelname)s] - %(asctime)s - %(message)s'
+
+# the attributes of every record. The other attributes are extra fields.
+RECORD_ATTRIBUTES = frozenset(
+    vars(logging.LogRecord('', logging.INFO, '', 0, '', (), None))
+) | {'message', 'asctime'}
+
+# the key of the stderr handler
+STREAM = '<stderr>'
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as json object with the time, the level, the logger,
+    the message, the extra fields and the traceback.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc
+            ).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith('_'):
+                data[key] = value
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        if record.stack_info:
+            data['stack'] = self.formatStack(record.stack_info)
+
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class LocalQueueHandler(QueueHandler):
+    """
+    Puts the records into the queue without formatting them. The records
+    never leave the process, so they do not need to be pickled.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+_lock = threading.Lock()
+_queue = queue.Queue(-1)  # type: queue.Queue
+# the path of the log file or STREAM -> its handler
+_handlers = {}  # type: T.Dict[str, logging.Handler]
+_listener = None  # type: T.Union[QueueListener, None]
+_json_format = False
+
+
+def configure_logging(file_path: T.Union[str, PurePath, None] = None,
+                      json_format: T.Union[bool, None] = None,
+                      level: T.Union[int, None] = None) -> logging.Logger:
+    """
+    Configures the weatheregg logger and returns it. The records are
+    written to stderr and to the log files. Further calls only add log
+    files which are not written yet or change the format or the level, so
+    every record is written once per file.
+
+    :param file_path: a log file
+    :param json_format: write json objects instead of text lines. None
+        keeps the current format.
+    :param level: None keeps the current level, which is INFO by default
+    :return:
+    """
+    global _listener, _json_format
+
+    logger = logging.getLogger(LOGGER_NAME)
+
+    with _lock:
+        changed = _listener is None
+
+        if json_format is not None and json_format != _json_format:
+            _json_format = json_format
+            changed = True
+
+        if STREAM not in _handlers:
+            _handlers[STREAM] = logging.StreamHandler()
+
+        if file_path is not None:
+            key = os.path.abspath(str(file_path))
+            if key not in _handlers:
+                _handlers[key] = logging.FileHandler(key, encoding='utf-8')
+                changed = True
+
+        if level is not None:
+            logger.setLevel(level)
+        elif logger.level == logging.NOTSET:
+            logger.setLevel(logging.INFO)
+
+        if changed:
+            # the listener writes the queued records before it stops.
+            if _listener is not None:
+                _listener.stop()
+
+            formatter = JsonFormatter() if _json_format else \
+                logging.Formatter(TEXT_FORMAT)
+            for handler in _handlers.values():
+                handler.setFormatter(formatter)
+
+            _listener = QueueListener(_queue, *_handlers.values(),
+                                      respect_handler_level=True)
+            _listener.start()
+
+        if not any(isinstance(handler, LocalQueueHandler)
+                   for handler in logger.handlers):
+            logger.addHandler(LocalQueueHandler(_queue))
+
+    return logger
+
+
+def shutdown_logging() -> None:
+    """
+    Writes the queued records, stops the background thread and closes the
+    log files. The next `configure_logging` starts over.
+
+    :return:
+    """
+    global _listener, _json_format
+
+    logger = logging.getLogger(LOGGER_NAME)
+
+    with _lock:
+        for handler in list(logger.handlers):
+            if isinstance(handler, LocalQueueHandler):
+                logger.removeHandler(handler)
+
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+        for handler in _handlers.values():
+            handler.close()
+        _handlers.clear()
+        _json_format = False
+
+
+atexit.register(shutdown_logging)
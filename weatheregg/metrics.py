@@ -0,0 +1,423 @@
+"""
+This file contains the metrics of the recorders.
+The duration of the request, the parsing and the saving of the updates, the
+results of the updates, the time of the last successful update of every
+location, the events of the retry policies and the delay of the updates are
+collected in a registry. The registry is exported in the Prometheus text
+format to a file, e. g. for the textfile collector of the node exporter, or
+from a local http endpoint.
+
+Usage::
+    >>> with timed('parse'):
+    ...     forecast = parse_response(response)  # doctest: +SKIP
+    >>> write_textfile('/var/lib/node_exporter/weatheregg.prom'
+    ...                )  # doctest: +SKIP
+    >>> server = start_http_server(9800)  # doctest: +SKIP
+
+"""
+
+import bisect
+import contextlib
+import math
+import os
+import threading
+import time
+import typing as T
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import PurePath
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+METRICS_PATH = '/metrics'
+
+# seconds
+BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30.)
+DRIFT_BUCKETS = (.1, .5, 1., 5., 10., 30., 60., 300., 900.)
+
+# the stages of an update
+REQUEST = 'request'
+PARSE = 'parse'
+SAVE = 'save'
+
+# the results of an update
+SAVED = 'saved'
+UNCHANGED = 'unchanged'
+FAILED = 'failed'
+REJECTED = 'rejected'  # skipped by an open circuit
+
+# the name, the labels and the value
+Sample = T.Tuple[str, T.Tuple[T.Tuple[str, str], ...], float]
+
+
+def format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value))
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('\n', r'\n') \
+        .replace('"', r'\"')
+
+
+class Metric:
+    """
+    A metric with a value per combination of label values.
+    """
+
+    kind = 'untyped'
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 label_names: T.Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        # label values -> value
+        self._values = {}  # type: T.Dict[T.Tuple[str, ...], T.Any]
+        self._lock = threading.Lock()
+
+    def _key(self, labels: T.Mapping[str, T.Any]) -> T.Tuple[str, ...]:
+        if set(labels) != set(self.label_names):
+            msg = '{} has the labels {}. Got {}.'
+            raise ValueError(msg.format(self.name, self.label_names,
+                                        tuple(labels)))
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def samples(self) -> T.Iterator[Sample]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name, tuple(zip(self.label_names, key)), value
+
+    def render(self) -> str:
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        for name, labels, value in self.samples():
+            if labels:
+                name += '{' + ','.join('{}="{}"'.format(k, escape(v))
+                                       for k, v in labels) + '}'
+            lines.append('{} {}'.format(name, format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1., **labels) -> None:
+        if amount < 0:
+            msg = 'Counters can only increase. Got {}.'
+            raise ValueError(msg.format(amount))
+
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1., **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.) + amount
+
+    def value(self, **labels) -> T.Union[float, None]:
+        with self._lock:
+            return self._values.get(self._key(labels))
+
+
+class Histogram(Metric):
+    """
+    Counts the observations per bucket. The buckets are the upper bounds of
+    the observations.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 label_names: T.Sequence[str] = (),
+                 buckets: T.Sequence[float] = BUCKETS):
+        if 'le' in label_names:
+            msg = 'The label le is reserved for the buckets of {}.'
+            raise ValueError(msg.format(name))
+
+        buckets = sorted(float(bucket) for bucket in buckets)
+        if not buckets or buckets[-1] != math.inf:
+            buckets.append(math.inf)
+
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # the counts of the buckets, the sum and the count
+                counts = self._values[key] = [0] * len(self.buckets) + [0., 0]
+            counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels) -> T.Iterator[None]:
+        """
+        Observes the seconds the context takes.
+
+        :param labels:
+        :return:
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            counts = self._values.get(self._key(labels))
+            return 0 if counts is None else counts[-1]
+
+    def sum(self, **labels) -> float:
+        with self._lock:
+            counts = self._values.get(self._key(labels))
+            return 0. if counts is None else counts[-2]
+
+    def samples(self) -> T.Iterator[Sample]:
+        with self._lock:
+            values = sorted((key, list(counts))
+                            for key, counts in self._values.items())
+
+        for key, counts in values:
+            labels = tuple(zip(self.label_names, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield (self.name + '_bucket',
+                       labels + (('le', format_value(bound)), ),
+                       cumulative)
+            yield self.name + '_sum', labels, counts[-2]
+            yield self.name + '_count', labels, counts[-1]
+
+
+class Registry:
+    """
+    The metrics of a process.
+    """
+
+    def __init__(self):
+        self._metrics = {}  # type: T.Dict[str, Metric]
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                msg = 'A metric named {} is already registered.'
+                raise ValueError(msg.format(metric.name))
+            self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> Metric:
+        with self._lock:
+            return self._metrics[name]
+
+    def counter(self, name: str, documentation: str,
+                label_names: T.Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str,
+              label_names: T.Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, label_names))
+
+    def histogram(self, name: str, documentation: str,
+                  label_names: T.Sequence[str] = (),
+                  buckets: T.Sequence[float] = BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, label_names,
+                                       buckets))
+
+    def clear(self) -> None:
+        """
+        Removes the values of all metrics.
+
+        :return:
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.clear()
+
+    def render(self) -> str:
+        """
+        Returns the metrics in the Prometheus text format.
+
+        :return:
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return ''.join(metric.render() for metric in metrics)
+
+
+# shared by all recorders of a process
+REGISTRY = Registry()
+
+STAGE_DURATION = REGISTRY.histogram(
+    'weatheregg_stage_duration_seconds',
+    'Duration of the request, parsing and saving of the forecasts.',
+    ('stage', )
+)
+STAGE_FAILURES = REGISTRY.counter(
+    'weatheregg_stage_failures_total',
+    'Stages which raised an error.',
+    ('stage', )
+)
+UPDATES = REGISTRY.counter(
+    'weatheregg_updates_total',
+    'Updates of the recorders by location and result.',
+    ('location', 'result')
+)
+LAST_SUCCESS = REGISTRY.gauge(
+    'weatheregg_last_success_timestamp_seconds',
+    'Unix time of the last successful update of the location.',
+    ('location', )
+)
+UPDATE_DRIFT = REGISTRY.histogram(
+    'weatheregg_update_drift_seconds',
+    'Seconds the updates started after their scheduled time.',
+    buckets=DRIFT_BUCKETS
+)
+RETRY_EVENTS = REGISTRY.counter(
+    'weatheregg_retry_events_total',
+    'Requests, failures, retries, exhausted budgets, rejected updates and '
+    'opened circuits of the retry policies.',
+    ('event', )
+)
+CIRCUIT_OPEN = REGISTRY.gauge(
+    'weatheregg_circuit_open',
+    '1 while the requests to the host are paused after failures.',
+    ('host', )
+)
+
+
+@contextlib.contextmanager
+def timed(stage: str) -> T.Iterator[None]:
+    """
+    Observes the duration of a stage of an update and counts the stage as
+    failed if it raises an error.
+
+    :param stage: request, parse or save
+    :return:
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_FAILURES.inc(stage=stage)
+        raise
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, stage=stage)
+
+
+def record_update(location: str,
+                  result: str,
+                  now: T.Union[float, None] = None,
+                  drift: T.Union[float, None] = None) -> None:
+    """
+    Records the result of an update of a recorder.
+
+    :param location: the url of the location
+    :param result: saved, unchanged, failed or rejected
+    :param now: unix time of the update, defaults to now
+    :param drift: seconds the update started after its scheduled time
+    :return:
+    """
+    UPDATES.inc(location=location, result=result)
+    if result in (SAVED, UNCHANGED):
+        LAST_SUCCESS.set(time.time() if now is None else now,
+                         location=location)
+    if drift is not None:
+        UPDATE_DRIFT.observe(drift)
+
+
+def write_textfile(file_path: T.Union[str, PurePath],
+                   registry: T.Union[Registry, None] = None) -> None:
+    """
+    Replaces the file atomically with the metrics, e. g. for the textfile
+    collector of the node exporter.
+
+    :param file_path: should end with .prom
+    :param registry: defaults to the registry of the process
+    :return:
+    """
+    registry = registry if registry is not None else REGISTRY
+    file_path = os.path.abspath(str(file_path))
+    temp_path = '{}.{}.tmp'.format(file_path, uuid.uuid4().hex)
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(registry.render())
+        os.replace(temp_path, file_path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in (METRICS_PATH, '/'):
+            self.send_error(404)
+            return
+
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_http_server(port: int,
+                      address: str = '127.0.0.1',
+                      registry: T.Union[Registry, None] = None
+                      ) -> ThreadingHTTPServer:
+    """
+    Serves the metrics at http://address:port/metrics from a daemon
+    thread. Call `shutdown` on the returned server to stop it.
+
+    :param port: 0 picks a free port
+    :param address: listen on all interfaces with 0.0.0.0
+    :param registry: defaults to the registry of the process
+    :return:
+    """
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry if registry is not None else REGISTRY
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True,
+                              name='weatheregg-metrics')
+    thread.start()
+    return server
@@ -0,0 +1,262 @@
+"""
+This file contains the BacklogReader.
+The BacklogReader answers queries over the backlog of a location. It keeps
+an index of the snapshots by the time of their update, so a query only
+loads the csv files or segment records it needs. The results are
+generated one after another instead of being loaded all at once.
+Compressed csv files are read transparently and `convert_backlog` converts
+a backlog directory to another compression.
+"""
+
+import bisect
+import csv
+import datetime
+import io
+import os
+import threading
+import typing as T
+from pathlib import PurePath
+
+from weatheregg.backlog import IndexEntry, SegmentStore, Snapshot, \
+    from_seconds, to_seconds
+from weatheregg.compression import compress, compression_of, read_file, \
+    strip_suffix, suffix
+from weatheregg.forecast import COLUMNS, Forecast, Timestamps
+from weatheregg.weatheregg import DATA_DIR_NAME, FILE_PATTERN, \
+    TIMESTAMP_FORMAT, write_file
+
+# e. g. 2019_06_01_22_00.csv
+FILE_NAME_FORMAT = FILE_PATTERN.replace('{0:', '').replace('}', '')
+
+HOUR = datetime.timedelta(hours=1)
+MAX_LEAD_TIME = 48  # hours
+
+Source = T.Union[str, IndexEntry]
+
+
+class LeadTime(T.NamedTuple):
+    lead: int  # hours
+    issued: datetime.datetime
+    temperature: int
+    cloudiness: int
+    rain: int
+    wind_velocity: int
+
+
+def read_csv(file_path: T.Union[str, PurePath]) -> Forecast:
+    """
+    Reads a forecast which was written by `save_data_to_csv`. Compressed
+    files are decompressed.
+
+    :param file_path:
+    :return:
+    """
+    text = read_file(file_path).decode('utf-8')
+    rows = [row for row in csv.reader(io.StringIO(text, newline=''))
+            if row]
+
+    if len(rows) < 2:
+        msg = '{} does not contain a forecast.'
+        raise ValueError(msg.format(file_path))
+
+    header, rows = rows[0], rows[1:]
+    columns = {name: [int(row[i]) for row in rows]
+               for i, name in enumerate(header) if name in COLUMNS}
+    start = datetime.datetime.strptime(rows[0][0], TIMESTAMP_FORMAT)
+    return Forecast(Timestamps(start, len(rows)), **columns)
+
+
+def list_csv_files(directory: T.Union[str, PurePath]
+                   ) -> T.List[T.Tuple[datetime.datetime, str]]:
+    """
+    Returns the time of the update and the path of every csv file in the
+    backlog directory.
+
+    :param directory:
+    :return:
+    """
+    files = []
+    with os.scandir(str(directory)) as entries:
+        for entry in entries:
+            try:
+                fetched = datetime.datetime.strptime(
+                    strip_suffix(entry.name), FILE_NAME_FORMAT
+                )
+            except ValueError:
+                continue
+            files.append((fetched, entry.path))
+    return files
+
+
+def convert_backlog(directory: T.Union[str, PurePath],
+                    compression: T.Union[str, None],
+                    fsync: bool = False) -> int:
+    """
+    Converts all csv files of the backlog directory to the compression in
+    place. Every file is replaced by its converted copy, so the directory
+    can be read and written while it is converted.
+    Returns the number of converted files.
+
+    :param directory:
+    :param compression: gzip, zstd or None
+    :param fsync: flush the converted files to the disk
+    :return:
+    """
+    new_suffix = suffix(compression)
+
+    count = 0
+    for _, file_path in list_csv_files(directory):
+        if compression_of(file_path) == compression:
+            continue
+
+        data = compress(read_file(file_path), compression)
+        write_file(strip_suffix(file_path) + new_suffix, data, fsync=fsync)
+        os.remove(file_path)
+        count += 1
+    return count
+
+
+class BacklogReader:
+    """
+    Reads the csv files and segments of a backlog directory.
+
+    Usage::
+        >>> reader = BacklogReader('/home/user/data/')
+        >>> for fetched, forecast in reader.issued_between(
+        ...         datetime.datetime(2019, 6, 1),
+        ...         datetime.datetime(2019, 6, 2)
+        ... ):  # doctest: +SKIP
+        ...     print(fetched, forecast['temperature'][0])
+        >>> for lead_time in reader.lead_times(
+        ...         datetime.datetime(2019, 6, 2, 12)
+        ... ):  # doctest: +SKIP
+        ...     print(lead_time.lead, lead_time.temperature)
+
+    The index is cached and only rebuilt if files were added or removed.
+    """
+
+    def __init__(self, directory: T.Union[str, PurePath]):
+        directory = os.path.abspath(str(directory))
+        # a data directory contains the backlog directory.
+        back_log_dir = os.path.join(directory, DATA_DIR_NAME)
+        if os.path.isdir(back_log_dir):
+            directory = back_log_dir
+
+        self._directory = directory
+        self._store = SegmentStore(directory)
+        self._csv_version = None  # type: T.Union[int, None]
+        self._csv_index = []  # type: T.List[T.Tuple[int, str]]
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    def _read_csv_index(self) -> T.List[T.Tuple[int, str]]:
+        try:
+            version = os.stat(self._directory).st_mtime_ns
+        except FileNotFoundError:
+            return []
+
+        with self._lock:
+            if version == self._csv_version:
+                return self._csv_index
+
+        # a snapshot can exist twice while its compression is converted.
+        index = sorted({
+            to_seconds(fetched): file_path
+            for fetched, file_path in list_csv_files(self._directory)
+        }.items())
+
+        with self._lock:
+            self._csv_version = version
+            self._csv_index = index
+        return index
+
+    def index(self) -> T.List[T.Tuple[int, Source]]:
+        """
+        Returns the time of the update in seconds and the source of every
+        snapshot, sorted by the time of the update. The source is the path
+        of a csv file or the index entry of a segment.
+
+        :return:
+        """
+        entries = self._store.index()
+        # a compacted csv file can exist until it is removed.
+        segments = {entry.fetched for entry in entries}
+        index = [(fetched, file_path)
+                 for fetched, file_path in self._read_csv_index()
+                 if fetched not in segments]
+        index.extend((entry.fetched, entry) for entry in entries)
+        index.sort(key=lambda item: item[0])
+        return index
+
+    def _find(self,
+              issued_from: T.Union[datetime.datetime, None],
+              issued_to: T.Union[datetime.datetime, None]
+              ) -> T.List[T.Tuple[int, Source]]:
+        index = self.index()
+        keys = [fetched for fetched, _ in index]
+        lo = 0 if issued_from is None else \
+            bisect.bisect_left(keys, to_seconds(issued_from))
+        hi = len(index) if issued_to is None else \
+            bisect.bisect_left(keys, to_seconds(issued_to))
+        return index[lo:hi]
+
+    def _load(self, fetched: int, source: Source) -> Snapshot:
+        if isinstance(source, IndexEntry):
+            return self._store.read(source)
+        return Snapshot(from_seconds(fetched), read_csv(source))
+
+    def issued_between(self,
+                       issued_from: T.Union[datetime.datetime, None] = None,
+                       issued_to: T.Union[datetime.datetime, None] = None
+                       ) -> T.Iterator[Snapshot]:
+        """
+        Yields the snapshots which were issued between issued_from
+        (inclusive) and issued_to (exclusive), oldest first.
+        Files which are removed while reading are skipped.
+
+        :param issued_from:
+        :param issued_to:
+        :return:
+        """
+        for fetched, source in self._find(issued_from, issued_to):
+            try:
+                yield self._load(fetched, source)
+            except FileNotFoundError:
+                continue
+
+    def lead_times(self,
+                   hour: datetime.datetime,
+                   max_lead: int = MAX_LEAD_TIME
+                   ) -> T.Iterator[LeadTime]:
+        """
+        Yields the forecasts for the hour as they were issued 1 to max_lead
+        hours before, longest lead time first.
+
+        :param hour:
+        :param max_lead: hours
+        :return:
+        """
+        hour = hour.replace(tzinfo=None)
+        for fetched, source in self._find(hour - max_lead * HOUR, hour):
+            if isinstance(source, IndexEntry) and \
+                    not source.covers(to_seconds(hour)):
+                continue
+
+            try:
+                fetched, forecast = self._load(fetched, source)
+            except FileNotFoundError:
+                continue
+
+            timestamps = forecast.timestamps
+            offset, rest = divmod(hour - timestamps.start, timestamps.step)
+            if rest or not 0 <= offset < len(timestamps):
+                continue
+
+            yield LeadTime(
+                (hour - fetched) // HOUR,
+                fetched,
+                *(forecast[name][offset] for name in COLUMNS)
+            )
@@ -0,0 +1,380 @@
+"""
+This file contains the MultiRecorder.
+The MultiRecorder records the 48 hours forecast for many locations from a
+single process. The requests are spread evenly across the update interval
+instead of sending them all at once.
+"""
+
+import csv
+import functools
+import logging
+import sys
+import typing as T
+from pathlib import PurePath
+
+from weatheregg.aio import CONCURRENCY, validate_weathereggs
+from weatheregg.metrics import FAILED, REJECTED, SAVED, UNCHANGED, \
+    record_update, write_textfile
+from weatheregg.retry import RETRY_INTERVAL, RetryPolicy, default_policy
+from weatheregg.scheduler import Job, Scheduler
+from weatheregg.weatheregg import (
+    WeatherEgg,
+    WeathereggException,
+    create_logger
+)
+
+
+Location = T.Tuple[str, str, str, str]
+
+
+def read_locations(file_path: T.Union[str, PurePath]) -> T.List[Location]:
+    """
+    Reads a locations file. Every line contains the country, state, location
+    and data directory separated by commas. Empty lines and lines starting
+    with `#` are ignored.
+
+    :param file_path:
+    :return:
+    """
+    locations = []
+    with open(str(file_path), newline='') as f:
+        for line_number, row in enumerate(csv.reader(f), start=1):
+            row = [column.strip() for column in row]
+            if not any(row) or row[0].startswith('#'):
+                continue
+
+            if len(row) != 4:
+                msg = 'Line {} of {} must contain country, state, location ' \
+                      'and data directory. Got {}.'
+                raise ValueError(msg.format(line_number, file_path, row))
+
+            locations.append(tuple(row))
+
+    return locations
+
+
+class MultiRecorder:
+    """
+    Records many locations from one process.
+    Every WeatherEgg is updated in its own interval. The updates are spread
+    evenly across the interval, so the requests to wetter.at do not happen
+    all at once, and aligned to the wall clock, so they do not drift.
+
+    Usage::
+        >>> recorder = MultiRecorder.from_locations(
+        ...     read_locations('/home/user/locations.csv')
+        ... )  # doctest: +SKIP
+        >>> recorder.run_forever()  # doctest: +SKIP
+
+    """
+
+    # updates which start later are logged as warning
+    MAX_DRIFT = 60  # seconds
+    # seconds until the first retry, if no retry policy is given
+    RETRY_INTERVAL = RETRY_INTERVAL
+
+    def __init__(self,
+                 weathereggs: T.Sequence[WeatherEgg],
+                 logger: T.Union[logging.Logger, None] = None,
+                 offset: float = 0.,
+                 jitter: float = 0.,
+                 scheduler: T.Union[Scheduler, None] = None,
+                 retry_policy: T.Union[RetryPolicy, None] = None,
+                 metrics_file: T.Union[str, PurePath, None] = None):
+        """
+
+        :param weathereggs:
+        :param logger:
+        :param offset: minutes after the aligned times
+        :param jitter: maximum random delay of an update in minutes
+        :param scheduler:
+        :param retry_policy: defaults to the policy which is shared by all
+            recorders of the process, see weatheregg.retry.default_policy
+        :param metrics_file: the metrics are written to this file in the
+            Prometheus text format after every update
+        """
+        if any(weatheregg.data_dir is None for weatheregg in weathereggs):
+            msg = 'Please provide a data directory for every Weatheregg.'
+            raise ValueError(msg)
+
+        self._weathereggs = list(weathereggs)
+        self._logger = logger if logger is not None else create_logger()
+        self._offset = offset
+        self._jitter = jitter
+        self._scheduler = scheduler if scheduler is not None else \
+            Scheduler()
+        self._retry_policy = retry_policy if retry_policy is not None else \
+            default_policy(self.RETRY_INTERVAL)
+        self._metrics_file = metrics_file
+        # index of the weatheregg -> its job
+        self._jobs = {}  # type: T.Dict[int, Job]
+        # indices of the weathereggs which are not recorded anymore
+        self._stopped = set()  # type: T.Set[int]
+
+    @classmethod
+    def from_locations(cls,
+                       locations: T.Iterable[Location],
+                       tz: T.Union[str, None] = None,
+                       interval: int = 60,
+                       logger: T.Union[logging.Logger, None] = None,
+                       concurrency: int = CONCURRENCY,
+                       backlog: str = 'csv',
+                       fsync: bool = False,
+                       compression: T.Union[str, None] = None,
+                       offset: float = 0.,
+                       jitter: float = 0.,
+                       retry_policy: T.Union[RetryPolicy, None] = None,
+                       metrics_file: T.Union[str, PurePath, None] = None
+                       ) -> 'MultiRecorder':
+        """
+        Creates a WeatherEgg for every location. The locations are checked
+        concurrently. Invalid locations are logged and skipped.
+
+        :param locations:
+        :param tz:
+        :param interval:
+        :param logger:
+        :param concurrency: maximum number of requests at the same time
+        :param backlog: csv, segments or delta
+        :param fsync: flush the saved files to the disk
+        :param compression: gzip or zstd compresses the csv backlog files
+        :param offset: minutes after the aligned times
+        :param jitter: maximum random delay of an update in minutes
+        :param retry_policy:
+        :param metrics_file:
+        :return:
+        """
+        if logger is None:
+            logger = create_logger()
+
+        weathereggs = [
+            WeatherEgg(
+                country=country,
+                state=state,
+                location=location,
+                data_dir=data_dir,
+                tz=tz,
+                interval=interval,
+                validate='lazy',
+                backlog=backlog,
+                fsync=fsync,
+                compression=compression
+            )
+            for country, state, location, data_dir in locations
+        ]
+
+        invalid = set()
+        for weatheregg, error in validate_weathereggs(weathereggs,
+                                                      concurrency):
+            logger.exception(error, exc_info=error)
+            if isinstance(error, WeathereggException):
+                invalid.add(weatheregg)
+            # other locations are checked again with their first update.
+
+        weathereggs = [weatheregg for weatheregg in weathereggs
+                       if weatheregg not in invalid]
+        return cls(weathereggs, logger=logger, offset=offset, jitter=jitter,
+                   retry_policy=retry_policy, metrics_file=metrics_file)
+
+    @property
+    def weathereggs(self) -> T.List[WeatherEgg]:
+        """
+        Returns the recorded WeatherEggs.
+
+        :return:
+        """
+        return list(self._weathereggs)
+
+    @property
+    def scheduler(self) -> Scheduler:
+        return self._scheduler
+
+    @property
+    def retry_policy(self) -> RetryPolicy:
+        return self._retry_policy
+
+    def schedule(self, start: T.Union[float, None] = None) -> None:
+        """
+        Schedules the updates of every WeatherEgg. The updates are spread
+        evenly across the interval and aligned to the wall clock, e. g. with
+        4 locations and an interval of 60 minutes to 0, 15, 30 and 45
+        minutes after every full hour plus the offset.
+
+        :param start: unix time, defaults to now
+        :return:
+        """
+        for job in self._jobs.values():
+            self._scheduler.remove(job)
+        self._jobs = {}
+
+        n = len(self._weathereggs)
+        for i, weatheregg in enumerate(self._weathereggs):
+            if i in self._stopped:
+                continue
+
+            interval = weatheregg.interval * 60
+            self._jobs[i] = self._scheduler.add(
+                functools.partial(self._update, i),
+                interval,
+                offset=self._offset * 60 + i * interval / n,
+                jitter=self._jitter * 60,
+                start=start,
+                name=weatheregg.url
+            )
+
+    def save_first_forecasts(self) -> None:
+        """
+        Saves the forecasts of the location checks right away, so they are
+        not requested again. Locations whose forecast can not be saved are
+        not recorded.
+
+        :return:
+        """
+        for i, weatheregg in enumerate(self._weathereggs):
+            if weatheregg.first_forecast is not None:
+                self._update(i)
+
+    def next_update(self) -> T.Union[float, None]:
+        """
+        Returns the unix time of the next update or None if nothing is
+        scheduled.
+
+        :return:
+        """
+        return self._scheduler.next_run()
+
+    def run_pending(self, now: T.Union[float, None] = None) -> None:
+        """
+        Runs all updates which are due.
+
+        :param now: unix time
+        :return:
+        """
+        self._scheduler.run_pending(now)
+
+    def _stop_recording(self, i: int) -> None:
+        self._stopped.add(i)
+        job = self._jobs.pop(i, None)
+        if job is not None:
+            self._scheduler.remove(job)
+
+    def _update(self, i: int) -> T.Union[float, None]:
+        """
+        Records the i-th weatheregg once. Returns the time of the retry if
+        the update failed.
+
+        :param i:
+        :return:
+        """
+        try:
+            return self._record(i)
+        finally:
+            if self._metrics_file is not None:
+                try:
+                    write_textfile(self._metrics_file)
+                except OSError as error:
+                    self._logger.exception(error)
+
+    def _record(self, i: int) -> T.Union[float, None]:
+        weatheregg = self._weathereggs[i]
+        logger = logging.LoggerAdapter(self._logger,
+                                       {'location': weatheregg.url})
+        policy = self._retry_policy
+
+        if not policy.allow(weatheregg.url):
+            retry_at = policy.breaker(weatheregg.url).retry_at
+            wait = 0. if retry_at is None else \
+                retry_at - self._scheduler.clock.time()
+            logger.info('Skip %s. The requests to wetter.at failed too '
+                        'often. Try again in %.0f seconds at the earliest.',
+                        weatheregg.url, max(0., wait))
+            record_update(weatheregg.url, REJECTED,
+                          self._scheduler.clock.time())
+            return None
+
+        job = self._jobs.get(i)
+        # the first forecasts are saved before the jobs run.
+        drift = job.last_drift if job is not None and job.runs else None
+        if drift is not None and drift > self.MAX_DRIFT:
+            logger.warning('Update of %s started %.0f seconds late.',
+                           weatheregg.url, drift)
+
+        try:
+            logger.info('Load data from %s.', weatheregg.url)
+            data = weatheregg.update_forecast()
+
+        except WeathereggException as fatal_error:
+            # wetter.at answered, but the location is gone.
+            policy.success(weatheregg.url)
+            logger.exception(fatal_error)
+            logger.info('Stop recording %s.', weatheregg.url)
+            record_update(weatheregg.url, FAILED,
+                          self._scheduler.clock.time(), drift)
+            self._stop_recording(i)
+            return None
+
+        except Exception as error:
+            logger.exception(error)
+            now = self._scheduler.clock.time()
+            record_update(weatheregg.url, FAILED, now, drift)
+            retry_at = policy.failure(weatheregg.url)
+            job = self._jobs.get(i)
+            # a retry after the next regular update is pointless.
+            if retry_at is None or \
+                    (job is not None and retry_at >= job.next_boundary(now)):
+                logger.info('Last request for %s failed. Retry with the '
+                            'next update.', weatheregg.url)
+                return None
+
+            logger.info('Last request for %s failed. Retry in %.0f seconds',
+                        weatheregg.url, retry_at - now)
+            return retry_at
+
+        policy.success(weatheregg.url)
+        now = self._scheduler.clock.time()
+
+        if data is None:
+            logger.info('Forecast for %s unchanged (%d times). Skip saving.',
+                        weatheregg.url, weatheregg.unchanged)
+            record_update(weatheregg.url, UNCHANGED, now, drift)
+        else:
+            logger.info('Save weather data to %s.', weatheregg.data_dir)
+            try:
+                weatheregg.save(data)
+            except Exception as error:
+                logger.exception(error)
+                logger.info('Stop recording %s.', weatheregg.url)
+                record_update(weatheregg.url, FAILED, now, drift)
+                self._stop_recording(i)
+            else:
+                record_update(weatheregg.url, SAVED, now, drift)
+        return None
+
+    def run_forever(self) -> None:
+        """
+        Records all locations until no location is left or the process
+        receives SIGINT or SIGTERM.
+
+        :return:
+        """
+        if not self._weathereggs:
+            msg = 'Please provide at least one location.'
+            raise ValueError(msg)
+
+        self.schedule()
+        self.save_first_forecasts()
+
+        with self._scheduler.handle_signals():
+            self._scheduler.run()
+
+        self._logger.info('Retries: %s.', ', '.join(
+            '{} {}'.format(name, value) for name, value in
+            self._retry_policy.stats._asdict().items()
+        ))
+
+        if self._scheduler.stopped:
+            self._logger.info('Stopped recording.')
+            return
+
+        self._logger.error('No location left to record.')
+        sys.exit(1)
@@ -0,0 +1,383 @@
+"""
+This file contains the retry policy of the recorders.
+A failed update is retried with exponential backoff and random jitter, so
+the recorders of many processes do not retry in lockstep.
+A circuit breaker per host opens after repeated failures. While it is open
+no requests are sent to the host, which lets wetter.at recover from an
+outage. After a timeout one request is let through to test the host.
+A retry budget limits the retries to a fraction of the updates, so an
+outage does not multiply the load.
+
+The circuit breakers are shared by all WeatherEggs which use the same
+RetryPolicy, by default `SHARED_POLICY`.
+"""
+
+import collections
+import random
+import threading
+import typing as T
+from urllib.parse import urlsplit
+
+from weatheregg.metrics import CIRCUIT_OPEN, RETRY_EVENTS
+from weatheregg.scheduler import Clock
+
+RETRY_INTERVAL = 120  # seconds until the first retry
+MAX_RETRY_INTERVAL = 1800  # seconds
+BACKOFF_FACTOR = 2.
+JITTER = 0.5  # fraction of the delay
+
+FAILURE_THRESHOLD = 5  # consecutive failures which open the circuit
+RESET_TIMEOUT = 600  # seconds until an open circuit is tested
+
+BUDGET_RATIO = 0.2  # retries per update
+MIN_RETRIES = 10  # retries per window which are always allowed
+BUDGET_WINDOW = 3600  # seconds
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class RetryStats(T.NamedTuple):
+    requests: int  # allowed updates
+    failures: int
+    retries: int
+    budget_exhausted: int  # retries which were denied by the budget
+    rejected: int  # updates which were skipped by an open circuit
+    circuits_opened: int
+    open_circuits: int
+
+
+class Backoff:
+    """
+    Returns the delay of a retry. The delay grows exponentially with the
+    number of failed attempts up to `max_delay`. A random part of up to
+    `jitter` times the delay is subtracted, so retries spread out.
+    """
+
+    def __init__(self,
+                 base: float = RETRY_INTERVAL,
+                 factor: float = BACKOFF_FACTOR,
+                 max_delay: float = MAX_RETRY_INTERVAL,
+                 jitter: float = JITTER,
+                 rng: T.Union[random.Random, None] = None):
+        if base <= 0 or factor < 1 or max_delay < base:
+            msg = 'Invalid backoff: base {}, factor {}, max_delay {}.'
+            raise ValueError(msg.format(base, factor, max_delay))
+
+        if not 0 <= jitter <= 1:
+            msg = 'The jitter must be between 0 and 1. Got {}.'
+            raise ValueError(msg.format(jitter))
+
+        self.base = base
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self._random = rng if rng is not None else random.Random()
+
+    def delay(self, attempt: int) -> float:
+        """
+        Returns the delay in seconds after the n-th failed attempt.
+
+        :param attempt: starts at 1
+        :return:
+        """
+        exponent = min(max(attempt - 1, 0), 64)
+        delay = min(self.max_delay, self.base * self.factor ** exponent)
+        return delay - self._random.uniform(0., self.jitter * delay)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures. An open circuit
+    rejects all requests for `reset_timeout` seconds. Then it is half open
+    and lets one request through: a success closes the circuit, a failure
+    opens it again.
+    """
+
+    def __init__(self,
+                 failure_threshold: int = FAILURE_THRESHOLD,
+                 reset_timeout: float = RESET_TIMEOUT,
+                 clock: T.Union[Clock, None] = None):
+        if failure_threshold < 1:
+            msg = 'The failure threshold must be at least 1. Got {}.'
+            raise ValueError(msg.format(failure_threshold))
+
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock if clock is not None else Clock()
+        self._failures = 0
+        self._opened_at = None  # type: T.Union[float, None]
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """
+        Returns closed, open or half-open.
+
+        :return:
+        """
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return CLOSED
+        if self._clock.time() < self._opened_at + self.reset_timeout:
+            return OPEN
+        return HALF_OPEN
+
+    @property
+    def retry_at(self) -> T.Union[float, None]:
+        """
+        Returns the unix time when an open circuit is tested again or None
+        if the circuit is closed.
+
+        :return:
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return None
+            return self._opened_at + self.reset_timeout
+
+    def allow(self) -> bool:
+        """
+        Returns whether a request may be sent.
+
+        :return:
+        """
+        with self._lock:
+            state = self._state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self) -> bool:
+        """
+        Records a failed request. Returns True if the circuit opened.
+
+        :return:
+        """
+        with self._lock:
+            self._failures += 1
+            if self._trial or (self._opened_at is None and
+                               self._failures >= self.failure_threshold):
+                self._opened_at = self._clock.time()
+                self._trial = False
+                return True
+            return False
+
+
+class RetryBudget:
+    """
+    Allows `min_retries` plus `ratio` times the number of requests retries
+    within the last `window` seconds.
+    """
+
+    def __init__(self,
+                 ratio: float = BUDGET_RATIO,
+                 min_retries: int = MIN_RETRIES,
+                 window: float = BUDGET_WINDOW,
+                 clock: T.Union[Clock, None] = None):
+        if ratio < 0 or min_retries < 0 or window <= 0:
+            msg = 'Invalid retry budget: ratio {}, min_retries {}, ' \
+                  'window {}.'
+            raise ValueError(msg.format(ratio, min_retries, window))
+
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self._clock = clock if clock is not None else Clock()
+        self._requests = collections.deque()  # type: T.Deque[float]
+        self._retries = collections.deque()  # type: T.Deque[float]
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float) -> None:
+        for times in (self._requests, self._retries):
+            while times and times[0] <= now - self.window:
+                times.popleft()
+
+    def record_request(self) -> None:
+        with self._lock:
+            now = self._clock.time()
+            self._expire(now)
+            self._requests.append(now)
+
+    def withdraw(self) -> bool:
+        """
+        Takes a retry from the budget. Returns False if the budget is
+        exhausted.
+
+        :return:
+        """
+        with self._lock:
+            now = self._clock.time()
+            self._expire(now)
+            allowed = self.min_retries + self.ratio * len(self._requests)
+            if len(self._retries) >= allowed:
+                return False
+            self._retries.append(now)
+            return True
+
+
+class RetryPolicy:
+    """
+    Decides whether and when an update is sent or retried.
+
+    Usage::
+        >>> policy = RetryPolicy()
+        >>> url = 'http://www.wetter.at/wetter/oesterreich/wien/wien'
+        >>> if policy.allow(url):
+        ...     try:
+        ...         update()
+        ...     except Exception:
+        ...         retry_at = policy.failure(url)
+        ...     else:
+        ...         policy.success(url)  # doctest: +SKIP
+
+    `failure` returns the unix time of the retry or None if the update
+    should wait for its next regular time, because the circuit of the host
+    is open or the retry budget is exhausted.
+    """
+
+    def __init__(self,
+                 backoff: T.Union[Backoff, None] = None,
+                 budget: T.Union[RetryBudget, None] = None,
+                 failure_threshold: int = FAILURE_THRESHOLD,
+                 reset_timeout: float = RESET_TIMEOUT,
+                 clock: T.Union[Clock, None] = None):
+        self._clock = clock if clock is not None else Clock()
+        self._backoff = backoff if backoff is not None else Backoff()
+        self._budget = budget if budget is not None else \
+            RetryBudget(clock=self._clock)
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._breakers = {}  # type: T.Dict[str, CircuitBreaker]
+        # url -> consecutive failed attempts
+        self._attempts = {}  # type: T.Dict[str, int]
+        self._counts = collections.Counter()  # type: T.Counter[str]
+        self._lock = threading.Lock()
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        """
+        Returns the circuit breaker of the host of the url.
+
+        :param url:
+        :return:
+        """
+        host = urlsplit(url).netloc
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(self._failure_threshold,
+                                         self._reset_timeout,
+                                         clock=self._clock)
+                self._breakers[host] = breaker
+            return breaker
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+        RETRY_EVENTS.inc(event=name)
+
+    def allow(self, url: str) -> bool:
+        """
+        Returns whether the update of the url may be sent now.
+
+        :param url:
+        :return:
+        """
+        if not self.breaker(url).allow():
+            self._count('rejected')
+            return False
+
+        self._budget.record_request()
+        self._count('requests')
+        return True
+
+    def success(self, url: str) -> None:
+        with self._lock:
+            self._attempts.pop(url, None)
+        breaker = self.breaker(url)
+        if breaker.retry_at is not None:
+            CIRCUIT_OPEN.set(0, host=urlsplit(url).netloc)
+        breaker.record_success()
+
+    def failure(self, url: str) -> T.Union[float, None]:
+        """
+        Records a failed update and returns the unix time of its retry or
+        None if it is not retried.
+
+        :param url:
+        :return:
+        """
+        with self._lock:
+            attempt = self._attempts.get(url, 0) + 1
+            self._attempts[url] = attempt
+        self._count('failures')
+
+        breaker = self.breaker(url)
+        if breaker.record_failure():
+            self._count('circuits_opened')
+            CIRCUIT_OPEN.set(1, host=urlsplit(url).netloc)
+        if breaker.retry_at is not None:
+            return None
+
+        if not self._budget.withdraw():
+            self._count('budget_exhausted')
+            return None
+
+        self._count('retries')
+        return self._clock.time() + self._backoff.delay(attempt)
+
+    @property
+    def stats(self) -> RetryStats:
+        """
+        Returns the counters of the policy.
+
+        :return:
+        """
+        with self._lock:
+            counts = dict(self._counts)
+            breakers = list(self._breakers.values())
+        return RetryStats(
+            requests=counts.get('requests', 0),
+            failures=counts.get('failures', 0),
+            retries=counts.get('retries', 0),
+            budget_exhausted=counts.get('budget_exhausted', 0),
+            rejected=counts.get('rejected', 0),
+            circuits_opened=counts.get('circuits_opened', 0),
+            open_circuits=sum(breaker.state != CLOSED
+                              for breaker in breakers)
+        )
+
+
+# shared by all recorders of a process
+SHARED_POLICY = RetryPolicy()
+
+
+def default_policy(retry_interval: float = RETRY_INTERVAL) -> RetryPolicy:
+    """
+    Returns the policy of a recorder without a policy of its own: the shared
+    policy or, if the seconds until the first retry were changed, a new
+    policy with that interval.
+
+    :param retry_interval: e. g. the RETRY_INTERVAL of the recorder class
+    :return:
+    """
+    if retry_interval == RETRY_INTERVAL:
+        return SHARED_POLICY
+    return RetryPolicy(backoff=Backoff(
+        base=retry_interval,
+        max_delay=max(MAX_RETRY_INTERVAL, retry_interval)
+    ))
@@ -0,0 +1,377 @@
+"""
+This file contains the Scheduler.
+The Scheduler runs many periodic jobs from one timer heap. The runs are
+aligned to the wall clock, e. g. to every full hour plus an offset, so the
+schedule does not drift by the time the jobs take. A random jitter spreads
+the runs of many processes. The delay of every run is measured.
+
+The Scheduler waits on an event instead of sleeping, so it stops right away
+when `stop` is called. A signal handler only sets a flag, which is checked
+at least every SIGNAL_INTERVAL seconds while the signals are handled.
+The time is read from a clock, which is replaced by a FakeClock in tests.
+"""
+
+import contextlib
+import heapq
+import itertools
+import random
+import signal
+import threading
+import time
+import typing as T
+
+# signals which stop the scheduler
+SIGNALS = (signal.SIGINT, signal.SIGTERM)
+# seconds between the checks for a signal
+SIGNAL_INTERVAL = 0.5
+
+
+class Clock:
+    """
+    The system clock.
+    """
+
+    def time(self) -> float:
+        """
+        Returns the unix time.
+
+        :return:
+        """
+        return time.time()
+
+    def wait(self, event: threading.Event, timeout: float) -> bool:
+        """
+        Waits until the event is set or the timeout is over. Returns
+        whether the event is set.
+
+        :param event:
+        :param timeout: seconds
+        :return:
+        """
+        return event.wait(timeout)
+
+
+class FakeClock(Clock):
+    """
+    A clock which only moves forward when it is waited on or advanced.
+
+    Usage::
+        >>> clock = FakeClock(start=100.)
+        >>> clock.wait(threading.Event(), 20.)
+        False
+        >>> clock.time()
+        120.0
+
+    """
+
+    def __init__(self, start: float = 0.):
+        self._now = float(start)
+
+    def time(self) -> float:
+        return self._now
+
+    def advance(self, seconds: float) -> None:
+        """
+        Moves the clock forward.
+
+        :param seconds:
+        :return:
+        """
+        self._now += max(0., seconds)
+
+    def wait(self, event: threading.Event, timeout: float) -> bool:
+        if not event.is_set():
+            self.advance(timeout)
+        return event.is_set()
+
+
+class Job:
+    """
+    A periodic job of the Scheduler. The job runs at every multiple of the
+    interval plus the offset, counted from the unix epoch, plus a random
+    jitter.
+    """
+
+    def __init__(self,
+                 callback: T.Callable[[], T.Union[float, None]],
+                 interval: float,
+                 offset: float = 0.,
+                 jitter: float = 0.,
+                 name: T.Union[str, None] = None):
+        if interval <= 0:
+            msg = 'The interval must be positive. Got {}.'
+            raise ValueError(msg.format(interval))
+
+        if jitter < 0:
+            msg = 'The jitter must not be negative. Got {}.'
+            raise ValueError(msg.format(jitter))
+
+        self.callback = callback
+        self.interval = float(interval)
+        self.offset = float(offset) % self.interval
+        self.jitter = float(jitter)
+        self.name = name if name is not None else repr(callback)
+        # unix time of the next run
+        self.due = None  # type: T.Union[float, None]
+        self.removed = False
+        self.runs = 0
+        self.last_drift = 0.  # seconds
+        self.max_drift = 0.  # seconds
+        self._total_drift = 0.
+
+    @property
+    def mean_drift(self) -> float:
+        """
+        Returns the mean delay of the runs in seconds.
+
+        :return:
+        """
+        return self._total_drift / self.runs if self.runs else 0.
+
+    def next_boundary(self, after: float, inclusive: bool = False) -> float:
+        """
+        Returns the first aligned time after the given unix time.
+
+        :param after:
+        :param inclusive: also return the given time if it is aligned
+        :return:
+        """
+        k = (after - self.offset) // self.interval
+        if not inclusive or k * self.interval + self.offset < after:
+            k += 1
+        return k * self.interval + self.offset
+
+    def record_drift(self, drift: float) -> None:
+        """
+        Records the delay of a run.
+
+        :param drift: seconds
+        :return:
+        """
+        self.runs += 1
+        self.last_drift = drift
+        self.max_drift = max(self.max_drift, drift)
+        self._total_drift += drift
+
+    def __repr__(self) -> str:
+        return '<Job {} due={}>'.format(self.name, self.due)
+
+
+class Scheduler:
+    """
+    Runs periodic jobs.
+
+    A job is a callable without arguments. If it returns a unix time, the
+    job runs again at that time, e. g. to retry a failed request. Otherwise
+    it runs at the next aligned time. An exception of a job is raised by
+    `run_pending`; a job stops itself with `Scheduler.remove`.
+
+    Usage::
+        >>> scheduler = Scheduler(clock=FakeClock())
+        >>> job = scheduler.add(lambda: print('update'), interval=3600,
+        ...                     offset=300, start=0., immediately=True)
+        >>> scheduler.run_pending()
+        update
+        1
+        >>> scheduler.next_run()
+        300.0
+
+    """
+
+    def __init__(self,
+                 clock: T.Union[Clock, None] = None,
+                 rng: T.Union[random.Random, None] = None):
+        self._clock = clock if clock is not None else Clock()
+        self._random = rng if rng is not None else random.Random()
+        # heap of (due time, sequence number, job)
+        self._heap = []  # type: T.List[T.Tuple[float, int, Job]]
+        self._counter = itertools.count()
+        self._stop = threading.Event()
+        self._lock = threading.RLock()
+        # set by the signal handler
+        self._signaled = False
+        self._handling_signals = False
+
+    @property
+    def clock(self) -> Clock:
+        return self._clock
+
+    @property
+    def jobs(self) -> T.List[Job]:
+        """
+        Returns the scheduled jobs sorted by their next run.
+
+        :return:
+        """
+        with self._lock:
+            return [job for _, _, job in sorted(self._heap)]
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop.is_set() or self._signaled
+
+    def _stopping(self) -> bool:
+        if self._signaled:
+            self.stop()
+        return self._stop.is_set()
+
+    def add(self,
+            callback: T.Callable[[], T.Union[float, None]],
+            interval: float,
+            offset: float = 0.,
+            jitter: float = 0.,
+            start: T.Union[float, None] = None,
+            immediately: bool = False,
+            name: T.Union[str, None] = None) -> Job:
+        """
+        Schedules a job. The first run is at the first aligned time at or
+        after the start.
+
+        :param callback:
+        :param interval: seconds
+        :param offset: seconds after the aligned times, e. g. 300 with an
+            interval of 3600 runs the job 5 minutes after every full hour
+        :param jitter: maximum random delay in seconds
+        :param start: unix time, defaults to now
+        :param immediately: run the job at the start, then at the aligned
+            times
+        :param name: used in the logs
+        :return:
+        """
+        job = Job(callback, interval, offset=offset, jitter=jitter,
+                  name=name)
+        if start is None:
+            start = self._clock.time()
+        if not immediately:
+            start = self._aligned(job, start, inclusive=True)
+        self._push(job, start)
+        return job
+
+    def remove(self, job: Job) -> None:
+        """
+        Removes the job. Does nothing if the job is not scheduled.
+
+        :param job:
+        :return:
+        """
+        with self._lock:
+            self._heap = [item for item in self._heap if item[2] is not job]
+            heapq.heapify(self._heap)
+            job.due = None
+            job.removed = True
+
+    def _aligned(self, job: Job, after: float,
+                 inclusive: bool = False) -> float:
+        due = job.next_boundary(after, inclusive=inclusive)
+        if job.jitter:
+            due += self._random.uniform(0., job.jitter)
+        return due
+
+    def _push(self, job: Job, due: float) -> None:
+        with self._lock:
+            job.due = due
+            heapq.heappush(self._heap, (due, next(self._counter), job))
+
+    def next_run(self) -> T.Union[float, None]:
+        """
+        Returns the unix time of the next run or None if no job is
+        scheduled.
+
+        :return:
+        """
+        with self._lock:
+            if self._heap:
+                return self._heap[0][0]
+            return None
+
+    def run_pending(self, now: T.Union[float, None] = None) -> int:
+        """
+        Runs all jobs which are due and returns their number.
+
+        :param now: unix time, defaults to the time of the clock
+        :return:
+        """
+        # the delay is measured with the clock, unless the time is given.
+        measure = now is None
+        if now is None:
+            now = self._clock.time()
+
+        count = 0
+        while not self._stopping():
+            with self._lock:
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                due, _, job = heapq.heappop(self._heap)
+                job.due = None
+
+            started = self._clock.time() if measure else now
+            job.record_drift(max(0., started - due))
+            next_due = job.callback()
+            count += 1
+
+            if job.removed:
+                continue
+            if next_due is None:
+                next_due = self._aligned(job, max(now, due))
+            self._push(job, next_due)
+        return count
+
+    def run(self) -> None:
+        """
+        Runs the jobs until `stop` is called or no job is left.
+
+        :return:
+        """
+        while not self._stopping():
+            self.run_pending()
+
+            next_run = self.next_run()
+            if next_run is None:
+                return
+            timeout = max(0., next_run - self._clock.time())
+            if self._handling_signals:
+                # the signal handler does not wake up the wait.
+                timeout = min(timeout, SIGNAL_INTERVAL)
+            self._clock.wait(self._stop, timeout)
+
+    def stop(self) -> None:
+        """
+        Stops `run` after the running job. It is safe to call from other
+        threads, but not from signal handlers, see `handle_signals`.
+
+        :return:
+        """
+        self._stop.set()
+
+    @contextlib.contextmanager
+    def handle_signals(self,
+                       signals: T.Iterable[int] = SIGNALS
+                       ) -> T.Iterator[None]:
+        """
+        Stops the scheduler on the signals, e. g. Ctrl+C or `kill`, while
+        the context is active. Signal handlers can only be installed in the
+        main thread, so in other threads nothing is done and the scheduler
+        is stopped with `stop`.
+        The handler only sets a flag, because setting the event could
+        deadlock if the signal interrupts the wait on it. `run` checks the
+        flag at least every SIGNAL_INTERVAL seconds.
+
+        :param signals:
+        :return:
+        """
+        if threading.current_thread() is not threading.main_thread():
+            yield
+            return
+
+        def handler(signum, frame):
+            self._signaled = True
+
+        previous = {signum: signal.signal(signum, handler)
+                    for signum in signals}
+        self._handling_signals = True
+        try:
+            yield
+        finally:
+            self._handling_signals = False
+            for signum, previous_handler in previous.items():
+                signal.signal(signum, previous_handler)
@@ -0,0 +1,59 @@
+"""
+Factories of the forecasts and helpers which are shared by the tests.
+"""
+
+import datetime
+import os
+
+from weatheregg.backlog import LOCK_FILE_NAME
+from weatheregg.forecast import Forecast, Timestamps
+
+HOUR = datetime.timedelta(hours=1)
+START = datetime.datetime(2019, 6, 1, 22)
+# the time of the update of the forecast which starts at START
+FETCHED = datetime.datetime(2019, 6, 1, 21)
+
+
+def create_forecast(hours: int = 48) -> Forecast:
+    """
+    Creates a forecast with increasing values.
+
+    :param hours:
+    :return:
+    """
+    return Forecast(
+        Timestamps(START, hours),
+        temperature=range(hours),
+        cloudiness=range(0, 2 * hours, 2),
+        rain=[0] * hours,
+        wind_velocity=range(hours, 2 * hours)
+    )
+
+
+def create_update(i: int) -> Forecast:
+    """
+    Creates the forecast of the i-th hourly update. The forecasts of the
+    same hour only differ in the temperature of every 8th update.
+
+    :param i:
+    :return:
+    """
+    start = START + i * HOUR
+    return Forecast(
+        Timestamps(start, 48),
+        temperature=[h + i // 8 for h in range(i, i + 48)],
+        cloudiness=[10 * (h % 10) for h in range(i, i + 48)],
+        rain=[0] * 48,
+        wind_velocity=[5] * 48
+    )
+
+
+def list_files(directory):
+    """
+    Returns the sorted file names without the lock file.
+
+    :param directory:
+    :return:
+    """
+    return sorted(name for name in os.listdir(directory)
+                  if name != LOCK_FILE_NAME)
@@ -0,0 +1,152 @@
+"""
+A local stand-in for wetter.at. It serves the recorded pages from the data
+directory, so the tests do not depend on the live website.
+"""
+
+import contextlib
+import hashlib
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+from unittest import mock
+
+TEST_DIR = path.abspath(path.dirname(__file__))
+PAGE_DIR = path.join(TEST_DIR, 'data')
+
+URL_PATTERN = '{base}/wetter/{{country}}/{{state}}/{{location}}/' \
+              'prognose/stuendlich'
+
+LAST_MODIFIED = 'Sat, 01 Jun 2019 12:00:00 GMT'
+
+
+def list_pages() -> list:
+    """
+    Returns the names of all recorded pages.
+
+    :return:
+    """
+    return sorted(path.splitext(file_name)[0]
+                  for file_name in os.listdir(PAGE_DIR)
+                  if file_name.endswith('.html'))
+
+
+def read_page(name: str = 'moedling') -> bytes:
+    """
+    Returns a recorded wetter.at page.
+
+    :param name:
+    :return:
+    """
+    with open(path.join(PAGE_DIR, name + '.html'), 'rb') as f:
+        return f.read()
+
+
+class WetterAtHandler(BaseHTTPRequestHandler):
+    """
+    Serves the page of the server for every location except the missing
+    ones.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # the headers and the body are sent separately, which would wait for
+    # the delayed ack of the client.
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        # one handler is created for every connection
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((time.monotonic(), self.path))
+            server.headers.append(dict(self.headers))
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+
+        try:
+            # /wetter/{country}/{state}/{location}/prognose/stuendlich
+            parts = self.path.strip('/').split('/')
+            location = parts[3] if len(parts) == 6 else None
+
+            delay = server.delays.get(location, server.delay)
+            if delay:
+                time.sleep(delay)
+
+            if location is None or location in server.missing:
+                self._send(404, b'Not found')
+                return
+
+            page = server.pages.get(location, server.page)
+            etag = '"{}"'.format(hashlib.sha1(page).hexdigest()[:16])
+            if self.headers.get('If-None-Match') == etag:
+                self._send(304, b'', etag=etag)
+            else:
+                self._send(200, page, etag=etag)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def _send(self, status: int, body: bytes, etag: str = None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', LAST_MODIFIED)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@contextlib.contextmanager
+def stand_in_server(page: bytes = None,
+                    pages: dict = None,
+                    missing: tuple = ('somewhere', ),
+                    delay: float = 0.,
+                    delays: dict = None,
+                    handler=WetterAtHandler):
+    """
+    Starts the stand-in server and points the wetter.at url of weatheregg
+    to it while the context is active.
+
+    :param page: served for every location without a page of its own
+    :param pages: maps locations to pages
+    :param missing: locations which respond with 404
+    :param delay: seconds every request takes
+    :param delays: maps locations to the seconds their requests take
+    :param handler:
+    :return: the server
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    server.page = read_page() if page is None else page
+    server.pages = pages if pages is not None else {}
+    server.missing = missing
+    server.delay = delay
+    server.delays = delays if delays is not None else {}
+    server.lock = threading.Lock()
+    server.requests = []
+    server.headers = []
+    server.connections = 0
+    server.active = 0
+    server.max_active = 0
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    base = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    try:
+        with mock.patch('weatheregg.weatheregg.WETTER_AT',
+                        URL_PATTERN.format(base=base)):
+            yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
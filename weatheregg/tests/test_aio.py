@@ -0,0 +1,125 @@
+"""
+Tests for the asynchronous fetch engine
+"""
+
+import asyncio
+import time
+import unittest
+
+import requests
+
+from weatheregg.weatheregg import LocationError, WeatherEgg
+from weatheregg.aio import (
+    RateLimiter,
+    get_weather_for_locations,
+    iter_weather_for_locations,
+    validate_weathereggs
+)
+from weatheregg.tests.server import stand_in_server
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_000_invalid_rate(self):
+        with self.assertRaises(ValueError):
+            RateLimiter(0)
+
+
+class TestGetWeatherForLocations(unittest.TestCase):
+    def test_000_fetch_locations(self):
+        locations = [('oesterreich', 'wien', 'ort-{}'.format(i))
+                     for i in range(8)]
+
+        with stand_in_server() as server:
+            results = get_weather_for_locations(locations, concurrency=4)
+
+        self.assertEqual(len(server.requests), 8)
+        self.assertEqual(sorted(location for location, _ in results),
+                         sorted(locations))
+        for _, weather in results:
+            self.assertEqual(len(weather['temperature']), 48)
+            self.assertEqual(len(weather['timestamp']), 48)
+
+    def test_001_concurrency_cap(self):
+        locations = [('oesterreich', 'wien', 'ort-{}'.format(i))
+                     for i in range(9)]
+
+        with stand_in_server(delay=0.05) as server:
+            get_weather_for_locations(locations, concurrency=3)
+
+        self.assertEqual(server.max_active, 3)
+
+    def test_002_rate_limit(self):
+        locations = [('oesterreich', 'wien', 'ort-{}'.format(i))
+                     for i in range(4)]
+
+        with stand_in_server() as server:
+            get_weather_for_locations(locations, concurrency=4,
+                                      rate_limit=20.)
+
+        times = sorted(t for t, _ in server.requests)
+        self.assertGreaterEqual(times[-1] - times[0], 0.14)
+
+    def test_003_completion_order(self):
+        locations = [('oesterreich', 'wien', 'slow'),
+                     ('oesterreich', 'wien', 'fast')]
+
+        async def collect():
+            return [location[2] async for location, _ in
+                    iter_weather_for_locations(locations)]
+
+        with stand_in_server(delays={'slow': 0.2}):
+            order = asyncio.run(collect())
+
+        self.assertEqual(order, ['fast', 'slow'])
+
+    def test_005_stop_early(self):
+        locations = [('oesterreich', 'wien', 'slow'),
+                     ('oesterreich', 'wien', 'fast')]
+
+        async def first():
+            results = iter_weather_for_locations(locations)
+            async for location, _ in results:
+                break
+            # the running request of the slow location is not waited for.
+            start = time.perf_counter()
+            await results.aclose()
+            return location[2], time.perf_counter() - start
+
+        with stand_in_server(delays={'slow': 1.}):
+            name, duration = asyncio.run(first())
+
+        self.assertEqual(name, 'fast')
+        self.assertLess(duration, 0.5)
+
+    def test_004_errors_are_returned(self):
+        locations = [('oesterreich', 'wien', 'somewhere')]
+
+        with stand_in_server():
+            [(location, error)] = get_weather_for_locations(locations)
+
+        self.assertEqual(location, locations[0])
+        self.assertIsInstance(error, Exception)
+        self.assertNotIsInstance(error, LocationError)
+
+
+class TestValidateWeathereggs(unittest.TestCase):
+    def test_000_validate(self):
+        names = ['ort-{}'.format(i) for i in range(6)] + ['somewhere']
+
+        with stand_in_server(delay=0.05) as server:
+            weathereggs = [WeatherEgg('oesterreich', 'wien', name,
+                                      validate='lazy')
+                           for name in names]
+            [(invalid, error)] = validate_weathereggs(weathereggs,
+                                                      concurrency=7)
+            self.assertEqual(server.max_active, 7)
+
+            for weatheregg in weathereggs[:-1]:
+                self.assertTrue(weatheregg.validated)
+                self.assertEqual(len(weatheregg.update_forecast()), 5)
+
+        self.assertIs(invalid, weathereggs[-1])
+        self.assertIsInstance(error, requests.HTTPError)
+        self.assertFalse(invalid.validated)
+        # every page was requested once.
+        self.assertEqual(len(server.requests), 7)
@@ -0,0 +1,217 @@
+"""
+Tests for the SegmentStore
+"""
+
+import csv
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from weatheregg.backlog import RECORD, SegmentStore
+from weatheregg.forecast import Forecast, Timestamps
+from weatheregg.weatheregg import export_backlog_to_csv, save
+from weatheregg.tests.factories import FETCHED, HOUR, START, \
+    create_forecast, create_update, list_files
+
+
+class TestSegmentStore(unittest.TestCase):
+    def setUp(self):
+        """
+
+        :return:
+        """
+        self.directory = tempfile.mkdtemp()
+        self.store = SegmentStore(self.directory)
+
+    def tearDown(self):
+        """
+
+        :return:
+        """
+        shutil.rmtree(self.directory)
+
+    def test_000_append_and_read(self):
+        forecast = create_forecast()
+        self.store.append(forecast, FETCHED)
+        self.store.append(forecast, FETCHED + HOUR)
+
+        snapshots = list(self.store.snapshots())
+
+        self.assertEqual(os.listdir(self.directory), ['2019_06_01.wal'])
+        self.assertEqual([fetched for fetched, _ in snapshots],
+                         [FETCHED, FETCHED + HOUR])
+        self.assertEqual(snapshots[0].forecast, forecast)
+        self.assertEqual(snapshots[1].forecast['timestamp'][0], START)
+
+    def test_001_compact_daily(self):
+        for i in range(20):
+            self.store.append(create_forecast(), FETCHED + i * HOUR)
+
+        self.assertEqual(list_files(self.directory),
+                         ['2019_06_01.seg', '2019_06_02.wal'])
+        self.assertEqual(len(self.store.index()), 20)
+
+        self.store.compact(before=datetime.date(2019, 6, 3))
+        self.assertEqual(list_files(self.directory),
+                         ['2019_06_01.seg', '2019_06_02.seg'])
+        self.assertEqual([fetched for fetched, _ in self.store.snapshots()],
+                         [FETCHED + i * HOUR for i in range(20)])
+
+    def test_002_find(self):
+        for i in range(30):
+            self.store.append(create_forecast(), FETCHED + i * HOUR)
+
+        entries = self.store.find(FETCHED + 2 * HOUR, FETCHED + 5 * HOUR)
+        self.assertEqual(len(entries), 3)
+
+        hour = START + 47 * HOUR
+        self.assertEqual(len(self.store.find(hour=hour)), 30)
+        self.assertEqual(len(self.store.find(hour=hour + HOUR)), 0)
+
+    def test_003_torn_record(self):
+        self.store.append(create_forecast(), FETCHED)
+        wal_path = os.path.join(self.directory, '2019_06_01.wal')
+        with open(wal_path, 'ab') as f:
+            f.write(b'WEGG\x00\x01')
+
+        self.assertEqual(len(self.store.index()), 1)
+
+        self.store.append(create_forecast(), FETCHED + HOUR)
+        self.assertEqual(len(list(self.store.snapshots())), 2)
+
+    def test_004_export_csv(self):
+        self.store.append(create_forecast(), FETCHED)
+        self.store.append(create_forecast(), FETCHED + HOUR)
+
+        csv_dir = os.path.join(self.directory, 'csv')
+        self.assertEqual(export_backlog_to_csv(self.directory, csv_dir), 2)
+        self.assertEqual(sorted(os.listdir(csv_dir)),
+                         ['2019_06_01_21_00.csv', '2019_06_01_22_00.csv'])
+
+        with open(os.path.join(csv_dir, '2019_06_01_21_00.csv')) as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[1], ['2019-06-01 22:00', '0', '0', '0', '48'])
+
+    def test_005_save_segments(self):
+        save(create_forecast(), self.directory, backlog='segments')
+        save(create_forecast(), self.directory, backlog='segments')
+
+        back_log_dir = os.path.join(self.directory, 'weather_back_log')
+        self.assertEqual(len(SegmentStore(back_log_dir).index()), 2)
+        self.assertTrue(os.path.isfile(
+            os.path.join(self.directory, 'current_weather.csv')
+        ))
+
+        with self.assertRaises(ValueError):
+            save(create_forecast(), self.directory, backlog='parquet')
+
+
+class TestDeltaEncoding(unittest.TestCase):
+    def setUp(self):
+        """
+
+        :return:
+        """
+        self.directory = tempfile.mkdtemp()
+        self.store = SegmentStore(self.directory, keyframe_interval=4)
+        self.forecasts = [create_update(i) for i in range(10)]
+        for i, forecast in enumerate(self.forecasts):
+            self.store.append(forecast, FETCHED + i * HOUR)
+
+    def tearDown(self):
+        """
+
+        :return:
+        """
+        shutil.rmtree(self.directory)
+
+    def test_000_reconstruct(self):
+        self.assertEqual([forecast for _, forecast in self.store.snapshots()],
+                         self.forecasts)
+
+        # a record in the middle of a chain
+        entry = self.store.index()[6]
+        self.assertEqual(SegmentStore(self.directory).read(entry).forecast,
+                         self.forecasts[6])
+
+    def test_001_keyframes(self):
+        entries = self.store.index()
+        keyframes = [i for i, entry in enumerate(entries)
+                     if entry.keyframe == entry.offset]
+
+        # every file starts with a keyframe.
+        self.assertEqual(keyframes, [0, 3, 7])
+        full_size = 4 * 4 * 48
+        for i, entry in enumerate(entries):
+            if i not in keyframes:
+                self.assertLess(entry.size, full_size / 2)
+
+    def test_002_compact(self):
+        self.store.compact(before=datetime.date(2019, 6, 3))
+        self.assertEqual(list_files(self.directory),
+                         ['2019_06_01.seg', '2019_06_02.seg'])
+
+        self.assertEqual([forecast for _, forecast in self.store.snapshots()],
+                         self.forecasts)
+        entries = self.store.index()
+        self.assertEqual([i for i, entry in enumerate(entries)
+                          if entry.keyframe == entry.offset], [0, 3, 7])
+
+    def test_003_mismatch_is_keyframe(self):
+        directory = os.path.join(self.directory, 'steps')
+        store = SegmentStore(directory, keyframe_interval=4)
+        store.append(create_update(0), FETCHED)
+        forecast = Forecast(Timestamps(START, 2, 2 * HOUR), [1, 2], [1, 2],
+                            [1, 2], [1, 2])
+        store.append(forecast, FETCHED + HOUR)
+
+        entries = store.index()
+        self.assertEqual(entries[1].keyframe, entries[1].offset)
+        self.assertEqual(entries[1].size, 4 * 4 * 2)
+        self.assertEqual(store.read(entries[1]).forecast, forecast)
+
+    def test_004_gap_is_keyframe(self):
+        directory = os.path.join(self.directory, 'gap')
+        store = SegmentStore(directory, keyframe_interval=4)
+        store.append(create_update(0), FETCHED)
+        # no hour of the forecast 50 hours later overlaps the previous one.
+        store.append(create_update(50), FETCHED + HOUR)
+
+        entries = store.index()
+        self.assertEqual(entries[1].keyframe, entries[1].offset)
+        self.assertEqual(entries[1].size, 4 * 4 * 48)
+        self.assertEqual(store.read(entries[1]).forecast, create_update(50))
+
+    def test_005_save_delta(self):
+        data_dir = os.path.join(self.directory, 'data')
+        for forecast in self.forecasts[:3]:
+            save(forecast, data_dir, backlog='delta')
+
+        back_log_dir = os.path.join(data_dir, 'weather_back_log')
+        [wal] = os.listdir(back_log_dir)
+        size = os.path.getsize(os.path.join(back_log_dir, wal))
+        self.assertLess(size, 3 * RECORD.size + 2 * 4 * 4 * 48)
+
+    def test_006_append_reuses_index(self):
+        store = SegmentStore(os.path.join(self.directory, 'reuse'),
+                             keyframe_interval=4)
+        with mock.patch.object(store, '_scan', wraps=store._scan) as scan, \
+                mock.patch.object(store, 'read', wraps=store.read) as read:
+            for i, forecast in enumerate(self.forecasts[:6]):
+                store.append(forecast, FETCHED + i * HOUR)
+
+        # only the new write-ahead files and the sealed one are scanned.
+        self.assertEqual(scan.call_count, 3)
+        self.assertEqual(read.call_count, 0)
+        self.assertEqual([forecast for _, forecast in store.snapshots()],
+                         self.forecasts[:6])
+
+        # a write of another store is noticed.
+        SegmentStore(store.directory, keyframe_interval=4).append(
+            self.forecasts[6], FETCHED + 6 * HOUR)
+        store.append(self.forecasts[7], FETCHED + 7 * HOUR)
+        self.assertEqual([forecast for _, forecast in store.snapshots()],
+                         self.forecasts[:8])
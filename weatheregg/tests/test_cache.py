@@ -0,0 +1,182 @@
+"""
+Tests for the caches
+"""
+
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from shutil import rmtree
+from unittest import mock
+
+from weatheregg.__main__ import forecast
+from weatheregg.cache import DiskCache, ForecastCache
+from weatheregg.scheduler import FakeClock
+from weatheregg.weatheregg import get_weather_for_location
+from weatheregg.tests.server import stand_in_server
+from weatheregg.tests.factories import create_forecast
+
+
+class TestForecastCache(unittest.TestCase):
+    def test_000_ttl(self):
+        clock = FakeClock()
+        cache = ForecastCache(ttl=60, clock=clock)
+        forecast = create_forecast()
+
+        cache.put('a', forecast)
+        clock.advance(59.)
+        self.assertIs(cache.get('a'), forecast)
+        clock.advance(1.)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_001_lru(self):
+        cache = ForecastCache(maxsize=2)
+        forecast = create_forecast()
+
+        cache.put('a', forecast)
+        cache.put('b', forecast)
+        cache.get('a')
+        cache.put('c', forecast)
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+
+    def test_002_invalidate(self):
+        cache = ForecastCache()
+        forecast = create_forecast()
+
+        cache.put('a', forecast)
+        cache.put('b', forecast)
+        cache.invalidate('a')
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('b'))
+
+        cache.invalidate()
+        self.assertEqual(len(cache), 0)
+
+    def test_003_disabled(self):
+        cache = ForecastCache(ttl=0)
+        cache.put('a', create_forecast())
+        self.assertIsNone(cache.get('a'))
+
+    def test_004_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            ForecastCache(ttl=-1)
+        with self.assertRaises(ValueError):
+            ForecastCache(maxsize=0)
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        """
+
+        :return:
+        """
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+
+        :return:
+        """
+        rmtree(self.directory)
+
+    def test_000_put_and_get(self):
+        cache = DiskCache(self.directory)
+
+        self.assertIsNone(cache.get('http://a'))
+        cache.put('http://a', b'page a')
+        self.assertEqual(cache.get('http://a'), b'page a')
+        self.assertIsNone(cache.get('http://b'))
+
+        cache.clear()
+        self.assertIsNone(cache.get('http://a'))
+
+    def test_001_ttl(self):
+        clock = FakeClock(1000.)
+        cache = DiskCache(self.directory, ttl=60, clock=clock)
+
+        cache.put('http://a', b'page a')
+        clock.advance(59.)
+        self.assertEqual(cache.get('http://a'), b'page a')
+        clock.advance(1.)
+        self.assertIsNone(cache.get('http://a'))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_002_lru_eviction(self):
+        page = os.urandom(1000)
+        cache = DiskCache(self.directory, max_size=2500)
+
+        cache.put('http://a', page)
+        cache.put('http://b', page)
+        # use a, so b is the least recently used page
+        os.utime(cache._path('http://b'), (0, 0))
+        cache.get('http://a')
+        cache.put('http://c', page)
+
+        self.assertEqual(cache.get('http://a'), page)
+        self.assertIsNone(cache.get('http://b'))
+        self.assertEqual(cache.get('http://c'), page)
+
+    def test_003_broken_entry(self):
+        cache = DiskCache(self.directory)
+        with open(cache._path('http://a'), 'wb') as f:
+            f.write(b'no gzip')
+
+        self.assertIsNone(cache.get('http://a'))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_004_fetch(self):
+        cache = DiskCache(self.directory)
+        with stand_in_server() as server:
+            first = get_weather_for_location('oesterreich', 'wien', 'wien',
+                                             disk_cache=cache, stream=True)
+            second = get_weather_for_location('oesterreich', 'wien', 'wien',
+                                              disk_cache=cache)
+
+        self.assertEqual(len(server.requests), 1)
+        self.assertEqual(first, second)
+
+    def test_005_command_line(self):
+        args = ['oesterreich', 'wien', 'wien', '--cache-dir', self.directory]
+        with stand_in_server() as server:
+            for _ in range(2):
+                with contextlib.redirect_stdout(io.StringIO()) as output:
+                    forecast(args)
+
+        self.assertEqual(len(server.requests), 1)
+        self.assertEqual(len(output.getvalue().splitlines()), 49)
+
+    def test_006_running_size(self):
+        page = os.urandom(1000)
+        cache = DiskCache(self.directory, max_size=2500)
+
+        with mock.patch.object(cache, '_entries',
+                               wraps=cache._entries) as entries:
+            cache.put('http://a', page)
+            cache.put('http://a', page)
+            cache.put('http://b', page)
+            # the directory is only scanned when it is too big.
+            self.assertEqual(entries.call_count, 0)
+            self.assertEqual(len(cache), 2)
+
+            cache.put('http://c', page)
+            self.assertEqual(entries.call_count, 1)
+
+        sizes = [os.path.getsize(os.path.join(self.directory, name))
+                 for name in os.listdir(self.directory)]
+        self.assertEqual(len(cache), len(sizes))
+        self.assertEqual(cache.size, sum(sizes))
+        self.assertLessEqual(cache.size, 2500)
+
+        # a new cache counts the pages of the directory.
+        self.assertEqual(DiskCache(self.directory).size, cache.size)
+
+    def test_007_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            DiskCache(self.directory, ttl=-1)
+        with self.assertRaises(ValueError):
+            DiskCache(self.directory, max_size=0)
@@ -0,0 +1,132 @@
+"""
+Tests for the compaction of the backlog
+"""
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from weatheregg.__main__ import run_compact
+from weatheregg.backlog import SegmentStore
+from weatheregg.compact import RetentionPolicy, compact_backlog, \
+    parse_duration
+from weatheregg.reader import BacklogReader
+from weatheregg.weatheregg import save
+from weatheregg.tests.factories import create_update, list_files
+
+HOUR = datetime.timedelta(hours=1)
+DAY = datetime.timedelta(days=1)
+FETCHED = datetime.datetime(2019, 6, 1, 21)
+NOW = datetime.datetime(2019, 6, 3, 12)
+
+
+class TestRetentionPolicy(unittest.TestCase):
+    def test_000_parse(self):
+        self.assertEqual(parse_duration('30d'), 30 * DAY)
+        self.assertEqual(parse_duration('15m'), HOUR / 4)
+        with self.assertRaises(ValueError):
+            parse_duration('30 days')
+        with self.assertRaises(ValueError):
+            RetentionPolicy.parse('0d=1h,30d=often')
+
+    def test_001_spacing(self):
+        policy = RetentionPolicy.parse('0d=all,1d=6h,30d=drop')
+        kept = policy.keep((NOW - i * HOUR for i in range(24 * 40)), NOW)
+
+        # everything of the last day, then one per 6 hours from 12:00 a day
+        # ago until 30 days
+        self.assertEqual(len(kept), 24 + 1 + 4 * 29)
+        self.assertIn(NOW, kept)
+        self.assertNotIn(NOW - 30 * DAY, kept)
+
+        # compacting again keeps the same snapshots
+        self.assertEqual(policy.keep(kept, NOW), kept)
+
+
+class TestCompactBacklog(unittest.TestCase):
+    def setUp(self):
+        """
+
+        :return:
+        """
+        self.directory = tempfile.mkdtemp()
+        self.back_log_dir = os.path.join(self.directory, 'weather_back_log')
+        self.forecasts = [create_update(i) for i in range(40)]
+
+    def tearDown(self):
+        """
+
+        :return:
+        """
+        shutil.rmtree(self.directory)
+
+    def save(self, i, backlog='csv'):
+        with mock.patch('weatheregg.weatheregg.datetime.datetime') as dt:
+            dt.now.return_value = FETCHED + i * HOUR
+            save(self.forecasts[i], self.directory, backlog=backlog)
+
+    def test_000_merge_csv_files(self):
+        for i in range(40):
+            self.save(i)
+
+        result = compact_backlog(self.back_log_dir, now=NOW)
+
+        self.assertEqual(result, (27, 27, 27))
+        files = list_files(self.back_log_dir)
+        self.assertEqual(files[:2], ['2019_06_01.seg', '2019_06_02.seg'])
+        # the csv files of today are left alone
+        self.assertEqual(len(files), 2 + 13)
+
+        snapshots = list(BacklogReader(self.directory).issued_between())
+        self.assertEqual([forecast for _, forecast in snapshots],
+                         self.forecasts)
+
+        # nothing changes on the second run
+        self.assertEqual(compact_backlog(self.back_log_dir, now=NOW),
+                         (0, 0, 0))
+
+    def test_001_monthly_with_retention(self):
+        for i in range(40):
+            self.save(i, backlog='segments' if i % 2 else 'csv')
+
+        retention = RetentionPolicy.parse('0d=all,1d=6h')
+        result = compact_backlog(self.back_log_dir, period='month',
+                                 retention=retention, keyframe_interval=4,
+                                 now=NOW)
+
+        self.assertEqual(result.read, 27)
+        self.assertIn('2019_06.seg', list_files(self.back_log_dir))
+        reader = BacklogReader(self.back_log_dir)
+        fetched = [t for t, _ in reader.issued_between()]
+        # 21:00, 0:00, 6:00 and 12:00 the day before, then every snapshot
+        self.assertEqual(fetched[:3], [FETCHED, FETCHED + 3 * HOUR,
+                                       FETCHED + 9 * HOUR])
+        self.assertEqual(fetched[3:], [FETCHED + i * HOUR
+                                       for i in range(15, 40)])
+
+        # the monthly segment is split again
+        compact_backlog(self.back_log_dir, now=NOW)
+        self.assertEqual(list_files(self.back_log_dir)[:3],
+                         ['2019_06_01.seg', '2019_06_02.seg',
+                          '2019_06_03.wal'])
+
+    def test_002_drop(self):
+        for i in range(40):
+            self.save(i, backlog='segments')
+
+        compact_backlog(self.back_log_dir,
+                        retention=RetentionPolicy.parse('1d=drop'), now=NOW)
+        self.assertEqual(list_files(self.back_log_dir),
+                         ['2019_06_02.seg', '2019_06_03.wal'])
+        self.assertEqual(len(SegmentStore(self.back_log_dir).index()), 24)
+
+    def test_003_cli(self):
+        self.save(0)
+
+        with mock.patch('builtins.print'):
+            run_compact([self.directory, '-p', 'month', '--delta'])
+
+        self.assertEqual(list_files(self.back_log_dir), ['2019_06.seg'])
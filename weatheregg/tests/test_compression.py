@@ -0,0 +1,113 @@
+"""
+Tests for the compressed backlog
+"""
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from weatheregg.__main__ import run_convert_backlog
+from weatheregg.compression import compress, decompress, zstandard
+from weatheregg.reader import BacklogReader, convert_backlog, read_csv
+from weatheregg.weatheregg import save
+from weatheregg.tests.factories import create_forecast
+
+FETCHED = datetime.datetime(2019, 6, 1, 21, 30)
+
+
+class TestCompress(unittest.TestCase):
+    def test_000_gzip(self):
+        data = b'temperature' * 100
+        compressed = compress(data, 'gzip')
+
+        self.assertLess(len(compressed), len(data))
+        self.assertEqual(compress(data, 'gzip'), compressed)
+        self.assertEqual(decompress(compressed, 'gzip'), data)
+        self.assertEqual(compress(data, None), data)
+
+    def test_001_unknown_compression(self):
+        with self.assertRaises(ValueError):
+            compress(b'', 'bzip2')
+
+    @unittest.skipIf(zstandard is None, 'zstandard is not installed')
+    def test_002_zstd(self):
+        data = b'temperature' * 100
+        self.assertEqual(decompress(compress(data, 'zstd'), 'zstd'), data)
+
+    @unittest.skipIf(zstandard is not None, 'zstandard is installed')
+    def test_003_zstd_missing(self):
+        with self.assertRaises(ImportError):
+            compress(b'', 'zstd')
+
+
+class TestCompressedBacklog(unittest.TestCase):
+    def setUp(self):
+        """
+
+        :return:
+        """
+        self.directory = tempfile.mkdtemp()
+        self.back_log_dir = os.path.join(self.directory, 'weather_back_log')
+
+    def tearDown(self):
+        """
+
+        :return:
+        """
+        shutil.rmtree(self.directory)
+
+    def save(self, hour, compression=None):
+        with mock.patch('weatheregg.weatheregg.datetime.datetime') as dt:
+            dt.now.return_value = FETCHED + datetime.timedelta(hours=hour)
+            save(create_forecast(), self.directory, compression=compression)
+
+    def test_000_save_compressed(self):
+        self.save(0, compression='gzip')
+
+        self.assertEqual(os.listdir(self.back_log_dir),
+                         ['2019_06_01_21_00.csv.gz'])
+        file_path = os.path.join(self.back_log_dir, '2019_06_01_21_00.csv.gz')
+        self.assertEqual(read_csv(file_path), create_forecast())
+        # the current file stays readable
+        self.assertEqual(
+            read_csv(os.path.join(self.directory, 'current_weather.csv')),
+            create_forecast()
+        )
+
+        with self.assertRaises(ValueError):
+            save(create_forecast(), self.directory, backlog='segments',
+                 compression='gzip')
+
+    def test_001_read_mixed(self):
+        self.save(0)
+        self.save(1, compression='gzip')
+
+        snapshots = list(BacklogReader(self.directory).issued_between())
+        self.assertEqual(len(snapshots), 2)
+        self.assertEqual(snapshots[0].forecast, snapshots[1].forecast)
+
+    def test_002_convert(self):
+        for hour in range(3):
+            self.save(hour)
+        self.save(3, compression='gzip')
+
+        self.assertEqual(convert_backlog(self.back_log_dir, 'gzip'), 3)
+        self.assertEqual(sorted(os.listdir(self.back_log_dir)), [
+            '2019_06_01_21_00.csv.gz', '2019_06_01_22_00.csv.gz',
+            '2019_06_01_23_00.csv.gz', '2019_06_02_00_00.csv.gz'
+        ])
+
+        self.assertEqual(convert_backlog(self.back_log_dir, None), 4)
+        self.assertEqual(len(BacklogReader(self.directory).index()), 4)
+
+    def test_003_convert_cli(self):
+        self.save(0)
+
+        with mock.patch('builtins.print'):
+            run_convert_backlog([self.directory])
+
+        self.assertEqual(os.listdir(self.back_log_dir),
+                         ['2019_06_01_21_00.csv.gz'])
@@ -0,0 +1,132 @@
+"""
+Tests for the Forecast
+"""
+
+import datetime
+import itertools
+import pickle
+import unittest
+
+import pytz
+
+from weatheregg.forecast import COLUMNS, Forecast, Timestamps, \
+    format_timestamps
+from weatheregg.tests.factories import START, create_forecast
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+
+class TestTimestamps(unittest.TestCase):
+    def test_000_access(self):
+        timestamps = Timestamps(START, 48)
+
+        self.assertEqual(len(timestamps), 48)
+        self.assertEqual(timestamps[0], START)
+        self.assertEqual(timestamps[2], datetime.datetime(2019, 6, 2, 0))
+        self.assertEqual(timestamps[-1], START + datetime.timedelta(hours=47))
+        self.assertEqual(list(timestamps),
+                         [START + datetime.timedelta(hours=i)
+                          for i in range(48)])
+
+        with self.assertRaises(IndexError):
+            timestamps[48]
+
+    def test_001_slice(self):
+        timestamps = Timestamps(START, 48)
+
+        self.assertEqual(timestamps[2:6:2],
+                         Timestamps(datetime.datetime(2019, 6, 2, 0), 2,
+                                    datetime.timedelta(hours=2)))
+        self.assertEqual(timestamps[2:6], list(timestamps)[2:6])
+        self.assertEqual(timestamps[::-1], list(timestamps)[::-1])
+
+    def test_002_pickle(self):
+        timestamps = Timestamps(START, 48)
+        self.assertEqual(pickle.loads(pickle.dumps(timestamps)), timestamps)
+
+    def test_003_strftime(self):
+        vienna = pytz.timezone('Europe/Vienna')
+        starts = (START, START.replace(minute=30, second=15),
+                  vienna.localize(datetime.datetime(2019, 10, 26, 22)))
+        steps = (datetime.timedelta(hours=1), datetime.timedelta(hours=25),
+                 datetime.timedelta(minutes=17), datetime.timedelta(days=1),
+                 datetime.timedelta(seconds=7))
+        formats = ('%Y-%m-%d %H:%M', '{%a %d.%m.%y} %H%% %S %Z%z', '%I %p')
+
+        for start, step, fmt in itertools.product(starts, steps, formats):
+            with self.subTest(start=start, step=step, fmt=fmt):
+                timestamps = Timestamps(start, 100, step)
+                self.assertEqual(timestamps.strftime(fmt),
+                                 [t.strftime(fmt) for t in timestamps])
+
+        self.assertEqual(Timestamps(START, 0).strftime('%H'), [])
+        self.assertEqual(format_timestamps([START], '%d %H:%M'),
+                         ['01 22:00'])
+
+
+class TestForecast(unittest.TestCase):
+    def test_000_dict_access(self):
+        forecast = create_forecast()
+
+        self.assertEqual(set(forecast), {'timestamp', 'temperature',
+                                         'cloudiness', 'rain',
+                                         'wind_velocity'})
+        self.assertEqual(forecast['temperature'][1], 1)
+        self.assertEqual(forecast['timestamp'][0], START)
+        self.assertIsInstance(forecast['cloudiness'], memoryview)
+        self.assertEqual(forecast['cloudiness'].tolist(),
+                         list(range(0, 96, 2)))
+        self.assertEqual(forecast.get('icon'), None)
+
+        with self.assertRaises(KeyError):
+            forecast['icon']
+
+    def test_001_length_mismatch(self):
+        with self.assertRaises(ValueError):
+            Forecast(Timestamps(START, 2), [1], [1, 2], [1, 2], [1, 2])
+
+    def test_002_from_and_to_dict(self):
+        forecast = create_forecast()
+        data = forecast.to_dict()
+
+        self.assertEqual(data['temperature'], list(range(48)))
+        self.assertEqual(Forecast.from_dict(data), forecast)
+
+    def test_003_column_view(self):
+        forecast = create_forecast()
+        view = forecast.column('temperature')
+
+        self.assertEqual(view[5], 5)
+        self.assertEqual(view.tolist(), list(range(48)))
+        self.assertIs(view, forecast['temperature'])
+        self.assertTrue(view.readonly)
+
+        with self.assertRaises(TypeError):
+            forecast['temperature'][5] = 0
+        self.assertEqual(forecast['temperature'][5], 5)
+
+    @unittest.skipIf(np is None, 'NumPy is not installed')
+    def test_004_to_numpy(self):
+        forecast = create_forecast()
+        column = forecast.to_numpy('wind_velocity')
+
+        self.assertEqual(column.sum(), sum(range(48, 96)))
+        self.assertFalse(column.flags.writeable)
+        self.assertTrue(np.shares_memory(
+            column, forecast.to_numpy('wind_velocity')))
+
+    def test_005_pickle(self):
+        forecast = create_forecast()
+        self.assertEqual(pickle.loads(pickle.dumps(forecast)), forecast)
+
+    def test_006_share_columns(self):
+        forecast = create_forecast()
+        copy = Forecast(forecast.timestamps, *(forecast[name]
+                                              for name in COLUMNS))
+
+        self.assertEqual(copy, forecast)
+        # read-only columns are not copied.
+        self.assertIs(copy['rain'], forecast['rain'])
@@ -0,0 +1,160 @@
+"""
+Tests for the bulk ingestion of saved pages
+"""
+
+import datetime
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from weatheregg.__main__ import run_ingest
+from weatheregg.backlog import SegmentStore
+from weatheregg.ingest import Page, ingest, iter_parse, read_pages
+from weatheregg.reader import BacklogReader
+from weatheregg.weatheregg import LocationError, parse_page
+from weatheregg.tests.server import list_pages, read_page
+
+DAY = datetime.timedelta(days=1)
+HOUR = datetime.timedelta(hours=1)
+FETCHED = datetime.datetime(2019, 6, 1, 12)
+
+
+def create_pages(n):
+    """
+    Returns n recorded pages, which were requested an hour apart, and a
+    broken page in the middle.
+
+    :param n:
+    :return:
+    """
+    names = list_pages()
+    pages = [Page(i, read_page(names[i % len(names)]), FETCHED + i * HOUR)
+             for i in range(n)]
+    pages.insert(n // 2, Page('broken', b'<html></html>', FETCHED))
+    return pages
+
+
+class TestParsePage(unittest.TestCase):
+    def test_000_now(self):
+        page = read_page()
+        forecast = parse_page(page, now=FETCHED)
+        next_day = parse_page(page, now=FETCHED + DAY)
+
+        self.assertEqual(len(forecast.timestamps), 48)
+        self.assertEqual(next_day.timestamps.start - forecast.timestamps.start,
+                         DAY)
+        self.assertEqual(parse_page([page[:1000], page[1000:]], now=FETCHED),
+                         forecast)
+
+        with self.assertRaises(LocationError):
+            parse_page(b'<html></html>')
+
+
+class TestIterParse(unittest.TestCase):
+    def setUp(self):
+        """
+
+        :return:
+        """
+        self.pages = create_pages(10)
+        self.expected = {page.key: parse_page(page.content, now=page.fetched)
+                         for page in self.pages if page.key != 'broken'}
+
+    def check(self, results, ordered=True):
+        keys = [result.key for result in results]
+        if ordered:
+            self.assertEqual(keys, [page.key for page in self.pages])
+        else:
+            self.assertCountEqual(keys, [page.key for page in self.pages])
+
+        for key, fetched, forecast, error in results:
+            if key == 'broken':
+                self.assertIsInstance(error, LocationError)
+                self.assertIsNone(forecast)
+            else:
+                self.assertIsNone(error)
+                self.assertEqual(forecast, self.expected[key])
+
+    def test_000_processes(self):
+        self.check(list(iter_parse(self.pages, workers=2, chunk_size=3)))
+
+    def test_001_unordered(self):
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            results = list(iter_parse(self.pages, chunk_size=2,
+                                      ordered=False, executor=executor))
+        self.check(results, ordered=False)
+
+    def test_002_in_process(self):
+        self.check(list(iter_parse(iter(self.pages), workers=0)))
+
+        with self.assertRaises(ValueError):
+            list(iter_parse(self.pages, chunk_size=0))
+
+
+class TestIngest(unittest.TestCase):
+    def setUp(self):
+        """
+
+        :return:
+        """
+        self.directory = tempfile.mkdtemp()
+        self.page_dir = os.path.join(self.directory, 'pages')
+        self.data_dir = os.path.join(self.directory, 'data')
+        os.makedirs(self.page_dir)
+
+        for i, name in enumerate(list_pages()):
+            file_path = os.path.join(self.page_dir, name + '.html')
+            with open(file_path, 'wb') as f:
+                f.write(read_page(name))
+            mtime = time.mktime((FETCHED + i * HOUR).timetuple())
+            os.utime(file_path, (mtime, mtime))
+
+        # a page of a DiskCache
+        header = json.dumps({
+            'url': 'http://www.wetter.at/wetter/oesterreich/wien/wien',
+            'stored': time.mktime((FETCHED + 5 * HOUR).timetuple())
+        })
+        with gzip.open(os.path.join(self.page_dir, 'cache.gz'), 'wb') as f:
+            f.write(header.encode('utf-8') + b'\n' + read_page())
+
+    def tearDown(self):
+        """
+
+        :return:
+        """
+        shutil.rmtree(self.directory)
+
+    def test_000_read_pages(self):
+        pages = list(read_pages([self.page_dir]))
+
+        self.assertEqual([page.fetched for page in pages],
+                         [FETCHED, FETCHED + HOUR, FETCHED + 2 * HOUR,
+                          FETCHED + 5 * HOUR])
+        self.assertEqual(pages[-1].content, read_page())
+
+    def test_001_ingest_segments(self):
+        back_log_dir = os.path.join(self.data_dir, 'weather_back_log')
+        result = ingest(read_pages([self.page_dir]), back_log_dir,
+                        backlog='segments', workers=2, chunk_size=1)
+
+        self.assertEqual(result, (4, 0))
+        entries = SegmentStore(back_log_dir).index()
+        self.assertEqual([entry.fetched for entry in entries],
+                         [entry.fetched for entry in sorted(entries)])
+        self.assertEqual(len(entries), 4)
+
+    def test_002_cli(self):
+        with open(os.path.join(self.page_dir, 'broken.html'), 'wb') as f:
+            f.write(b'<html></html>')
+
+        with mock.patch('builtins.print') as print_:
+            run_ingest([self.page_dir, '-d', self.data_dir, '-w', '2'])
+
+        self.assertEqual(len(BacklogReader(self.data_dir).index()), 4)
+        self.assertIn('1 pages failed', print_.call_args_list[-1][0][0])
@@ -0,0 +1,135 @@
+"""
+Tests for the logging
+"""
+
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+from weatheregg.log import LOGGER_NAME, JsonFormatter, LocalQueueHandler, \
+    configure_logging, shutdown_logging
+
+
+class Message:
+    """
+    Counts how often it is converted to a string.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.threads = set()
+
+    def __str__(self):
+        self.calls += 1
+        self.threads.add(threading.current_thread().name)
+        return 'message'
+
+
+class TestJsonFormatter(unittest.TestCase):
+    def test_000_format(self):
+        record = logging.LogRecord(LOGGER_NAME, logging.INFO, __file__, 1,
+                                   'Load data from %s.', ('wien', ), None)
+        record.location = 'wien'
+
+        data = json.loads(JsonFormatter().format(record))
+
+        self.assertEqual(data['level'], 'INFO')
+        self.assertEqual(data['logger'], LOGGER_NAME)
+        self.assertEqual(data['message'], 'Load data from wien.')
+        self.assertEqual(data['location'], 'wien')
+        self.assertTrue(data['time'].endswith('+00:00'))
+        self.assertNotIn('exception', data)
+
+    def test_001_exception(self):
+        try:
+            raise KeyError('wien')
+        except KeyError:
+            logger = logging.getLogger('test')
+            record = logger.makeRecord('test', logging.ERROR, __file__, 1,
+                                       'Failed', (), sys.exc_info())
+
+        data = json.loads(JsonFormatter().format(record))
+        self.assertIn("KeyError: 'wien'", data['exception'])
+
+
+class TestConfigureLogging(unittest.TestCase):
+    def setUp(self):
+        """
+
+        :return:
+        """
+        shutdown_logging()
+        self.directory = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.directory, 'weatheregg.log')
+
+    def tearDown(self):
+        """
+
+        :return:
+        """
+        shutdown_logging()
+        shutil.rmtree(self.directory)
+
+    def read_lines(self):
+        shutdown_logging()
+        with open(self.file_path, encoding='utf-8') as f:
+            return f.read().splitlines()
+
+    def test_000_configure_once(self):
+        for _ in range(3):
+            logger = configure_logging(self.file_path)
+            configure_logging()
+        logger.info('Load data from %s.', 'wien')
+
+        handlers = [handler for handler in logger.handlers
+                    if isinstance(handler, LocalQueueHandler)]
+        self.assertEqual(len(handlers), 1)
+
+        lines = self.read_lines()
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].startswith('[INFO] - '))
+        self.assertTrue(lines[0].endswith(' - Load data from wien.'))
+
+    def test_001_json(self):
+        logger = configure_logging(self.file_path, json_format=True)
+        logging.LoggerAdapter(logger, {'location': 'wien'}).info(
+            'Retry in %.0f seconds', 120.4)
+        logger.debug('Not written')
+
+        lines = self.read_lines()
+        self.assertEqual(len(lines), 1)
+        data = json.loads(lines[0])
+        self.assertEqual(data['message'], 'Retry in 120 seconds')
+        self.assertEqual(data['location'], 'wien')
+
+    def test_002_lazy(self):
+        logger = configure_logging(self.file_path)
+        message = Message()
+        # other handlers of the root logger would format it, too.
+        logger.propagate = False
+        self.addCleanup(setattr, logger, 'propagate', True)
+
+        logger.debug('Skipped %s', message)
+        self.assertEqual(message.calls, 0)
+
+        logger.info('Written %s', message)
+        self.read_lines()
+        # formatted for stderr and the file by the thread which writes the log
+        self.assertEqual(message.calls, 2)
+        self.assertNotIn(threading.current_thread().name, message.threads)
+
+    def test_003_shutdown(self):
+        logger = configure_logging(self.file_path)
+        shutdown_logging()
+
+        self.assertFalse(any(isinstance(handler, LocalQueueHandler)
+                             for handler in logger.handlers))
+
+        # configuring again starts over.
+        configure_logging(self.file_path).info('Again')
+        self.assertEqual(len(self.read_lines()), 1)
@@ -0,0 +1,130 @@
+"""
+Tests for the metrics
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import requests
+
+from weatheregg.metrics import PARSE, REQUEST, STAGE_DURATION, \
+    STAGE_FAILURES, Registry, start_http_server, timed, write_textfile
+from weatheregg.weatheregg import get_weather_for_location
+from weatheregg.tests.server import stand_in_server
+
+
+def create_registry():
+    """
+    Creates a registry with a metric of every type.
+
+    :return:
+    """
+    registry = Registry()
+    counter = registry.counter('test_updates_total', 'Updates.',
+                               ('location', ))
+    gauge = registry.gauge('test_last_success', 'Last success.')
+    histogram = registry.histogram('test_duration_seconds', 'Duration.',
+                                   ('stage', ), buckets=(0.1, 1.))
+
+    counter.inc(location='wien')
+    counter.inc(2, location='a "b"\\\n')
+    gauge.set(1559390400.)
+    for value in (0.05, 0.1, 0.5, 3.):
+        histogram.observe(value, stage='parse')
+    return registry
+
+
+class TestRegistry(unittest.TestCase):
+    def test_000_render(self):
+        self.assertEqual(create_registry().render(), (
+            '# HELP test_updates_total Updates.\n'
+            '# TYPE test_updates_total counter\n'
+            'test_updates_total{location="a \\"b\\"\\\\\\n"} 2.0\n'
+            'test_updates_total{location="wien"} 1.0\n'
+            '# HELP test_last_success Last success.\n'
+            '# TYPE test_last_success gauge\n'
+            'test_last_success 1559390400.0\n'
+            '# HELP test_duration_seconds Duration.\n'
+            '# TYPE test_duration_seconds histogram\n'
+            'test_duration_seconds_bucket{stage="parse",le="0.1"} 2\n'
+            'test_duration_seconds_bucket{stage="parse",le="1.0"} 3\n'
+            'test_duration_seconds_bucket{stage="parse",le="+Inf"} 4\n'
+            'test_duration_seconds_sum{stage="parse"} 3.65\n'
+            'test_duration_seconds_count{stage="parse"} 4\n'
+        ))
+
+    def test_001_invalid(self):
+        registry = create_registry()
+
+        with self.assertRaises(ValueError):
+            registry.counter('test_updates_total', 'Again.')
+        with self.assertRaises(ValueError):
+            registry.get('test_updates_total').inc(stage='parse')
+        with self.assertRaises(ValueError):
+            registry.get('test_updates_total').inc(-1, location='wien')
+
+    def test_002_timed(self):
+        failures = STAGE_FAILURES.value(stage='test')
+
+        with timed('test'):
+            pass
+        with self.assertRaises(KeyError):
+            with timed('test'):
+                raise KeyError()
+
+        self.assertEqual(STAGE_DURATION.count(stage='test'), 2)
+        self.assertEqual(STAGE_FAILURES.value(stage='test'), failures + 1)
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        """
+
+        :return:
+        """
+        self.directory = tempfile.mkdtemp()
+        self.registry = create_registry()
+
+    def tearDown(self):
+        """
+
+        :return:
+        """
+        shutil.rmtree(self.directory)
+
+    def test_000_textfile(self):
+        file_path = os.path.join(self.directory, 'weatheregg.prom')
+        write_textfile(file_path, self.registry)
+
+        with open(file_path) as f:
+            self.assertEqual(f.read(), self.registry.render())
+        self.assertEqual(os.listdir(self.directory), ['weatheregg.prom'])
+
+    def test_001_http(self):
+        server = start_http_server(0, registry=self.registry)
+        try:
+            url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+            response = requests.get(url + '/metrics')
+            missing = requests.get(url + '/missing')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(response.text, self.registry.render())
+        self.assertTrue(
+            response.headers['Content-Type'].startswith('text/plain'))
+        self.assertEqual(missing.status_code, 404)
+
+    def test_002_instrumentation(self):
+        requests_before = STAGE_DURATION.count(stage=REQUEST)
+        parsed_before = STAGE_DURATION.count(stage=PARSE)
+
+        with stand_in_server():
+            get_weather_for_location('oesterreich', 'wien', 'wien')
+
+        self.assertEqual(STAGE_DURATION.count(stage=REQUEST),
+                         requests_before + 1)
+        self.assertEqual(STAGE_DURATION.count(stage=PARSE),
+                         parsed_before + 1)
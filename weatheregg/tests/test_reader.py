@@ -0,0 +1,96 @@
+"""
+Tests for the BacklogReader
+"""
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from weatheregg.backlog import SegmentStore
+from weatheregg.forecast import Forecast, Timestamps
+from weatheregg.reader import BacklogReader, read_csv
+from weatheregg.weatheregg import FILE_PATTERN, save_data_to_csv
+from weatheregg.tests.factories import START
+
+HOUR = datetime.timedelta(hours=1)
+FETCHED = datetime.datetime(2019, 6, 1, 21)
+
+
+class TestBacklogReader(unittest.TestCase):
+    def setUp(self):
+        """
+        Creates a backlog with csv files from 21:00 to 23:00 and segments
+        from 00:00 to 02:00. Every snapshot starts one hour after its
+        update and its temperatures start with the hour of the update.
+
+        :return:
+        """
+        self.directory = tempfile.mkdtemp()
+        self.back_log_dir = os.path.join(self.directory, 'weather_back_log')
+        os.makedirs(self.back_log_dir)
+        store = SegmentStore(self.back_log_dir)
+
+        for i in range(6):
+            fetched = FETCHED + i * HOUR
+            forecast = Forecast(
+                Timestamps(fetched + HOUR, 48),
+                temperature=range(fetched.hour, fetched.hour + 48),
+                cloudiness=[0] * 48,
+                rain=[0] * 48,
+                wind_velocity=[0] * 48
+            )
+            if i < 3:
+                save_data_to_csv(forecast, os.path.join(
+                    self.back_log_dir, FILE_PATTERN.format(fetched)
+                ))
+            else:
+                store.append(forecast, fetched)
+
+        self.reader = BacklogReader(self.directory)
+
+    def tearDown(self):
+        """
+
+        :return:
+        """
+        shutil.rmtree(self.directory)
+
+    def test_000_read_csv(self):
+        file_path = os.path.join(self.back_log_dir, '2019_06_01_21_00.csv')
+        forecast = read_csv(file_path)
+
+        self.assertEqual(forecast.timestamps.start, START)
+        self.assertEqual(forecast['temperature'][0], 21)
+        self.assertEqual(len(forecast['wind_velocity']), 48)
+
+    def test_001_index(self):
+        self.assertEqual(self.reader.directory, self.back_log_dir)
+        self.assertEqual(len(self.reader.index()), 6)
+
+        with mock.patch('weatheregg.reader.os.scandir') as scandir:
+            self.reader.index()
+            scandir.assert_not_called()
+
+    def test_002_issued_between(self):
+        snapshots = self.reader.issued_between(FETCHED + 2 * HOUR,
+                                               FETCHED + 4 * HOUR)
+        self.assertEqual([fetched for fetched, _ in snapshots],
+                         [FETCHED + 2 * HOUR, FETCHED + 3 * HOUR])
+
+        with mock.patch('weatheregg.reader.read_csv') as load:
+            list(self.reader.issued_between(FETCHED + 3 * HOUR))
+            load.assert_not_called()
+
+    def test_003_lead_times(self):
+        hour = FETCHED + 6 * HOUR
+        lead_times = list(self.reader.lead_times(hour))
+
+        self.assertEqual([lead_time.lead for lead_time in lead_times],
+                         [6, 5, 4, 3, 2, 1])
+        # the forecast for 03:00 issued at 21:00 is the 6th value.
+        self.assertEqual(lead_times[0].temperature, 21 + 5)
+        self.assertEqual(lead_times[-1].issued, FETCHED + 5 * HOUR)
+        self.assertEqual(len(list(self.reader.lead_times(hour, 2))), 2)
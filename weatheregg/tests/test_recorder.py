@@ -0,0 +1,272 @@
+"""
+Tests for the MultiRecorder
+"""
+
+from os import path, remove
+import tempfile
+import uuid
+import unittest
+from unittest import mock
+
+from weatheregg.weatheregg import LocationError, WeatherEgg
+from weatheregg.metrics import LAST_SUCCESS, UPDATES
+from weatheregg.recorder import MultiRecorder, read_locations
+from weatheregg.retry import Backoff, RetryPolicy
+from weatheregg.scheduler import FakeClock, Scheduler
+from weatheregg.tests.server import stand_in_server
+
+TEST_DIR = path.abspath(path.dirname(__file__))
+
+
+def create_weathereggs(n, interval=60):
+    """
+    Creates n WeatherEggs without checking the locations on wetter.at.
+
+    :param n:
+    :param interval:
+    :return:
+    """
+    return [
+        WeatherEgg('oesterreich', 'wien', 'location-{}'.format(i),
+                   data_dir=path.join(TEST_DIR, 'data-{}'.format(i)),
+                   interval=interval, validate='off')
+        for i in range(n)
+    ]
+
+
+class TestReadLocations(unittest.TestCase):
+    def setUp(self):
+        """
+
+        :return:
+        """
+        file_name = str(uuid.uuid4()) + '.csv'
+        self.file_path = str(path.join(TEST_DIR, file_name))
+
+    def tearDown(self):
+        """
+
+        :return:
+        """
+        remove(self.file_path)
+
+    def test_000_read_locations(self):
+        with open(self.file_path, 'w') as f:
+            f.write('# country, state, location, data directory\n'
+                    '\n'
+                    'Österreich, Niederösterreich, Mödling, /data/moedling\n'
+                    'oesterreich,wien,wien,/data/wien\n')
+
+        self.assertEqual(read_locations(self.file_path), [
+            ('Österreich', 'Niederösterreich', 'Mödling', '/data/moedling'),
+            ('oesterreich', 'wien', 'wien', '/data/wien'),
+        ])
+
+    def test_001_invalid_line(self):
+        with open(self.file_path, 'w') as f:
+            f.write('oesterreich,wien,wien\n')
+
+        with self.assertRaises(ValueError):
+            read_locations(self.file_path)
+
+
+def queue(recorder):
+    """
+    Returns the due times and the indices of the scheduled WeatherEggs.
+
+    :param recorder:
+    :return:
+    """
+    urls = [weatheregg.url for weatheregg in recorder.weathereggs]
+    return sorted((job.due, urls.index(job.name))
+                  for job in recorder.scheduler.jobs)
+
+
+class TestMultiRecorder(unittest.TestCase):
+    def test_000_requires_data_dir(self):
+        with mock.patch('weatheregg.weatheregg.get_weather_for_location'):
+            weatheregg = WeatherEgg('oesterreich', 'wien', 'wien')
+
+        with self.assertRaises(ValueError):
+            MultiRecorder([weatheregg])
+
+    def test_001_spread_requests(self):
+        recorder = MultiRecorder(create_weathereggs(4))
+        recorder.schedule(start=0.)
+
+        self.assertEqual(queue(recorder),
+                         [(0., 0), (900., 1), (1800., 2), (2700., 3)])
+
+        # the updates are aligned to the full hour
+        recorder.schedule(start=1000.)
+        self.assertEqual(queue(recorder),
+                         [(1800., 2), (2700., 3), (3600., 0), (4500., 1)])
+
+    def test_002_run_pending(self):
+        weathereggs = create_weathereggs(4)
+        recorder = MultiRecorder(weathereggs)
+        recorder.schedule(start=0.)
+
+        with mock.patch.object(WeatherEgg, 'update_forecast') as forecast, \
+                mock.patch.object(WeatherEgg, 'save') as save:
+            recorder.run_pending(now=1000.)
+
+            self.assertEqual(forecast.call_count, 2)
+            self.assertEqual(save.call_count, 2)
+
+        self.assertEqual(recorder.next_update(), 1800.)
+        self.assertEqual(queue(recorder),
+                         [(1800., 2), (2700., 3), (3600., 0), (4500., 1)])
+
+    def test_003_retry_and_drop(self):
+        weathereggs = create_weathereggs(2)
+        clock = FakeClock(start=2000.)
+        policy = RetryPolicy(backoff=Backoff(base=120., jitter=0.),
+                             clock=clock)
+        recorder = MultiRecorder(weathereggs, scheduler=Scheduler(clock),
+                                 retry_policy=policy)
+        recorder.schedule(start=0.)
+
+        errors = [ConnectionError(), LocationError(), None]
+        with mock.patch.object(WeatherEgg, 'update_forecast',
+                               side_effect=errors), \
+                mock.patch.object(WeatherEgg, 'save') as save:
+            recorder.run_pending()
+
+            save.assert_not_called()
+            self.assertEqual(queue(recorder), [(2120., 0)])
+
+            # back on schedule after the retry
+            clock.advance(120.)
+            recorder.run_pending()
+
+        self.assertEqual(queue(recorder), [(3600., 0)])
+
+    def test_004_skip_unchanged(self):
+        recorder = MultiRecorder(create_weathereggs(1))
+        recorder.schedule(start=0.)
+
+        with mock.patch.object(WeatherEgg, 'update_forecast',
+                               return_value=None), \
+                mock.patch.object(WeatherEgg, 'save') as save:
+            recorder.run_pending(now=0.)
+
+            save.assert_not_called()
+
+        self.assertEqual(queue(recorder), [(3600., 0)])
+
+    def test_005_reuse_validation(self):
+        locations = [('oesterreich', 'wien', name,
+                      path.join(TEST_DIR, 'data-' + name))
+                     for name in ('ort-0', 'ort-1', 'ort-2')]
+
+        with stand_in_server() as server, \
+                mock.patch.object(WeatherEgg, 'save') as save:
+            recorder = MultiRecorder.from_locations(locations,
+                                                    logger=mock.Mock())
+            recorder.schedule(start=0.)
+            recorder.save_first_forecasts()
+
+            self.assertEqual(save.call_count, 3)
+            self.assertEqual(len(server.requests), 3)
+
+            # the first scheduled update only revalidates the page.
+            recorder.run_pending(now=0.)
+
+            self.assertEqual(save.call_count, 3)
+            self.assertEqual(len(server.requests), 4)
+
+    def test_006_skip_invalid_locations(self):
+        locations = [('oesterreich', 'wien', 'wien', 'data-wien'),
+                     ('oesterreich', 'wien', 'nowhere', 'data-nowhere')]
+
+        with stand_in_server(pages={'nowhere': b'<html></html>'}):
+            recorder = MultiRecorder.from_locations(locations,
+                                                    logger=mock.Mock())
+
+        self.assertEqual([weatheregg.url.split('/')[-3]
+                          for weatheregg in recorder.weathereggs], ['wien'])
+
+    def test_007_run_until_stopped(self):
+        clock = FakeClock(start=100.)
+        scheduler = Scheduler(clock)
+        recorder = MultiRecorder(create_weathereggs(2), offset=5,
+                                 scheduler=scheduler)
+
+        def update_forecast():
+            if clock.time() >= 3 * 3600:
+                scheduler.stop()
+
+        with mock.patch.object(WeatherEgg, 'update_forecast',
+                               side_effect=update_forecast) as forecast, \
+                mock.patch.object(WeatherEgg, 'save'):
+            recorder.run_forever()
+
+        # 0:05 and 0:35 every hour until the stop at 3:05
+        self.assertEqual(forecast.call_count, 7)
+        self.assertEqual(clock.time(), 3 * 3600 + 300)
+
+    def test_008_circuit_breaker(self):
+        clock = FakeClock(start=0.)
+        policy = RetryPolicy(backoff=Backoff(base=120., jitter=0.),
+                             failure_threshold=2, reset_timeout=1800.,
+                             clock=clock)
+        recorder = MultiRecorder(create_weathereggs(3),
+                                 scheduler=Scheduler(clock),
+                                 retry_policy=policy)
+        recorder.schedule()
+
+        with mock.patch.object(WeatherEgg, 'update_forecast',
+                               side_effect=ConnectionError()) as forecast, \
+                mock.patch.object(WeatherEgg, 'save'):
+            clock.advance(2400.)
+            recorder.run_pending()
+
+            # the third location does not send a request.
+            self.assertEqual(forecast.call_count, 2)
+            self.assertEqual(policy.stats.rejected, 1)
+            self.assertEqual(policy.stats.open_circuits, 1)
+            self.assertEqual(queue(recorder),
+                             [(2520., 0), (4800., 1), (6000., 2)])
+
+            # the retry is skipped while the circuit is open.
+            clock.advance(120.)
+            recorder.run_pending()
+
+            self.assertEqual(forecast.call_count, 2)
+            self.assertEqual(queue(recorder),
+                             [(3600., 0), (4800., 1), (6000., 2)])
+
+    def test_009_metrics(self):
+        weathereggs = create_weathereggs(3)
+        urls = [weatheregg.url for weatheregg in weathereggs]
+        clock = FakeClock(start=0.)
+        results = ('saved', 'unchanged', 'failed')
+        before = [UPDATES.value(location=url, result=result)
+                  for url, result in zip(urls, results)]
+
+        with tempfile.TemporaryDirectory() as directory:
+            metrics_file = path.join(directory, 'weatheregg.prom')
+            recorder = MultiRecorder(weathereggs, scheduler=Scheduler(clock),
+                                     retry_policy=RetryPolicy(clock=clock),
+                                     metrics_file=metrics_file)
+            recorder.schedule()
+
+            with mock.patch.object(WeatherEgg, 'update_forecast',
+                                   side_effect=[mock.Mock(), None,
+                                                ConnectionError()]), \
+                    mock.patch.object(WeatherEgg, 'save'):
+                clock.advance(2400.)
+                recorder.run_pending()
+
+            with open(metrics_file) as f:
+                metrics = f.read()
+
+        self.assertEqual([UPDATES.value(location=url, result=result)
+                          for url, result in zip(urls, results)],
+                         [value + 1 for value in before])
+        self.assertEqual(LAST_SUCCESS.value(location=urls[0]), 2400.)
+        self.assertEqual(LAST_SUCCESS.value(location=urls[1]), 2400.)
+        self.assertIn('weatheregg_updates_total{{location="{}",'
+                      'result="failed"}}'.format(urls[2]), metrics)
+        self.assertIn('weatheregg_update_drift_seconds_count', metrics)
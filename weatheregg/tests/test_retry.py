@@ -0,0 +1,149 @@
+"""
+Tests for the retry policy
+"""
+
+import random
+import time
+import unittest
+
+from weatheregg.retry import CLOSED, HALF_OPEN, OPEN, SHARED_POLICY, \
+    Backoff, CircuitBreaker, RetryBudget, RetryPolicy, default_policy
+from weatheregg.scheduler import FakeClock
+
+URL = 'http://www.wetter.at/wetter/oesterreich/wien/{}/prognose/stuendlich'
+
+
+class TestBackoff(unittest.TestCase):
+    def test_000_exponential(self):
+        backoff = Backoff(base=10., factor=2., max_delay=100., jitter=0.)
+
+        self.assertEqual([backoff.delay(attempt) for attempt in range(1, 7)],
+                         [10., 20., 40., 80., 100., 100.])
+        self.assertEqual(backoff.delay(1000), 100.)
+
+    def test_001_jitter(self):
+        backoff = Backoff(base=100., jitter=0.5, rng=random.Random(0))
+        delays = [backoff.delay(1) for _ in range(100)]
+
+        self.assertTrue(all(50. <= delay <= 100. for delay in delays))
+        self.assertGreater(len(set(delays)), 90)
+
+    def test_002_invalid(self):
+        with self.assertRaises(ValueError):
+            Backoff(base=0.)
+        with self.assertRaises(ValueError):
+            Backoff(jitter=2.)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_000_open_and_close(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60.,
+                                 clock=clock)
+
+        self.assertFalse(breaker.record_failure())
+        self.assertFalse(breaker.record_failure())
+        self.assertTrue(breaker.record_failure())
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.retry_at, 60.)
+
+        # one trial request after the timeout
+        clock.advance(60.)
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertTrue(breaker.allow())
+
+    def test_001_failed_trial(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60.,
+                                 clock=clock)
+        breaker.record_failure()
+
+        clock.advance(60.)
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.record_failure())
+        self.assertEqual(breaker.state, OPEN)
+        self.assertEqual(breaker.retry_at, 120.)
+
+
+class TestRetryBudget(unittest.TestCase):
+    def test_000_budget(self):
+        clock = FakeClock()
+        budget = RetryBudget(ratio=0.5, min_retries=1, window=100.,
+                             clock=clock)
+        for _ in range(4):
+            budget.record_request()
+
+        self.assertEqual([budget.withdraw() for _ in range(4)],
+                         [True, True, True, False])
+
+        # the retries expire with the window
+        clock.advance(100.)
+        self.assertTrue(budget.withdraw())
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def setUp(self):
+        """
+
+        :return:
+        """
+        self.clock = FakeClock(start=1000.)
+        self.policy = RetryPolicy(
+            backoff=Backoff(base=10., jitter=0.),
+            budget=RetryBudget(ratio=0., min_retries=3, clock=self.clock),
+            failure_threshold=3,
+            reset_timeout=300.,
+            clock=self.clock
+        )
+
+    def test_000_backoff(self):
+        url = URL.format('wien')
+        self.assertTrue(self.policy.allow(url))
+        self.assertEqual(self.policy.failure(url), 1010.)
+        self.assertEqual(self.policy.failure(url), 1020.)
+
+        # a success resets the backoff
+        self.policy.success(url)
+        self.assertEqual(self.policy.failure(url), 1010.)
+
+    def test_001_shared_circuit(self):
+        for name in ('wien', 'linz', 'graz'):
+            self.assertTrue(self.policy.allow(URL.format(name)))
+            self.policy.failure(URL.format(name))
+
+        # all locations of the host are paused.
+        self.assertFalse(self.policy.allow(URL.format('salzburg')))
+        self.assertTrue(self.policy.allow('http://localhost/salzburg'))
+
+        stats = self.policy.stats
+        self.assertEqual(stats.requests, 4)
+        self.assertEqual(stats.failures, 3)
+        self.assertEqual(stats.retries, 2)
+        self.assertEqual(stats.rejected, 1)
+        self.assertEqual(stats.circuits_opened, 1)
+        self.assertEqual(stats.open_circuits, 1)
+
+    def test_002_budget_exhausted(self):
+        policy = RetryPolicy(
+            budget=RetryBudget(ratio=0., min_retries=1, clock=self.clock),
+            clock=self.clock
+        )
+        self.assertIsNotNone(policy.failure(URL.format('wien')))
+        self.assertIsNone(policy.failure(URL.format('linz')))
+        self.assertEqual(policy.stats.budget_exhausted, 1)
+
+    def test_003_default_policy(self):
+        self.assertIs(default_policy(), SHARED_POLICY)
+
+        # a changed RETRY_INTERVAL of a recorder class still has an effect
+        policy = default_policy(10.)
+        self.assertIsNot(policy, SHARED_POLICY)
+        start = time.time()
+        delay = policy.failure(URL.format('wien')) - start
+        self.assertTrue(4. <= delay <= 11., delay)
@@ -0,0 +1,150 @@
+"""
+Tests for the Scheduler
+"""
+
+import os
+import random
+import signal
+import unittest
+
+from weatheregg.scheduler import SIGNAL_INTERVAL, FakeClock, Job, Scheduler
+
+HOUR = 3600.
+
+
+class TestJob(unittest.TestCase):
+    def test_000_next_boundary(self):
+        job = Job(print, HOUR, offset=300.)
+
+        self.assertEqual(job.next_boundary(0.), 300.)
+        self.assertEqual(job.next_boundary(300.), HOUR + 300.)
+        self.assertEqual(job.next_boundary(300., inclusive=True), 300.)
+        self.assertEqual(job.next_boundary(-4000.), 300. - HOUR)
+
+    def test_001_invalid(self):
+        with self.assertRaises(ValueError):
+            Job(print, 0.)
+        with self.assertRaises(ValueError):
+            Job(print, HOUR, jitter=-1.)
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        """
+
+        :return:
+        """
+        self.clock = FakeClock(start=1000.)
+        self.scheduler = Scheduler(self.clock, random.Random(0))
+        self.runs = []
+
+    def record(self, name, duration=0.):
+        def callback():
+            self.runs.append((name, self.clock.time()))
+            self.clock.advance(duration)
+        return callback
+
+    def test_000_no_drift(self):
+        # the job takes 10 minutes, but the runs stay on the full hour.
+        self.scheduler.add(self.record('a', duration=600.), HOUR)
+
+        for _ in range(3):
+            self.clock.advance(self.scheduler.next_run() - self.clock.time())
+            self.scheduler.run_pending()
+
+        self.assertEqual(self.runs, [('a', HOUR), ('a', 2 * HOUR),
+                                     ('a', 3 * HOUR)])
+
+    def test_001_many_jobs(self):
+        self.scheduler.add(self.record('a'), HOUR, offset=1800.)
+        self.scheduler.add(self.record('b'), HOUR / 2)
+        self.scheduler.add(self.record('c'), HOUR, immediately=True)
+
+        # missed runs are skipped.
+        self.assertEqual(self.scheduler.run_pending(now=2 * HOUR), 3)
+        self.assertEqual([name for name, _ in self.runs], ['c', 'a', 'b'])
+        self.assertEqual([job.due for job in self.scheduler.jobs],
+                         [2.5 * HOUR, 2.5 * HOUR, 3 * HOUR])
+
+    def test_002_jitter_and_drift(self):
+        job = self.scheduler.add(self.record('a', duration=20.), 60.,
+                                 jitter=10.)
+        other = self.scheduler.add(self.record('b'), 60., offset=5.)
+
+        for _ in range(50):
+            self.clock.advance(self.scheduler.next_run() - self.clock.time())
+            self.scheduler.run_pending()
+
+        for name, t in self.runs:
+            if name == 'a':
+                self.assertLess(t % 60., 10.)
+        self.assertNotEqual(len({t % 60. for name, t in self.runs
+                                 if name == 'a'}), 1)
+
+        # b waits until a is done.
+        self.assertEqual(job.max_drift, 0.)
+        self.assertGreater(other.max_drift, 0.)
+        self.assertLess(other.max_drift, 25.)
+        self.assertGreater(other.mean_drift, 0.)
+
+    def test_003_retry_and_remove(self):
+        results = [HOUR + 120., None]
+
+        def callback():
+            self.runs.append(self.clock.time())
+            if not results:
+                self.scheduler.remove(job)
+                return None
+            return results.pop(0)
+
+        job = self.scheduler.add(callback, HOUR)
+        self.scheduler.run()
+
+        self.assertEqual(self.runs, [HOUR, HOUR + 120., 2 * HOUR])
+        self.assertEqual(self.scheduler.jobs, [])
+        self.assertFalse(self.scheduler.stopped)
+
+    def test_004_stop(self):
+        def callback():
+            self.runs.append(self.clock.time())
+            if len(self.runs) == 3:
+                self.scheduler.stop()
+
+        self.scheduler.add(callback, HOUR)
+        self.scheduler.run()
+
+        self.assertEqual(len(self.runs), 3)
+        self.assertTrue(self.scheduler.stopped)
+        self.assertEqual(self.scheduler.run_pending(now=10 * HOUR), 0)
+
+    def test_005_signal(self):
+        scheduler = Scheduler()
+        scheduler.add(lambda: os.kill(os.getpid(), signal.SIGTERM), HOUR,
+                      immediately=True)
+        previous = signal.getsignal(signal.SIGTERM)
+
+        with scheduler.handle_signals():
+            scheduler.run()
+
+        self.assertTrue(scheduler.stopped)
+        self.assertIs(signal.getsignal(signal.SIGTERM), previous)
+
+    def test_006_signal_while_waiting(self):
+        timeouts = []
+
+        class SignalClock(FakeClock):
+            def wait(self, event, timeout):
+                timeouts.append(timeout)
+                # the signal interrupts the wait.
+                signal.getsignal(signal.SIGTERM)(signal.SIGTERM, None)
+                return super().wait(event, timeout)
+
+        scheduler = Scheduler(SignalClock(start=1000.))
+        scheduler.add(self.record('job'), HOUR)
+
+        with scheduler.handle_signals():
+            scheduler.run()
+
+        self.assertTrue(scheduler.stopped)
+        self.assertEqual(self.runs, [])
+        self.assertEqual(timeouts, [SIGNAL_INTERVAL])
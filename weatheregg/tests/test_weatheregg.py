@@ -2,9 +2,12 @@
 Weatheregg`s main test file
 """
 
-from os import path, remove
+from os import listdir, makedirs, path, remove
 from shutil import rmtree
+from ast import literal_eval
 import datetime
+import re
+import threading
 import uuid
 import unittest
 from unittest import mock
@@ -15,8 +18,21 @@ import pytz
 
 from weatheregg.weatheregg import (
     LocationError,
+    Validators,
+    configure_session,
+    create_session,
+    get_session,
     get_response_for_location,
     get_weather_for_location,
+    extract_location_info,
+    convert_to_int,
+    flip_list_of_dicts,
+    get_correct_day,
+    parse_hourly,
+    parse_location_info,
+    parse_response,
+    time_to_datetime,
+    TimeContext,
     # parse_chart,
     save_data_to_csv,
     save,
@@ -25,6 +41,10 @@ from weatheregg.weatheregg import (
     FILE_PATTERN,
     WeatherEgg
 )
+from weatheregg.cache import ForecastCache
+from weatheregg.scheduler import FakeClock, Scheduler
+from weatheregg.tests.server import list_pages, read_page, stand_in_server
+from weatheregg.tests.factories import create_forecast
 
 TEST_DIR = path.abspath(path.dirname(__file__))
 ROOT_DIR = path.abspath(path.join(TEST_DIR, '..'))
@@ -64,16 +84,393 @@ class TestGetResponseForLocation(unittest.TestCase):
         Checks what happens if a request fails.
         :return:
         """
-        with mock.patch('requests.get') as mock_request:
-            response = requests.Response()
-            response.status_code = 404
-            mock_request.return_value = response
+        session = mock.Mock(spec=requests.Session)
+        response = requests.Response()
+        response.status_code = 404
+        session.get.return_value = response
 
-            self.assertRaises(requests.HTTPError,
-                              get_response_for_location,
-                              'oesterreich',
-                              'niederoesterreich',
-                              'somewhere')
+        self.assertRaises(requests.HTTPError,
+                          get_response_for_location,
+                          'oesterreich',
+                          'niederoesterreich',
+                          'somewhere',
+                          session=session)
+
+
+class TestSession(unittest.TestCase):
+    def tearDown(self):
+        """
+
+        :return:
+        """
+        configure_session()
+
+    def test_000_reuse_connection(self):
+        with stand_in_server() as server:
+            for _ in range(3):
+                get_response_for_location('oesterreich',
+                                          'niederoesterreich',
+                                          'moedling')
+
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(server.connections, 1)
+
+    def test_001_no_keep_alive(self):
+        configure_session(keep_alive=False)
+
+        with stand_in_server() as server:
+            for _ in range(3):
+                get_response_for_location('oesterreich',
+                                          'niederoesterreich',
+                                          'moedling')
+
+        self.assertEqual(server.connections, 3)
+
+    def test_002_configure_session(self):
+        session = create_session(pool_size=2)
+        self.assertIs(configure_session(session=session), session)
+        self.assertIs(get_session(), session)
+
+        with self.assertRaises(ValueError):
+            create_session(pool_size=0)
+
+    def test_003_inject_session(self):
+        session = create_session()
+        with stand_in_server() as server:
+            weatheregg = WeatherEgg('oesterreich',
+                                    'niederoesterreich',
+                                    'moedling',
+                                    session=session)
+            weatheregg.weather_forecast(fresh=True)
+
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(server.connections, 1)
+        self.assertIsNot(get_session(), session)
+
+
+class TestConditionalRequests(unittest.TestCase):
+    def test_000_not_modified(self):
+        validators = Validators()
+        with stand_in_server() as server:
+            weather = get_weather_for_location('oesterreich',
+                                               'niederoesterreich',
+                                               'moedling',
+                                               validators=validators)
+            self.assertEqual(len(weather['temperature']), 48)
+
+            weather = get_weather_for_location('oesterreich',
+                                               'niederoesterreich',
+                                               'moedling',
+                                               validators=validators)
+            self.assertIsNone(weather)
+
+        self.assertNotIn('If-None-Match', server.headers[0])
+        self.assertIn('If-None-Match', server.headers[1])
+        self.assertIn('If-Modified-Since', server.headers[1])
+
+    def test_001_modified(self):
+        validators = Validators()
+        with stand_in_server() as server:
+            get_weather_for_location('oesterreich', 'niederoesterreich',
+                                     'moedling', validators=validators)
+
+            server.page = server.page.replace(b'"temp": ', b'"temp": 1')
+            weather = get_weather_for_location('oesterreich',
+                                               'niederoesterreich',
+                                               'moedling',
+                                               validators=validators)
+
+        self.assertEqual(len(weather['temperature']), 48)
+
+    def test_002_update_forecast(self):
+        with stand_in_server():
+            weatheregg = WeatherEgg('oesterreich',
+                                    'niederoesterreich',
+                                    'moedling')
+
+            self.assertIsNotNone(weatheregg.update_forecast())
+            self.assertIsNone(weatheregg.update_forecast())
+            self.assertIsNone(weatheregg.update_forecast())
+            # unconditional requests always return the forecast
+            self.assertIsNotNone(weatheregg.weather_forecast())
+
+        self.assertEqual(weatheregg.unchanged, 2)
+
+
+def create_response(page: bytes) -> requests.Response:
+    """
+    Creates a response for a recorded page.
+
+    :param page:
+    :return:
+    """
+    response = requests.Response()
+    response.status_code = 200
+    response._content = page
+    response._content_consumed = True
+    return response
+
+
+class TestParseLocationInfo(unittest.TestCase):
+    def test_000_corpus(self):
+        pattern = re.compile(r"var locationInfo = (?P<weather>.*);")
+        for name in list_pages():
+            with self.subTest(page=name):
+                content = read_page(name).decode('utf-8')
+                text = pattern.search(content).group('weather')
+
+                self.assertEqual(parse_location_info(text),
+                                 literal_eval(text))
+                self.assertEqual(parse_location_info(text.encode('utf-8')),
+                                 literal_eval(text))
+
+    def test_001_invalid(self):
+        with self.assertRaises(SyntaxError):
+            parse_location_info('{"hourly": [')
+
+    def test_002_parse_response(self):
+        for name in list_pages():
+            with self.subTest(page=name):
+                weather = parse_response(create_response(read_page(name)))
+
+                for field in ['timestamp', 'temperature', 'cloudiness',
+                              'rain', 'wind_velocity']:
+                    self.assertEqual(len(weather[field]), 48)
+
+
+class TestExtractLocationInfo(unittest.TestCase):
+    @staticmethod
+    def chunks(page: bytes, size: int, consumed: list):
+        for i in range(0, len(page), size):
+            consumed.append(i)
+            yield page[i:i + size]
+
+    def test_000_equals_regex(self):
+        pattern = re.compile(rb"var locationInfo = (?P<weather>.*);")
+        for name in list_pages():
+            page = read_page(name)
+            expected = pattern.search(page).group('weather')
+            for size in (1, 7, 19, 1024, len(page)):
+                with self.subTest(page=name, size=size):
+                    consumed = []
+                    self.assertEqual(
+                        extract_location_info(
+                            self.chunks(page, size, consumed)),
+                        expected
+                    )
+
+    def test_001_stop_reading(self):
+        page = read_page()
+        consumed = []
+        extract_location_info(self.chunks(page, 1024, consumed))
+
+        end = page.index(b'\n', page.index(b'var locationInfo = '))
+        self.assertEqual(consumed[-1], end // 1024 * 1024)
+        self.assertLess(len(consumed), len(page) // 1024)
+
+    def test_002_missing(self):
+        self.assertIsNone(extract_location_info([b'<html>', b'</html>']))
+        self.assertIsNone(
+            extract_location_info([b'var locationInfo = {}\n', b';'])
+        )
+
+    def test_003_stream(self):
+        with stand_in_server():
+            streamed = get_weather_for_location('oesterreich',
+                                                'niederoesterreich',
+                                                'moedling',
+                                                stream=True)
+            weather = get_weather_for_location('oesterreich',
+                                               'niederoesterreich',
+                                               'moedling')
+
+        self.assertEqual(streamed, weather)
+
+
+class TestParseHourly(unittest.TestCase):
+    def test_000_equals_former_parser(self):
+        pattern = re.compile(r"var locationInfo = (?P<weather>.*);")
+        tz = pytz.timezone('Europe/Vienna')
+        for name in list_pages():
+            with self.subTest(page=name):
+                content = read_page(name).decode('utf-8')
+                hourly = parse_location_info(
+                    pattern.search(content).group('weather'))['hourly']
+
+                forecast = parse_hourly(hourly, tz=tz)
+
+                columns = flip_list_of_dicts(hourly)
+                self.assertEqual(list(forecast['timestamp']),
+                                 time_to_datetime(columns['periodText'], tz))
+                for old, new in [('temp', 'temperature'),
+                                 ('cloud', 'cloudiness'),
+                                 ('rain', 'rain'),
+                                 ('wind', 'wind_velocity')]:
+                    self.assertEqual(forecast[new].tolist(),
+                                     convert_to_int(columns[old]))
+
+    def test_001_empty(self):
+        with self.assertRaises(ValueError):
+            parse_hourly([])
+
+
+class TestTimeContext(unittest.TestCase):
+    def setUp(self):
+        """
+
+        :return:
+        """
+        pattern = re.compile(r"var locationInfo = (?P<weather>.*);")
+        self.hourly = [parse_location_info(pattern.search(
+            read_page(name).decode('utf-8')).group('weather'))['hourly']
+                       for name in list_pages()]
+
+    def test_000_frozen_clock(self):
+        tz = pytz.timezone('Europe/Vienna')
+        now = tz.localize(datetime.datetime(2019, 6, 1, 12))
+        context = TimeContext(clock=FakeClock(now.timestamp()))
+
+        self.assertEqual(context.now(tz), now)
+        self.assertIs(context.now(tz), context.now(tz))
+        self.assertEqual(context.now(pytz.utc), now)
+        self.assertEqual(TimeContext(now=now).now(pytz.utc), now)
+
+        for hourly in self.hourly:
+            self.assertEqual(parse_hourly(hourly, tz=tz, time_context=context),
+                             parse_hourly(hourly, tz=tz, now=now))
+
+    def test_001_resolved_once_per_zone(self):
+        context = TimeContext()
+        zones = (None, pytz.timezone('Europe/Vienna'), pytz.utc)
+        with mock.patch('weatheregg.weatheregg.get_correct_day',
+                        wraps=get_correct_day) as correct_day:
+            for tz in zones:
+                for _ in range(3):
+                    for hourly in self.hourly:
+                        parse_hourly(hourly, tz=tz, time_context=context)
+
+        periods = {hourly[0]['periodText'] for hourly in self.hourly}
+        self.assertEqual(correct_day.call_count,
+                         len(zones) * len(periods))
+
+    def test_002_get_weather_for_location(self):
+        now = datetime.datetime(2019, 6, 1, 12)
+        context = TimeContext(now=now)
+        with stand_in_server():
+            forecasts = [get_weather_for_location('oesterreich', 'wien',
+                                                  name, time_context=context)
+                         for name in list_pages()]
+
+        for forecast in forecasts:
+            self.assertIn(forecast.timestamps.start.date(),
+                          (now.date(), now.date() - datetime.timedelta(1)))
+
+
+class TestWeatherEggCache(unittest.TestCase):
+    def test_000_one_request(self):
+        with stand_in_server() as server:
+            weatheregg = WeatherEgg('oesterreich',
+                                    'niederoesterreich',
+                                    'moedling')
+            weatheregg.current_weather()
+            weatheregg.current_temperature()
+            weatheregg.current_cloudiness()
+            weatheregg.current_rain()
+            weatheregg.current_wind_velocity()
+            weatheregg.weather_forecast()
+
+        self.assertEqual(len(server.requests), 1)
+
+    def test_001_fresh_and_invalidate(self):
+        with stand_in_server() as server:
+            weatheregg = WeatherEgg('oesterreich',
+                                    'niederoesterreich',
+                                    'moedling')
+            weatheregg.current_temperature(fresh=True)
+            weatheregg.current_temperature()
+            weatheregg.invalidate()
+            weatheregg.current_temperature()
+
+        self.assertEqual(len(server.requests), 3)
+
+    def test_002_shared_cache(self):
+        cache = ForecastCache()
+        with stand_in_server() as server:
+            for _ in range(3):
+                WeatherEgg('oesterreich', 'niederoesterreich', 'moedling',
+                           cache=cache).weather_forecast()
+            WeatherEgg('oesterreich', 'niederoesterreich', 'moedling',
+                       cache_ttl=0).weather_forecast()
+
+        # the location is still checked by every new WeatherEgg.
+        self.assertEqual(len(server.requests), 5)
+        self.assertEqual(len(cache), 1)
+
+    def test_003_cached_forecast_is_read_only(self):
+        cache = ForecastCache()
+        with stand_in_server():
+            first = WeatherEgg('oesterreich', 'niederoesterreich',
+                               'moedling', cache=cache)
+            second = WeatherEgg('oesterreich', 'niederoesterreich',
+                                'moedling', cache=cache)
+            temperature = first.weather_forecast()['temperature'][0]
+
+            with self.assertRaises(TypeError):
+                first.weather_forecast()['temperature'][0] = 99
+            self.assertEqual(second.weather_forecast()['temperature'][0],
+                             temperature)
+
+
+class TestValidation(unittest.TestCase):
+    def test_000_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            WeatherEgg('oesterreich', 'wien', 'wien', validate='later')
+
+    def test_001_lazy(self):
+        with stand_in_server(pages={'nowhere': b'<html></html>'}) as server:
+            weatheregg = WeatherEgg('oesterreich', 'wien', 'nowhere',
+                                    validate='lazy')
+            self.assertFalse(weatheregg.validated)
+            self.assertEqual(len(server.requests), 0)
+
+            with self.assertRaises(LocationError):
+                weatheregg.current_temperature()
+
+            self.assertFalse(weatheregg.validated)
+
+    def test_002_off(self):
+        with stand_in_server() as server:
+            weatheregg = WeatherEgg('oesterreich', 'niederoesterreich',
+                                    'moedling', validate='off')
+            self.assertTrue(weatheregg.validated)
+            self.assertIsNone(weatheregg.first_forecast)
+            self.assertEqual(len(weatheregg.update_forecast()['rain']), 48)
+
+        self.assertEqual(len(server.requests), 1)
+
+    def test_003_first_forecast_is_reused(self):
+        with stand_in_server() as server:
+            weatheregg = WeatherEgg('oesterreich', 'niederoesterreich',
+                                    'moedling')
+            first = weatheregg.first_forecast
+            self.assertIsNotNone(first)
+            self.assertIs(weatheregg.update_forecast(), first)
+            self.assertEqual(len(server.requests), 1)
+
+            # the page did not change since the location check.
+            self.assertIsNone(weatheregg.update_forecast())
+
+        self.assertEqual(len(server.requests), 2)
+        self.assertIn('If-None-Match', server.headers[-1])
+
+    def test_004_expired_first_forecast(self):
+        with stand_in_server() as server:
+            weatheregg = WeatherEgg('oesterreich', 'niederoesterreich',
+                                    'moedling', cache_ttl=0)
+            self.assertIsNone(weatheregg.first_forecast)
+            weatheregg.update_forecast()
+
+        self.assertEqual(len(server.requests), 2)
 
 
 # class TestParseChart(unittest.TestCase):
@@ -221,6 +618,68 @@ class TestSave(unittest.TestCase):
         check_file(self, backlog_file_path)
 
 
+class TestAtomicSave(unittest.TestCase):
+    def setUp(self):
+        """
+
+        :return:
+        """
+        self.data_path = str(path.join(TEST_DIR, str(uuid.uuid4())))
+        makedirs(self.data_path)
+        self.file_path = path.join(self.data_path, FILE_NAME)
+
+    def tearDown(self):
+        """
+
+        :return:
+        """
+        rmtree(self.data_path)
+
+    def test_000_replace(self):
+        save_data_to_csv(create_forecast(), self.file_path)
+        save_data_to_csv(create_forecast(), self.file_path)
+
+        check_file(self, self.file_path)
+        self.assertEqual(listdir(self.data_path), [FILE_NAME])
+        with open(self.file_path, 'rb') as f:
+            lines = f.read().split(b'\r\n')
+        self.assertEqual(lines[1], b'2019-06-01 22:00,0,0,0,48')
+
+    def test_001_failed_write(self):
+        save_data_to_csv(create_forecast(), self.file_path)
+
+        with mock.patch('weatheregg.weatheregg.os.replace',
+                        side_effect=OSError()):
+            with self.assertRaises(OSError):
+                save_data_to_csv(create_forecast(hours=2), self.file_path)
+
+        check_file(self, self.file_path)
+        self.assertEqual(listdir(self.data_path), [FILE_NAME])
+
+    def test_002_fsync(self):
+        with mock.patch('weatheregg.weatheregg.os.fsync') as fsync:
+            save_data_to_csv(create_forecast(), self.file_path)
+            fsync.assert_not_called()
+
+            save(create_forecast(), self.data_path, fsync=True)
+            # current file, its directory, backlog file and its directory
+            self.assertEqual(fsync.call_count, 4)
+
+    def test_003_skip_identical_forecast(self):
+        page = read_page()
+        with stand_in_server() as server:
+            weatheregg = WeatherEgg('oesterreich', 'niederoesterreich',
+                                    'moedling', validate='off')
+            self.assertIsNotNone(weatheregg.update_forecast())
+
+            # the page changed, but the forecast did not.
+            server.page = page + b'<!-- changed -->'
+            self.assertIsNone(weatheregg.update_forecast())
+
+        self.assertEqual(weatheregg.unchanged, 1)
+        self.assertEqual(len(server.requests), 2)
+
+
 class TestWeatherEgg(unittest.TestCase):
     def setUp(self):
         """
@@ -297,3 +756,65 @@ class TestWeatherEgg(unittest.TestCase):
 
         with self.assertRaises(ValueError):
             weatheregg.run_forever()
+
+    def test_005_run_forever_aligned(self):
+        data_path = str(path.join(TEST_DIR, str(uuid.uuid4())))
+        weatheregg = WeatherEgg('oesterreich', 'wien', 'wien',
+                                data_dir=data_path, validate='off')
+        clock = FakeClock(start=1000.)
+        scheduler = Scheduler(clock)
+        updates = []
+
+        def update_forecast():
+            updates.append(clock.time())
+            clock.advance(30.)
+            if len(updates) == 3:
+                scheduler.stop()
+
+        try:
+            with mock.patch('weatheregg.weatheregg.create_logger'), \
+                    mock.patch.object(weatheregg, 'update_forecast',
+                                      side_effect=update_forecast), \
+                    mock.patch.object(weatheregg, 'save'):
+                weatheregg.run_forever(offset=5, scheduler=scheduler)
+        finally:
+            rmtree(data_path)
+
+        # right away, then 5 minutes after every full hour
+        self.assertEqual(updates, [1000., 3900., 7500.])
+
+    def test_006_run_forever_in_thread(self):
+        data_path = str(path.join(TEST_DIR, str(uuid.uuid4())))
+        weatheregg = WeatherEgg('oesterreich', 'wien', 'wien',
+                                data_dir=data_path, validate='off')
+        clock = FakeClock(start=1000.)
+        scheduler = Scheduler(clock)
+        updates = []
+        errors = []
+
+        def update_forecast():
+            updates.append(clock.time())
+            if len(updates) == 2:
+                scheduler.stop()
+
+        def run():
+            # signal handlers can only be installed in the main thread.
+            try:
+                weatheregg.run_forever(scheduler=scheduler)
+            except Exception as error:
+                errors.append(error)
+
+        try:
+            with mock.patch('weatheregg.weatheregg.create_logger'), \
+                    mock.patch.object(weatheregg, 'update_forecast',
+                                      side_effect=update_forecast), \
+                    mock.patch.object(weatheregg, 'save'):
+                thread = threading.Thread(target=run)
+                thread.start()
+                thread.join(10)
+        finally:
+            rmtree(data_path)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(errors, [])
+        self.assertEqual(updates, [1000., 3600.])
@@ -1,27 +1,60 @@
 import sys
+from array import array
 from ast import literal_eval
 from pathlib import PurePath
 from os import path, makedirs
+import io
+import os
+import uuid
 import typing as T
 import logging
 import csv
-import time
 import datetime
-import re
+import json
+import threading
 import pytz
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from weatheregg.backlog import KEYFRAME_INTERVAL, SegmentStore
+from weatheregg.cache import CACHE_TTL, DiskCache, ForecastCache
+from weatheregg.compression import check_compression, compress, \
+    compression_of, suffix
+from weatheregg.forecast import TYPECODE, Forecast, Timestamps, \
+    format_timestamps
+from weatheregg.log import configure_logging
+from weatheregg.metrics import FAILED, PARSE, REJECTED, REQUEST, SAVE, \
+    SAVED, UNCHANGED, record_update, timed, write_textfile
+from weatheregg.retry import RETRY_INTERVAL, RetryPolicy, default_policy
+from weatheregg.scheduler import Clock, Scheduler
 
 FILE_NAME = 'current_weather.csv'
 FILE_PATTERN = "{0:%Y_%m_%d_%H_%M}.csv"
 DATA_DIR_NAME = 'weather_back_log'
+# csv: one csv file per update, segments: see weatheregg.backlog,
+# delta: segments with delta encoded snapshots
+BACKLOG_FORMATS = ('csv', 'segments', 'delta')
 
 TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M'
 
+# the forecast is assigned to this javascript variable in the page:
+LOCATION_INFO = b'var locationInfo = '
+CHUNK_SIZE = 16 * 1024  # bytes
+
 # wetter.at url pattern:
 WETTER_AT = 'http://www.wetter.at/wetter/'
 WETTER_AT += '{country}/{state}/{location}/prognose/stuendlich'
 
+# connection pool settings:
+POOL_SIZE = 10
+KEEP_ALIVE = True
+TIMEOUT = 30  # seconds
+
+_session = None  # type: T.Union[requests.Session, None]
+_session_lock = threading.Lock()
+_timeout = TIMEOUT
+
 
 class WeathereggException(Exception):
     pass
@@ -37,20 +70,20 @@ class ParseError(WeathereggException):
     pass
 
 
-def get_response_for_location(country: str,
-                              state: str,
-                              location: str) -> requests.Response:
+def get_url_for_location(country: str,
+                         state: str,
+                         location: str) -> str:
     """
-    This class makes a request to wetter.at to get the current weather
-    data for the provided location.
+    Returns the wetter.at url for the provided location.
+
     :param country:
     :param state:
     :param location:
     :return:
     """
-    if any(len(s) == 0 or
-           s is None or
-           not isinstance(s, str)
+    if any(s is None or
+           not isinstance(s, str) or
+           len(s) == 0
            for s in (country, state, location)):
         msg = 'country, state and location can not be empty or None and ' \
               'they must be strings.'
@@ -60,20 +93,206 @@ def get_response_for_location(country: str,
     state = state.strip().lower()
     location = location.strip().lower()
 
-    url = WETTER_AT.format(country=country,
-                           state=state,
-                           location=location)
+    return WETTER_AT.format(country=country,
+                            state=state,
+                            location=location)
+
+
+def create_session(pool_size: int = POOL_SIZE,
+                   keep_alive: bool = KEEP_ALIVE) -> requests.Session:
+    """
+    Creates a session which keeps up to `pool_size` connections per host
+    open for reuse.
+
+    :param pool_size:
+    :param keep_alive: if False, every connection is closed after the
+        response
+    :return:
+    """
+    if pool_size < 1:
+        msg = 'The pool size must be at least 1. Got {}.'
+        raise ValueError(msg.format(pool_size))
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size,
+                          pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+
+    return session
+
+
+def configure_session(pool_size: int = POOL_SIZE,
+                      keep_alive: bool = KEEP_ALIVE,
+                      timeout: T.Union[float, None] = TIMEOUT,
+                      session: T.Union[requests.Session, None] = None
+                      ) -> requests.Session:
+    """
+    Replaces the shared session which is used by default for all requests
+    to wetter.at. Instead of creating a new session, an existing session,
+    e. g. one with a fake transport adapter, can be provided.
+
+    :param pool_size:
+    :param keep_alive:
+    :param timeout: seconds until a request is aborted
+    :param session:
+    :return: the new shared session
+    """
+    global _session, _timeout
+
+    if session is None:
+        session = create_session(pool_size=pool_size, keep_alive=keep_alive)
+
+    with _session_lock:
+        old_session, _session = _session, session
+        _timeout = timeout
+
+    if old_session is not None and old_session is not session:
+        old_session.close()
+
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the shared session. It is created on first use.
+
+    :return:
+    """
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+
+class Validators:
+    """
+    Remembers the ETag and Last-Modified validators of the responses per
+    url, so the next request for the url can be conditional.
+    """
+
+    def __init__(self):
+        # url -> conditional request headers
+        self._headers = {}  # type: T.Dict[str, T.Dict[str, str]]
+        self._lock = threading.Lock()
+
+    def headers(self, url: str) -> T.Dict[str, str]:
+        """
+        Returns the conditional request headers for the url.
+
+        :param url:
+        :return:
+        """
+        with self._lock:
+            return dict(self._headers.get(url, {}))
+
+    def update(self, url: str, response: requests.Response) -> None:
+        """
+        Remembers the validators of the response for the url.
+
+        :param url:
+        :param response:
+        :return:
+        """
+        headers = {}
+        etag = response.headers.get('ETag')
+        if etag:
+            headers['If-None-Match'] = etag
+        last_modified = response.headers.get('Last-Modified')
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        with self._lock:
+            if headers:
+                self._headers[url] = headers
+            else:
+                self._headers.pop(url, None)
+
+    def clear(self) -> None:
+        """
+        Forgets all validators.
+
+        :return:
+        """
+        with self._lock:
+            self._headers.clear()
+
+
+def get_response_for_location(
+        country: str,
+        state: str,
+        location: str,
+        session: T.Union[requests.Session, None] = None,
+        validators: T.Union[Validators, None] = None,
+        stream: bool = False,
+        disk_cache: T.Union[DiskCache, None] = None
+) -> requests.Response:
+    """
+    This class makes a request to wetter.at to get the current weather
+    data for the provided location.
+    If validators are provided, the request is conditional and the
+    response has status code 304 if the page did not change.
+    If stream is set, only the headers are downloaded and the page is read
+    on demand. Note that the connection of a streamed response is not
+    reused if the page is not read to the end.
+    If a disk cache is provided, a cached page is returned without a
+    request and new pages are stored in the cache. Responses for the cache
+    are never streamed.
+    :param country:
+    :param state:
+    :param location:
+    :param session: defaults to the shared session
+    :param validators:
+    :param stream:
+    :param disk_cache:
+    :return:
+    """
+    url = get_url_for_location(country, state, location)
+
+    if disk_cache is not None:
+        content = disk_cache.get(url)
+        if content is not None:
+            return _create_cached_response(url, content)
+        stream = False
 
-    response = requests.get(url)
+    if session is None:
+        session = get_session()
+
+    headers = validators.headers(url) if validators is not None else None
+
+    response = session.get(url, headers=headers, timeout=_timeout,
+                           stream=stream)
+
+    if response.status_code == 304 and headers:
+        return response
 
-    if response.status_code != 200:
+    elif response.status_code != 200:
+        if stream:
+            response.close()
         msg = '{} not found! Got status code {}'.format(
             url, response.status_code
         )
         raise requests.HTTPError(msg)
 
-    else:
-        return response
+    if disk_cache is not None:
+        disk_cache.put(url, response.content)
+
+    return response
+
+
+def _create_cached_response(url: str, content: bytes) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response.encoding = 'utf-8'
+    response._content = content
+    response._content_consumed = True
+    return response
 
 
 #
@@ -169,38 +388,157 @@ def get_response_for_location(country: str,
 #     return tuple(time_list)
 
 
-def parse_response(response: requests.Response):
-    content = response.content.decode("utf-8")
+def parse_location_info(text: T.Union[str, bytes]) -> dict:
+    """
+    Converts the `locationInfo` object of the page to a dict. The object is
+    usually valid JSON, which is parsed much faster than building a python
+    AST with `literal_eval`. Only if it is not, it is evaluated as python
+    literal.
 
-    weather = re.search(r"var locationInfo = (?P<weather>.*);", content)
+    :param text:
+    :return:
+    """
+    try:
+        return json.loads(text)
+    except ValueError:
+        if isinstance(text, bytes):
+            text = text.decode('utf-8')
+        return literal_eval(text)
 
+
+def extract_location_info(chunks: T.Iterable[bytes]) -> T.Union[bytes, None]:
+    """
+    Searches the chunks of a page for the `locationInfo` assignment and
+    returns the assigned object. The assignment ends with the last `;` of
+    its line. No more chunks are read once the line is complete.
+    Returns None if the page has no `locationInfo`.
+
+    :param chunks:
+    :return:
+    """
+    buffer = bytearray()
+    found = False
+    searched = 0
+
+    for chunk in chunks:
+        buffer += chunk
+
+        if not found:
+            start = buffer.find(LOCATION_INFO)
+            if start < 0:
+                # keep the tail, it might contain a part of the marker.
+                del buffer[:max(0, len(buffer) - len(LOCATION_INFO) + 1)]
+                continue
+            del buffer[:start + len(LOCATION_INFO)]
+            found = True
+
+        end = buffer.find(b'\n', searched)
+        if end >= 0:
+            del buffer[end:]
+            break
+        searched = len(buffer)
+
+    if not found:
+        return None
+
+    end = buffer.rfind(b';')
+    if end < 0:
+        return None
+
+    return bytes(buffer[:end])
+
+
+def parse_response(response: requests.Response,
+                   tz: T.Union[datetime.tzinfo, None] = None,
+                   time_context: T.Union['TimeContext', None] = None
+                   ) -> Forecast:
+    # for a streamed response only the beginning of the page is downloaded.
+    forecast = parse_page(response.iter_content(CHUNK_SIZE), tz=tz,
+                          time_context=time_context)
+    response.close()
+    return forecast
+
+
+def parse_page(page: T.Union[bytes, T.Iterable[bytes]],
+               tz: T.Union[datetime.tzinfo, None] = None,
+               now: T.Union[datetime.datetime, None] = None,
+               time_context: T.Union['TimeContext', None] = None) -> Forecast:
+    """
+    Parses the forecast of a wetter.at page, e. g. a saved one.
+
+    :param page: the page or its chunks
+    :param tz:
+    :param now: the time of the request, defaults to the current time
+    :param time_context: the time of a refresh cycle, replaces now
+    :return:
+    """
+    if isinstance(page, bytes):
+        page = (page, )
+
+    weather = extract_location_info(page)
     if weather is None:
         raise LocationError("Weather data not found. "
                             "The website might have changed or "
                             "there is no information "
                             "for the provided location")
-    weather = weather.group("weather")
-    weather = literal_eval(weather)
+    weather = parse_location_info(weather)
     hourly_data = weather.get('hourly')
     if hourly_data is None:
         raise WeathereggException("Parsing error in data. The data format "
                                   "might have changed.")
 
-    hourly_data = flip_list_of_dicts(hourly_data)
-    hourly_data['temp'] = convert_to_int(hourly_data['temp'])
-    rename(hourly_data, 'temp', 'temperature')
-    hourly_data['wind'] = convert_to_int(hourly_data['wind'])
-    rename(hourly_data, 'wind', 'wind_velocity')
-    hourly_data['cloud'] = convert_to_int(hourly_data['cloud'])
-    rename(hourly_data, 'cloud', 'cloudiness')
-    hourly_data['rain'] = convert_to_int(hourly_data['rain'])
+    return parse_hourly(hourly_data, tz=tz, now=now,
+                        time_context=time_context)
 
-    rename(hourly_data, 'periodText', 'timestamp')
 
-    save_del(hourly_data, 'info')
-    save_del(hourly_data, 'icon')
+def parse_hourly(hourly_data: T.Sequence[dict],
+                 tz: T.Union[datetime.tzinfo, None] = None,
+                 now: T.Union[datetime.datetime, None] = None,
+                 time_context: T.Union['TimeContext', None] = None
+                 ) -> Forecast:
+    """
+    Converts the hourly data of the page to a Forecast in a single pass.
+    The values go straight into the typed columns, only the time of the
+    first hour is parsed.
 
-    return hourly_data
+    :param hourly_data:
+    :param tz:
+    :param now: the time of the request, defaults to the current time
+    :param time_context: the time of a refresh cycle, replaces now
+    :return:
+    """
+    if len(hourly_data) == 0:
+        raise ValueError("List is empty.")
+
+    temperature = array(TYPECODE)
+    cloudiness = array(TYPECODE)
+    rain = array(TYPECODE)
+    wind_velocity = array(TYPECODE)
+
+    add_temperature = temperature.append
+    add_cloudiness = cloudiness.append
+    add_rain = rain.append
+    add_wind_velocity = wind_velocity.append
+
+    for hour in hourly_data:
+        add_temperature(int(hour['temp']))
+        add_cloudiness(int(hour['cloud']))
+        add_rain(int(hour['rain']))
+        add_wind_velocity(int(hour['wind']))
+
+    period_text = hourly_data[0]['periodText']
+    if time_context is not None:
+        start = time_context.start_time(period_text, tz=tz)
+    else:
+        start = get_start_time(period_text, tz=tz, now=now)
+
+    return Forecast(
+        Timestamps(start, len(hourly_data)),
+        temperature=temperature,
+        cloudiness=cloudiness,
+        rain=rain,
+        wind_velocity=wind_velocity
+    )
 
 
 def rename(d, k_old, k_new):
@@ -216,13 +554,20 @@ def is_inter_datetime(dt):
         return True
 
 
-def get_correct_day(t0, tz=None):
+def get_correct_day(t0, tz=None, now=None):
     """
     Is required to determine if the current day is correct.
     Imagine the request is after midnight but you still get the weather
     of 11:00pm.
+    The day is determined relative to `now`, the time of the request,
+    which defaults to the current time.
     """
-    current_datetime = datetime.datetime.now(tz=tz)
+    if now is None:
+        current_datetime = datetime.datetime.now(tz=tz)
+    elif tz is not None and now.tzinfo is not None:
+        current_datetime = now.astimezone(tz)
+    else:
+        current_datetime = now
 
     day_is_not_correct = is_inter_datetime(current_datetime) and t0 > \
                          datetime.time(20)
@@ -233,14 +578,95 @@ def get_correct_day(t0, tz=None):
     return day
 
 
+class TimeContext:
+    """
+    The time of a refresh cycle. The current time is taken once and the
+    day of a forecast is resolved once per timezone and period, so the
+    forecasts of many locations share the date logic. A context with a
+    fixed `now` or a FakeClock freezes the time.
+
+    Usage::
+        >>> context = TimeContext()
+        >>> for country, state, location in locations:
+        ...     get_weather_for_location(
+        ...         country, state, location, tz=tz, time_context=context
+        ...     )  # doctest: +SKIP
+
+    """
+
+    def __init__(self,
+                 now: T.Union[datetime.datetime, None] = None,
+                 clock: T.Union[Clock, None] = None):
+        if now is None:
+            clock = clock if clock is not None else Clock()
+            self._timestamp = clock.time()  # type: T.Union[float, None]
+        else:
+            self._timestamp = None
+        self._fixed = now
+        # timezone -> current time
+        self._now = {}  # type: T.Dict[T.Any, datetime.datetime]
+        # (timezone, period text) -> start time
+        self._starts = {}  # type: T.Dict[tuple, datetime.datetime]
+
+    def now(self, tz: T.Union[datetime.tzinfo, None] = None
+            ) -> datetime.datetime:
+        """
+        Returns the time of the cycle in the timezone.
+
+        :param tz:
+        :return:
+        """
+        now = self._now.get(tz)
+        if now is None:
+            if self._fixed is None:
+                now = datetime.datetime.fromtimestamp(self._timestamp, tz)
+            elif tz is not None and self._fixed.tzinfo is not None:
+                now = self._fixed.astimezone(tz)
+            else:
+                now = self._fixed
+            self._now[tz] = now
+        return now
+
+    def start_time(self, period_text: str,
+                   tz: T.Union[datetime.tzinfo, None] = None
+                   ) -> datetime.datetime:
+        """
+        Like `get_start_time`, but resolved once per timezone and period.
+
+        :param period_text:
+        :param tz:
+        :return:
+        """
+        key = tz, period_text
+        start = self._starts.get(key)
+        if start is None:
+            start = get_start_time(period_text, tz=tz, now=self.now(tz))
+            self._starts[key] = start
+        return start
+
+
 def time_to_datetime(l, tz=None):
+    return list(time_to_timestamps(l, tz=tz))
+
+
+def get_start_time(period_text: str, tz=None,
+                   now=None) -> datetime.datetime:
+    """
+    Returns the datetime of the first hour of the forecast.
+    """
+    t0 = datetime.time.fromisoformat(period_text)
+    day = get_correct_day(t0, tz=tz, now=now)
+    return datetime.datetime.combine(day, t0)
+
+
+def time_to_timestamps(l, tz=None) -> Timestamps:
+    """
+    Like `time_to_datetime`, but only the first hour is converted. The
+    timestamps are stored as start time plus an hourly step.
+    """
     if not l:
-        return []
-    n_hours = len(l)
-    t0 = datetime.time.fromisoformat(l[0])
-    day = get_correct_day(t0, tz=tz)
-    d0 = datetime.datetime.combine(day, t0)
-    return [d0 + datetime.timedelta(hours=i) for i in range(n_hours)]
+        return Timestamps(None, 0)
+    return Timestamps(get_start_time(l[0], tz=tz), len(l))
 
 
 def save_del(d, k):
@@ -262,10 +688,15 @@ def get_weather_for_location(
         country: str,
         state: str,
         location: str,
-        tz: T.Union[datetime.tzinfo, None] = None
-) -> dict:
+        tz: T.Union[datetime.tzinfo, None] = None,
+        session: T.Union[requests.Session, None] = None,
+        validators: T.Union[Validators, None] = None,
+        stream: bool = False,
+        disk_cache: T.Union[DiskCache, None] = None,
+        time_context: T.Union[TimeContext, None] = None
+) -> T.Union[Forecast, None]:
     """
-    Returns a tuple containing the following data:
+    Returns a Forecast containing the following data:
 
     - datetime in hours
     - temperature in °C
@@ -273,57 +704,161 @@ def get_weather_for_location(
     - precipitation in mm
     - wind velocity in km/h
 
+    If validators are provided, the request is conditional and None is
+    returned if the forecast did not change since the last request.
+    If stream is set, the download stops as soon as the forecast is found.
+    If a disk cache is provided, cached pages are used instead of requests.
+    The forecasts of a batch should share a TimeContext.
+
     :param country:
     :param state:
     :param location:
     :param tz:
+    :param session: defaults to the shared session
+    :param validators:
+    :param stream:
+    :param disk_cache:
+    :param time_context: the time of the refresh cycle, defaults to now
     :return:
     """
 
-    response = get_response_for_location(country, state, location)
-    weather = parse_response(response)
-    weather['timestamp'] = time_to_datetime(weather['timestamp'], tz)
+    with timed(REQUEST):
+        response = get_response_for_location(country, state, location,
+                                             session=session,
+                                             validators=validators,
+                                             stream=stream,
+                                             disk_cache=disk_cache)
+    if response.status_code == 304:
+        return None
+
+    with timed(PARSE):
+        weather = parse_response(response, tz=tz, time_context=time_context)
+
+    # only remember the validators once the page could be parsed.
+    if validators is not None:
+        url = get_url_for_location(country, state, location)
+        validators.update(url, response)
+
     return weather
 
 
-def save_data_to_csv(data: dict,
-                     file_path: T.Union[str, PurePath]) -> None:
+def save_data_to_csv(data: T.Mapping,
+                     file_path: T.Union[str, PurePath],
+                     fsync: bool = False) -> None:
     """
-    Function to write data to a csv file
+    Function to write data to a csv file.
+    The file is written to a temporary file first and then renamed, so
+    readers never see a partly written file. With fsync the data is flushed
+    to the disk before the rename and the rename itself is flushed too.
+    If the file name ends with .gz or .zst, the file is compressed.
 
     :param data:
     :param file_path:
+    :param fsync:
     :return:
     """
 
     file_path = str(file_path)
     file_path = str(path.abspath(file_path))
 
-    with open(file_path, 'w') as f:
-        csv_writer = csv.writer(f, delimiter=',')
-
-        # write header
-        csv_writer.writerow([
-            '',
-            'temperature',
-            'cloudiness',
-            'rain',
-            'wind_velocity'
-        ])
-
-        # write data
-        time = [t.strftime(TIMESTAMP_FORMAT) for t in data['timestamp']]
-        for d in zip(time,
-                     data['temperature'],
-                     data['cloudiness'],
-                     data['rain'],
-                     data['wind_velocity']):
-            csv_writer.writerow(d)
-
-
-def save(data: dict,
+    buffer = io.StringIO()
+    csv_writer = csv.writer(buffer, delimiter=',')
+
+    # write header
+    csv_writer.writerow([
+        '',
+        'temperature',
+        'cloudiness',
+        'rain',
+        'wind_velocity'
+    ])
+
+    # write data
+    time = format_timestamps(data['timestamp'], TIMESTAMP_FORMAT)
+    csv_writer.writerows(zip(time,
+                             data['temperature'],
+                             data['cloudiness'],
+                             data['rain'],
+                             data['wind_velocity']))
+
+    body = buffer.getvalue().encode('utf-8')
+    write_file(file_path, compress(body, compression_of(file_path)),
+               fsync=fsync)
+
+
+def write_file(file_path: T.Union[str, PurePath],
+               data: bytes,
+               fsync: bool = False) -> None:
+    """
+    Replaces the file atomically with the data.
+
+    :param file_path:
+    :param data:
+    :param fsync: flush the file and the rename to the disk
+    :return:
+    """
+    file_path = str(path.abspath(str(file_path)))
+    dir_path = path.dirname(file_path)
+    temp_path = '{}.{}.tmp'.format(file_path, uuid.uuid4().hex)
+    try:
+        # the permissions are the same as with open(file_path, 'w').
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        with open(fd, 'wb') as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    if fsync:
+        _fsync_dir(dir_path)
+
+
+def _fsync_dir(dir_path: str) -> None:
+    try:
+        fd = os.open(dir_path, os.O_RDONLY)
+    except OSError:  # pragma: no cover
+        # e. g. directories can not be opened on Windows.
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def check_backlog(backlog: str,
+                  compression: T.Union[str, None] = None) -> None:
+    """
+    Raises a ValueError if the backlog format or the compression is not
+    supported.
+
+    :param backlog: csv, segments or delta
+    :param compression: gzip, zstd or None
+    :return:
+    """
+    if backlog not in BACKLOG_FORMATS:
+        msg = 'backlog must be one of {}. Got {!r}.'
+        raise ValueError(msg.format(', '.join(BACKLOG_FORMATS), backlog))
+
+    check_compression(compression)
+    if compression is not None and backlog != 'csv':
+        msg = 'Only the csv backlog can be compressed.'
+        raise ValueError(msg)
+
+
+def save(data: T.Mapping,
          dir_path: T.Union[str, PurePath],
-         tz: T.Union[datetime.tzinfo, None] = None) -> None:
+         tz: T.Union[datetime.tzinfo, None] = None,
+         backlog: str = 'csv',
+         fsync: bool = False,
+         compression: T.Union[str, None] = None,
+         store: T.Union[SegmentStore, None] = None) -> None:
     """
     Function to save the data. First to the current
     file and then to the data directory.
@@ -331,32 +866,126 @@ def save(data: dict,
     :param data:
     :param dir_path:
     :param tz:
+    :param backlog: csv, segments or delta
+    :param fsync: flush the files to the disk
+    :param compression: gzip or zstd compresses the csv backlog files
+    :param store: the store of a segments or delta backlog, see
+        save_to_backlog
     :return:
     """
+    check_backlog(backlog, compression)
 
     dir_path = str(dir_path)
     dir_path = str(path.abspath(dir_path))
 
-    back_log_dir = str(path.join(dir_path, 'weather_back_log'))
+    back_log_dir = str(path.join(dir_path, DATA_DIR_NAME))
 
-    makedirs(dir_path, exist_ok=True)
-    makedirs(back_log_dir, exist_ok=True)
+    with timed(SAVE):
+        makedirs(dir_path, exist_ok=True)
+        makedirs(back_log_dir, exist_ok=True)
 
-    # save the current data
-    file_path = path.join(dir_path, FILE_NAME)
-    save_data_to_csv(data=data, file_path=file_path)
+        # save the current data
+        file_path = path.join(dir_path, FILE_NAME)
+        save_data_to_csv(data=data, file_path=file_path, fsync=fsync)
+
+        save_to_backlog(data, back_log_dir, datetime.datetime.now(tz=tz),
+                        backlog=backlog, fsync=fsync,
+                        compression=compression, store=store)
+
+
+def create_store(back_log_dir: T.Union[str, PurePath],
+                 backlog: str) -> T.Union[SegmentStore, None]:
+    """
+    Returns the SegmentStore of a segments or delta backlog and None for a
+    csv backlog.
 
-    dd = datetime.datetime.now(tz=tz)
-    dd = dd.replace(minute=0, second=0, microsecond=0)
+    :param back_log_dir:
+    :param backlog: csv, segments or delta
+    :return:
+    """
+    if backlog == 'csv':
+        return None
+    keyframe_interval = KEYFRAME_INTERVAL if backlog == 'delta' else None
+    return SegmentStore(back_log_dir, keyframe_interval)
+
+
+def save_to_backlog(data: T.Mapping,
+                    back_log_dir: T.Union[str, PurePath],
+                    fetched: datetime.datetime,
+                    backlog: str = 'csv',
+                    fsync: bool = False,
+                    compression: T.Union[str, None] = None,
+                    store: T.Union[SegmentStore, None] = None) -> None:
+    """
+    Adds the data to the backlog directory. The time of the update is
+    rounded down to the hour.
+
+    :param data:
+    :param back_log_dir:
+    :param fetched: the time of the update
+    :param backlog: csv, segments or delta
+    :param fsync: flush the files to the disk
+    :param compression: gzip or zstd compresses the csv backlog files
+    :param store: the store of a segments or delta backlog. Reusing it
+        between the updates saves reading the index of the day again.
+    :return:
+    """
+    dd = fetched.replace(minute=0, second=0, microsecond=0)
 
-    back_log_file_name = FILE_PATTERN.format(dd)
-    back_log_file_path = path.join(back_log_dir, back_log_file_name)
+    if backlog != 'csv':
+        if store is None:
+            store = create_store(back_log_dir, backlog)
+        store.append(data, fetched=dd, fsync=fsync)
+        return
+
+    back_log_file_name = FILE_PATTERN.format(dd) + suffix(compression)
+    back_log_file_path = path.join(str(back_log_dir), back_log_file_name)
 
     # if path.isfile(back_log_file_path):
     #     msg = '{} does already exist! cannot overwrite backlog file!'
     #     raise FileExistsError(msg.format(str(back_log_file_path)))
 
-    save_data_to_csv(data=data, file_path=back_log_file_path)
+    save_data_to_csv(data=data, file_path=back_log_file_path, fsync=fsync)
+
+
+def export_backlog_to_csv(back_log_dir: T.Union[str, PurePath],
+                          csv_dir: T.Union[str, PurePath, None] = None,
+                          compression: T.Union[str, None] = None) -> int:
+    """
+    Writes every snapshot of a segments backlog to a csv file, like the
+    csv backlog does. Returns the number of written files.
+
+    :param back_log_dir: directory of the segments
+    :param csv_dir: defaults to back_log_dir
+    :param compression: gzip, zstd or None
+    :return:
+    """
+    file_suffix = suffix(compression)
+    if csv_dir is None:
+        csv_dir = back_log_dir
+    csv_dir = str(path.abspath(str(csv_dir)))
+    makedirs(csv_dir, exist_ok=True)
+
+    count = 0
+    for fetched, forecast in SegmentStore(back_log_dir).snapshots():
+        file_path = path.join(csv_dir,
+                              FILE_PATTERN.format(fetched) + file_suffix)
+        save_data_to_csv(data=forecast, file_path=file_path)
+        count += 1
+    return count
+
+
+def create_logger(logging_file_path: T.Union[str, PurePath, None] = None
+                  ) -> logging.Logger:
+    """
+    Returns the weatheregg logger. The log messages are written to stderr
+    and, if a path is given, to the logging file. The logger is configured
+    once, see weatheregg.log.configure_logging.
+
+    :param logging_file_path:
+    :return:
+    """
+    return configure_logging(logging_file_path)
 
 
 def _clean_location(location: str):
@@ -386,17 +1015,33 @@ class WeatherEgg:
         ... )
 
         >>> weatheregg.weather_forecast()  # doctest: +ELLIPSIS
-        {...}
+        Forecast(...)
 
         >>> weatheregg.current_temperature()  # doctest: +SKIP
         >>> weatheregg.current_cloudiness()  # doctest: +SKIP
         >>> weatheregg.current_rain()  # doctest: +SKIP
         >>> weatheregg.current_wind_velocity()  # doctest: +SKIP
+        >>> weatheregg.current_temperature(fresh=True)  # doctest: +SKIP
+        >>> weatheregg.invalidate()  # doctest: +SKIP
         >>> weatheregg.run_forever()  # doctest: +SKIP
 
+    The forecast is cached for `cache_ttl` seconds, so the current values
+    are read from the same forecast. Pass a ForecastCache, e. g.
+    `weatheregg.cache.SHARED_CACHE`, to share the forecasts between
+    WeatherEggs.
+
+    The location is checked in __init__ by default. With `validate='lazy'`
+    it is checked by the first request for the forecast and with
+    `validate='off'` it is not checked at all. The forecast of the check is
+    returned by the first `update_forecast` call, so the page is not
+    requested twice. `weatheregg.aio.validate_weathereggs` checks many
+    WeatherEggs concurrently.
+
     """
 
-    RETRY_INTERVAL = 120  # seconds
+    VALIDATE_MODES = ('eager', 'lazy', 'off')
+    # seconds until the first retry, if run_forever gets no retry policy
+    RETRY_INTERVAL = RETRY_INTERVAL
 
     LINE_FORMAT = '{datetime}, {temp:>15}, {cloudiness:>15}, ' \
                   '{rain:>18}, {wind:>20}'
@@ -407,12 +1052,28 @@ class WeatherEgg:
                  location: str,
                  data_dir: T.Union[str, PurePath, None] = None,
                  tz: T.Union[datetime.tzinfo, None, str] = None,
-                 interval: int = 60):
+                 interval: int = 60,
+                 session: T.Union[requests.Session, None] = None,
+                 stream: bool = False,
+                 cache_ttl: float = CACHE_TTL,
+                 cache: T.Union[ForecastCache, None] = None,
+                 disk_cache: T.Union[DiskCache, None] = None,
+                 validate: str = 'eager',
+                 backlog: str = 'csv',
+                 fsync: bool = False,
+                 compression: T.Union[str, None] = None):
         interval = int(interval)
         if interval < 60:
             msg = 'Interval must be bigger than 60 minutes!'
             raise ValueError(msg)
 
+        if validate not in self.VALIDATE_MODES:
+            msg = 'validate must be one of {}. Got {!r}.'
+            raise ValueError(msg.format(', '.join(self.VALIDATE_MODES),
+                                        validate))
+
+        check_backlog(backlog, compression)
+
         if data_dir is not None:
             self._data_dir = str(data_dir)
             self._data_dir = str(path.abspath(data_dir))
@@ -427,14 +1088,29 @@ class WeatherEgg:
         self._location = _clean_location(location)
         self._tz = tz
         self._interval = interval
-
-        # check if the location exists:
-        get_weather_for_location(
-            self._country,
-            self._state,
-            self._location,
-            tz=self._tz
-        )
+        self._session = session
+        self._stream = stream
+        self._disk_cache = disk_cache
+        self._backlog = backlog
+        self._fsync = fsync
+        self._compression = compression
+        # the SegmentStore of the backlog, created by the first save
+        self._store = None  # type: T.Union[SegmentStore, None]
+        self._validators = Validators()
+        self._unchanged = 0
+        self._validated = validate == 'off'
+        # forecast of the location check, returned by the first update.
+        self._first_forecast = None  # type: T.Union[Forecast, None]
+        # the last forecast returned by update_forecast
+        self._last_update = None  # type: T.Union[Forecast, None]
+
+        if cache is None:
+            cache = ForecastCache(ttl=cache_ttl, maxsize=1)
+        self._cache = cache
+
+        if validate == 'eager':
+            # check if the location exists. The forecast is cached.
+            self.validate()
 
     @property
     def url(self) -> str:
@@ -449,66 +1125,203 @@ class WeatherEgg:
             location=self._location
         )
 
-    def _get_data(self) -> dict:
+    @property
+    def data_dir(self) -> T.Union[str, None]:
+        """
+        Returns the directory where the data is recorded.
+
+        :return:
+        """
+        return self._data_dir
+
+    @property
+    def interval(self) -> int:
+        """
+        Returns the update interval in minutes.
+
+        :return:
+        """
+        return self._interval
+
+    @property
+    def unchanged(self) -> int:
+        """
+        Returns how often `update_forecast` found the forecast unchanged.
+
+        :return:
+        """
+        return self._unchanged
+
+    @property
+    def validated(self) -> bool:
+        """
+        Returns if the location was checked or the check was turned off.
+
+        :return:
+        """
+        return self._validated
+
+    @property
+    def first_forecast(self) -> T.Union[Forecast, None]:
+        """
+        Returns the forecast of the location check until it is returned by
+        `update_forecast` or removed from the cache. Otherwise None.
+
+        :return:
+        """
+        data = self._first_forecast
+        if data is not None and self._cache.get(self._cache_key) is data:
+            return data
+        return None
+
+    @property
+    def _cache_key(self) -> tuple:
+        return self.url, self._tz
+
+    def validate(self,
+                 time_context: T.Union[TimeContext, None] = None
+                 ) -> Forecast:
+        """
+        Checks if the location exists on wetter.at and returns its forecast.
+        The forecast is cached and returned by the next `update_forecast`
+        call as long as it is in the cache.
+        Raises a LocationError if the location does not exist.
+
+        :param time_context: shared by the checks of a batch
+        :return:
+        """
+        # request the full page, even if the forecast is unchanged.
+        self._validators.clear()
+        data = self._get_data(conditional=True, time_context=time_context)
+        self._validated = True
+        self._first_forecast = data
+        return data
+
+    def _get_data(self,
+                  conditional: bool = False,
+                  time_context: T.Union[TimeContext, None] = None
+                  ) -> T.Union[Forecast, None]:
         data = get_weather_for_location(
             self._country,
             self._state,
             self._location,
-            tz=self._tz
+            tz=self._tz,
+            session=self._session,
+            validators=self._validators if conditional else None,
+            stream=self._stream,
+            disk_cache=self._disk_cache,
+            time_context=time_context
         )
 
+        if data is not None:
+            self._cache.put(self._cache_key, data)
+
         return data
 
-    def weather_forecast(self) -> dict:
+    def invalidate(self) -> None:
         """
-        Returns the 48 hours weather forecast.
+        Removes the cached forecast, so the next access requests a new one.
 
         :return:
         """
+        self._cache.invalidate(self._cache_key)
+
+    def update_forecast(self,
+                        time_context: T.Union[TimeContext, None] = None
+                        ) -> T.Union[Forecast, None]:
+        """
+        Returns the 48 hours weather forecast if wetter.at published a new
+        one since the last update. Otherwise None is returned and the
+        update is counted as unchanged. A forecast which is identical to the
+        last one is counted as unchanged too.
+        The first call returns the forecast of the location check without a
+        new request, if it is still cached.
+
+        :param time_context: shared by the updates of a batch
+        :return:
+        """
+        if not self._validated:
+            data = self.validate(time_context=time_context)
+        else:
+            data = self.first_forecast
+            if data is None:
+                data = self._get_data(conditional=True,
+                                      time_context=time_context)
+        self._first_forecast = None
+
+        if data is None or data == self._last_update:
+            self._unchanged += 1
+            return None
+
+        self._last_update = data
+        return data
+
+    def weather_forecast(self, fresh: bool = False) -> Forecast:
+        """
+        Returns the 48 hours weather forecast. A cached forecast is
+        returned unless fresh is set.
+
+        :param fresh:
+        :return:
+        """
+        if not self._validated:
+            return self.validate()
+
+        if not fresh:
+            data = self._cache.get(self._cache_key)
+            if data is not None:
+                return data
+
         return self._get_data()
 
-    def current_weather(self) -> T.Tuple[int, int, float, int]:
+    def current_weather(self,
+                        fresh: bool = False) -> T.Tuple[int, int, float, int]:
         """
         Returns a tuple with the current weather data.
+        :param fresh:
         :return:
         """
-        data = self.weather_forecast()
+        data = self.weather_forecast(fresh=fresh)
         t = data['temperature'][0]
         c = data['cloudiness'][0]
         p = data['rain'][0]
         w = data['wind_velocity'][0]
         return t, c, p, w
 
-    def current_temperature(self) -> int:
+    def current_temperature(self, fresh: bool = False) -> int:
         """
         Returns the current temperature based on the 48 hours forecast.
+        :param fresh:
         :return:
         """
-        t = self.weather_forecast()['temperature']
+        t = self.weather_forecast(fresh=fresh)['temperature']
         return t[0]
 
-    def current_cloudiness(self) -> int:
+    def current_cloudiness(self, fresh: bool = False) -> int:
         """
         Returns the current cloudiness based on the 48 hours forecast.
+        :param fresh:
         :return:
         """
-        c = self.weather_forecast()['cloudiness']
+        c = self.weather_forecast(fresh=fresh)['cloudiness']
         return c[0]
 
-    def current_rain(self) -> float:
+    def current_rain(self, fresh: bool = False) -> float:
         """
         Returns the current precipitation based on the 48 hours forecast.
+        :param fresh:
         :return:
         """
-        p = self.weather_forecast()['rain']
+        p = self.weather_forecast(fresh=fresh)['rain']
         return float(p[0])
 
-    def current_wind_velocity(self) -> int:
+    def current_wind_velocity(self, fresh: bool = False) -> int:
         """
         Returns the current wind velocity based on the 48 hours forecast.
+        :param fresh:
         :return:
         """
-        w = self.weather_forecast()['wind_velocity']
+        w = self.weather_forecast(fresh=fresh)['wind_velocity']
         return w[0]
 
     def print_weather(self, pretty_print=True) -> None:
@@ -523,7 +1336,7 @@ class WeatherEgg:
             print_format = '{datetime},{temp},{cloudiness},' \
                            '{rain},{wind}'
 
-        data = self._get_data()
+        data = self.weather_forecast()
         print(print_format.format(
             datetime='timestamp',
             temp='         temperature [°C]',
@@ -531,7 +1344,7 @@ class WeatherEgg:
             rain='rain [%]',
             wind='wind velocity [km/h]'
         ))
-        time = [t.strftime(TIMESTAMP_FORMAT) for t in data['timestamp']]
+        time = format_timestamps(data['timestamp'], TIMESTAMP_FORMAT)
         for d, t, c, r, w in zip(time,
                                  data['temperature'],
                                  data['cloudiness'],
@@ -545,10 +1358,49 @@ class WeatherEgg:
                 wind=str(w)
             ))
 
-    def run_forever(self) -> None:
+    def save(self, data: T.Mapping) -> None:
         """
-        This method runs the weatheregg.
+        Saves the data to the current_weather file and to the
+        weather_back_log directory.
 
+        :param data:
+        :return:
+        """
+        if self._data_dir is None:
+            msg = 'Please provide a data directory for Weatheregg.'
+            raise ValueError(msg)
+
+        # the store is kept, so its index is not read again every update.
+        if self._store is None:
+            self._store = create_store(
+                path.join(self._data_dir, DATA_DIR_NAME), self._backlog
+            )
+
+        save(data, dir_path=self._data_dir, backlog=self._backlog,
+             fsync=self._fsync, compression=self._compression,
+             store=self._store)
+
+    def run_forever(self,
+                    offset: float = 0.,
+                    jitter: float = 0.,
+                    scheduler: T.Union[Scheduler, None] = None,
+                    retry_policy: T.Union[RetryPolicy, None] = None,
+                    metrics_file: T.Union[str, PurePath, None] = None
+                    ) -> None:
+        """
+        This method runs the weatheregg. The forecast is updated right away
+        and then in every interval, aligned to the wall clock, until the
+        process receives SIGINT or SIGTERM. Failed updates are retried
+        according to the retry policy.
+
+        :param offset: minutes after the aligned times, e. g. 5 updates 5
+            minutes after every full hour
+        :param jitter: maximum random delay of an update in minutes
+        :param scheduler:
+        :param retry_policy: defaults to the policy which is shared by all
+            recorders of the process, see weatheregg.retry.default_policy
+        :param metrics_file: the metrics are written to this file in the
+            Prometheus text format after every update
         :return:
         """
 
@@ -559,51 +1411,83 @@ class WeatherEgg:
         makedirs(self._data_dir, exist_ok=True)
 
         logging_file_path = str(path.join(self._data_dir, 'weatheregg.log'))
+        logger = logging.LoggerAdapter(create_logger(logging_file_path),
+                                       {'location': self.url})
+
+        if scheduler is None:
+            scheduler = Scheduler()
+        if retry_policy is None:
+            retry_policy = default_policy(self.RETRY_INTERVAL)
 
-        logger = logging.getLogger('weatheregg_logger')
-        logger.setLevel(logging.DEBUG)
-        fh = logging.FileHandler(logging_file_path)
-        fh.setLevel(logging.INFO)
-        ch = logging.StreamHandler()
-        ch.setLevel(logging.INFO)
-        # create formatter and add it to the handlers
-        formatter = logging.Formatter(
-            '[%(levelname)s] - %(asctime)s - %(message)s')
-        fh.setFormatter(formatter)
-        ch.setFormatter(formatter)
-        # add the handlers to the logger
-        logger.addHandler(fh)
-        logger.addHandler(ch)
-
-        retry = False
-
-        while True:
+        def update() -> T.Union[float, None]:
             try:
-                logger.info('Load data from {}.'.format(self.url))
-                data = self._get_data()
+                return record()
+            finally:
+                if metrics_file is not None:
+                    try:
+                        write_textfile(metrics_file)
+                    except OSError as error:
+                        logger.exception(error)
+
+        def record() -> T.Union[float, None]:
+            if not retry_policy.allow(self.url):
+                logger.info('The requests to wetter.at failed too often. '
+                            'Skip this update.')
+                record_update(self.url, REJECTED, scheduler.clock.time())
+                return None
+
+            try:
+                logger.info('Load data from %s.', self.url)
+                data = self.update_forecast()
 
             except WeathereggException as fatal_error:
                 logger.exception(fatal_error)
+                record_update(self.url, FAILED, scheduler.clock.time(),
+                              job.last_drift)
                 sys.exit(1)
 
             except Exception as error:
                 logger.exception(error)
-                retry = True
-
+                now = scheduler.clock.time()
+                record_update(self.url, FAILED, now, job.last_drift)
+                retry_at = retry_policy.failure(self.url)
+                # a retry after the next regular update is pointless.
+                if retry_at is None or retry_at >= job.next_boundary(now):
+                    logger.info('Last request failed. Retry with the next '
+                                'update.')
+                    return None
+
+                logger.info('Last request failed. Retry in %.0f seconds',
+                            retry_at - now)
+                return retry_at
+
+            retry_policy.success(self.url)
+            now = scheduler.clock.time()
+
+            if data is None:
+                logger.info('Forecast unchanged (%d times). Skip saving.',
+                            self._unchanged)
+                record_update(self.url, UNCHANGED, now, job.last_drift)
             else:
-                logger.info('Save weather data to {}.'.format(self._data_dir))
+                logger.info('Save weather data to %s.', self._data_dir)
                 try:
-                    save(data, dir_path=self._data_dir)
+                    self.save(data)
                 except Exception as error:
                     logger.exception(error)
+                    record_update(self.url, FAILED, now, job.last_drift)
                     sys.exit(1)
+                record_update(self.url, SAVED, now, job.last_drift)
 
-            if retry:
-                logger.info('Last request failed. Retry in {} '
-                            'seconds'.format(self.RETRY_INTERVAL))
-                time.sleep(self.RETRY_INTERVAL)
-                retry = False
-            else:
-                logger.info('Success. Next update in {} minutes.'.format(
-                    self._interval))
-                time.sleep(self._interval * 60)
\ No newline at end of file
+            logger.info('Success. Next update in %s minutes at the latest.',
+                        self._interval)
+            return None
+
+        job = scheduler.add(update, self._interval * 60,
+                            offset=offset * 60, jitter=jitter * 60,
+                            immediately=True, name=self.url)
+
+        with scheduler.handle_signals():
+            scheduler.run()
+
+        logger.info('Stopped after %d updates. Mean delay %.1f seconds.',
+                    job.runs, job.mean_drift)